@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import json
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+from custom_converters.org_parse_converter import OrgParseConverter
+from custom_converters.person_parse_input_converter import PersonParseInputConverter
+from map_elites import MAPElites
+from model_caller.async_cache import AsyncCache
+from model_caller.call_scheduler import CallScheduler
+from model_caller.fake_caller import FakeModelCaller
+from model_caller.model_caller import ModelCaller
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+from solution_generator.solution_generator import GenerateSolution
+
+
+benchmark_problem_definition = """
+Parse each organisation name into its top level brand, lower level brand, legal suffixes, locations and organisation type.
+Return JSON with a NameParses list containing one object per input name, keeping the Id of each input.
+"""
+
+benchmark_categories = [
+    "Specification Detail: Simple\nConciseness: Short",
+    "Specification Detail: Medium\nConciseness: Medium",
+    "Specification Detail: Extremely Detailed\nConciseness: Long",
+    "Target Audience: Machine-Oriented\nConciseness: Short",
+]
+
+
+async def run_benchmark(args) -> dict:
+    """Runs initialisation and full MAP-Elites rounds against the fake model and measures them."""
+    # A fresh in-memory cache, so every benchmark run makes the same model calls
+    ModelCaller.set_cache(AsyncCache())
+    ModelCaller.call_counters.update({counter: 0 for counter in ModelCaller.call_counters})
+    ModelCaller.context_caching = args.context_caching
+    # The training split and the search's choices of parents and spaces use the global random generator
+    random.seed(args.seed)
+
+    # Scheduler pauses after rate limit errors are scaled with the simulated latencies
+    scheduler = CallScheduler(max_concurrency=args.max_concurrency, priority_handicap_seconds=30 * args.time_scale, rate_limit_pause_seconds=5 * args.time_scale)
+    model_caller = FakeModelCaller(scheduler, latency_seconds=args.latency_seconds,
+                                   error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, time_scale=args.time_scale, seed=args.seed)
+    names = FakeModelCaller.generate_org_names(args.num_examples, args.seed)
+    output_converter = OrgParseConverter()
+    expected_outputs = [output_converter.convert_single_parse(FakeModelCaller.get_name_parse(name)) for name in names]
+    prompt_tester = PromptTesterObjectSimilarity(model_caller, names, expected_outputs, Evaluator(["Id", "TransliteratedName"], {}),
+                                                 output_converter, PersonParseInputConverter(), train_split=args.num_examples)
+    map_elites_runner = MAPElites(GenerateSolution(model_caller, benchmark_problem_definition), prompt_tester, benchmark_categories, args.min_spaces)
+
+    tracemalloc.start()
+    start_time = time.monotonic()
+    await map_elites_runner.initialise_solutions(benchmark_problem_definition, args.min_spaces)
+    initialisation_seconds = time.monotonic() - start_time
+
+    rounds = []
+    for _ in range(args.rounds):
+        calls_before = dict(model_caller.call_counts)
+        evaluated_before = prompt_tester.score_store.misses
+        round_start_time = time.monotonic()
+        await map_elites_runner.run_mutation_and_replacement()
+        round_seconds = time.monotonic() - round_start_time
+        calls = {kind: model_caller.call_counts[kind] - calls_before[kind] for kind in calls_before}
+        candidates_evaluated = prompt_tester.score_store.misses - evaluated_before
+        rounds.append({
+            "seconds": round_seconds,
+            "candidates_evaluated": candidates_evaluated,
+            "candidates_per_minute": 60 * candidates_evaluated / round_seconds if round_seconds > 0 else 0.0,
+            "calls": calls,
+        })
+
+    _, peak_traced_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    map_elites_runner.close()
+
+    total_round_seconds = sum(round_result["seconds"] for round_result in rounds)
+    total_candidates = sum(round_result["candidates_evaluated"] for round_result in rounds)
+    return {
+        "initialisation_seconds": initialisation_seconds,
+        "rounds": rounds,
+        "candidates_per_minute": 60 * total_candidates / total_round_seconds if total_round_seconds > 0 else 0.0,
+        "model_calls_per_round": sum(sum(round_result["calls"][kind] for kind in ["evaluation", "classification", "generation", "embedding"]) for round_result in rounds) / max(1, len(rounds)),
+        "best_score": max(map_elites_runner.best_score_per_space.values(), default=0.0),
+        "peak_traced_memory_mb": peak_traced_bytes / 2 ** 20,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "call_counters": ModelCaller.get_call_counters(),
+        "context_cache_stats": model_caller.context_cache_stats,
+    }
+
+
+def compare_to_baseline(results: dict, baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path, "r") as f:
+        baseline = json.load(f)
+    regressions = []
+    if results["candidates_per_minute"] < baseline["candidates_per_minute"] * (1 - tolerance):
+        regressions.append(f"candidates per minute fell from {baseline['candidates_per_minute']:.1f} to {results['candidates_per_minute']:.1f}")
+    if results["model_calls_per_round"] > baseline["model_calls_per_round"] * (1 + tolerance):
+        regressions.append(f"model calls per round rose from {baseline['model_calls_per_round']:.1f} to {results['model_calls_per_round']:.1f}")
+    if results["peak_traced_memory_mb"] > baseline["peak_traced_memory_mb"] * (1 + tolerance):
+        regressions.append(f"peak memory rose from {baseline['peak_traced_memory_mb']:.1f}MB to {results['peak_traced_memory_mb']:.1f}MB")
+    return regressions
+
+
+def parse_args_and_run_benchmark():
+    parser = argparse.ArgumentParser(description="Benchmark MAP-Elites rounds against a local fake model.")
+    parser.add_argument("-n", "--rounds", type=int, help="Number of MAP-Elites rounds to measure", default=2)
+    parser.add_argument("--num_examples", type=int, help="Number of generated training examples", default=200)
+    parser.add_argument("--min_spaces", type=int, help="Minimum number of search spaces which should have solutions", default=3)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum number of concurrent fake model calls", default=32)
+    parser.add_argument("--latency_seconds", type=float, help="Median latency of a fake model call before scaling", default=0.5)
+    parser.add_argument("--time_scale", type=float, help="Multiplier applied to every simulated delay", default=0.02)
+    parser.add_argument("--error_rate", type=float, help="Fraction of fake calls which fail with a server error", default=0.0)
+    parser.add_argument("--rate_limit_rate", type=float, help="Fraction of fake calls which fail with a rate limit error", default=0.0)
+    parser.add_argument("--context_caching", action="store_true", help="Cache candidate prompts in the fake model's context cache and count the prompt tokens saved")
+    parser.add_argument("--seed", type=int, help="Seed for the generated data and the fake model's latency and failures", default=0)
+    parser.add_argument("--output", type=str, help="Write the results as JSON to this file, e.g. to use as a baseline", default=None)
+    parser.add_argument("--baseline", type=str, help="Results file of an earlier run to compare against, exits with an error on regressions", default=None)
+    parser.add_argument("--tolerance", type=float, help="Allowed relative change against the baseline before it counts as a regression", default=0.2)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+
+    for i, round_result in enumerate(results["rounds"]):
+        print(f"Round {i + 1}: {round_result['candidates_evaluated']} candidates in {round_result['seconds']:.2f}s "
+              f"({round_result['candidates_per_minute']:.1f}/min), calls: {round_result['calls']}")
+    print(f"Candidates evaluated per minute: {results['candidates_per_minute']:.1f}")
+    print(f"Model calls per round: {results['model_calls_per_round']:.1f}")
+    print(f"Peak traced memory: {results['peak_traced_memory_mb']:.1f}MB, peak RSS: {results['peak_rss_mb']:.1f}MB")
+    print(f"Best score: {results['best_score']:.4f}")
+    if args.context_caching:
+        context_cache_stats = results["context_cache_stats"]
+        print(f"Context caches: {context_cache_stats['created']} created, {context_cache_stats['deleted']} deleted, "
+              f"{context_cache_stats['prefix_tokens_saved']} prompt tokens read from cache over {context_cache_stats['calls']} calls")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    parse_args_and_run_benchmark()
@@ -5,4 +5,5 @@ from custom_converters.converter import Converter
 
 class PersonParseInputConverter(Converter):
     def convert(self, name: str) -> dict:
-        return {"Id":str(uuid.uuid4()), "PresentedName": name}
\ No newline at end of file
+        # Derive the Id from the name so the same input always produces the same model prompt
+        return {"Id":str(uuid.uuid5(uuid.NAMESPACE_OID, name)), "PresentedName": name}
@@ -1,5 +1,8 @@
 import asyncio
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from rich.console import Console
 from rich.progress import Progress, TimeElapsedColumn, TaskProgressColumn, MofNCompleteColumn
@@ -8,13 +11,20 @@ import itertools
 import random
 import numpy as np
 
+from map_elites_checkpoint import MAPElitesCheckpoint
+from run_budget import RunBudget
 from prompt_testing.prompt_tester import PromptTester
+from prompt_testing.near_duplicate_index import NearDuplicateIndex
+from prompt_testing.surrogate_ranker import SurrogateRanker
+from solution_generator.search_space_classifier import EmbeddingSearchSpaceClassifier
 from solution_generator.solution_generator import GenerateSolution
+from telemetry import telemetry
 
 
 class MAPElites:
-    def __init__(self, solution_generator: GenerateSolution, prompt_tester: PromptTester, search_space_definitions: list[str], min_spaces_with_solutions=5, num_crossovers=3):
+    def __init__(self, solution_generator: GenerateSolution, prompt_tester: PromptTester, search_space_definitions: list[str], min_spaces_with_solutions=5, num_crossovers=3, search_space_classifier: EmbeddingSearchSpaceClassifier | None = None, checkpoint: MAPElitesCheckpoint | None = None, budget: RunBudget | None = None, surrogate: SurrogateRanker | None = None, near_duplicate_index: NearDuplicateIndex | None = None):
         self.solution_generator = solution_generator
+        self.search_space_classifier = search_space_classifier
         self.prompt_tester = prompt_tester
         self.search_space_definitions = search_space_definitions
         self.best_solution_per_space = {}
@@ -28,6 +38,118 @@ class MAPElites:
         self.previous_best_field_scores = {}
         self.num_crossovers = min(num_crossovers, len(self.best_score_per_space))
         self.console = Console()
+        self.checkpoint = checkpoint
+        self.budget = budget
+        # Screens generated candidates so only those predicted to score well are fully evaluated
+        self.surrogate = surrogate
+        # Drops candidates which are near duplicates of prompts already evaluated, before the surrogate sees them
+        self.near_duplicate_index = near_duplicate_index
+        self.rounds_completed = 0
+        self.candidates_completed = 0
+        # Prompt files and checkpoints are written in order on one background thread, so they never hold up the search
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.checkpoint_lock = threading.Lock()
+        self.pending_checkpoint_state = None
+        self.pending_checkpoint_scores = {}
+        self.checkpoint_scheduled = False
+        score_store = getattr(self.prompt_tester, "score_store", None)
+        if checkpoint is not None and score_store is not None:
+            # Scores are appended to the checkpoint's journal as they are set, rather than copied into every checkpoint
+            score_store.unsaved = {}
+
+    def get_state(self) -> dict:
+        """Snapshot of everything needed to continue the run, taken between awaits so it is consistent."""
+        return {
+            "search_space_definitions": self.search_space_definitions,
+            "best_solution_per_space": {space: list(solutions) for space, solutions in self.best_solution_per_space.items()},
+            "best_score_per_space": dict(self.best_score_per_space),
+            "best_field_score_per_space": dict(self.best_field_score_per_space),
+            "worst_example_by_field": dict(self.worst_example_by_field),
+            "initial_prompt_score": self.initial_prompt_score,
+            "initial_prompt_score_per_space": self.initial_prompt_score_per_space,
+            "previous_best_score_per_space": dict(self.previous_best_score_per_space),
+            "previous_best_field_scores": dict(self.previous_best_field_scores),
+            "rounds_completed": self.rounds_completed,
+            "candidates_completed": self.candidates_completed,
+            "random_state": random.getstate(),
+            "active_example_indices": getattr(self.prompt_tester, "active_example_indices", None),
+            "budget": self.budget.get_state() if self.budget is not None else None,
+        }
+
+    def load_state(self, state: dict):
+        if state["search_space_definitions"] != self.search_space_definitions:
+            print("Search spaces differ from the checkpoint, continuing with the search spaces of the checkpoint")
+            self.search_space_definitions = state["search_space_definitions"]
+        self.best_solution_per_space = state["best_solution_per_space"]
+        self.best_score_per_space = state["best_score_per_space"]
+        self.best_field_score_per_space = state["best_field_score_per_space"]
+        self.worst_example_by_field = state["worst_example_by_field"]
+        self.initial_prompt_score = state["initial_prompt_score"]
+        self.initial_prompt_score_per_space = state["initial_prompt_score_per_space"]
+        self.previous_best_score_per_space = state["previous_best_score_per_space"]
+        self.previous_best_field_scores = state["previous_best_field_scores"]
+        self.rounds_completed = state["rounds_completed"]
+        self.candidates_completed = state["candidates_completed"]
+        random.setstate(MAPElitesCheckpoint.to_random_state(state["random_state"]))
+        # A resumed run keeps the usage it spent before, so its limits cover the whole run
+        if self.budget is not None and state.get("budget") is not None:
+            self.budget.load_state(state["budget"])
+
+        score_store = getattr(self.prompt_tester, "score_store", None)
+        if score_store is not None:
+            score_store.scores.update({key: tuple(score) for key, score in state["scores"].items()})
+        # Elite scores are only comparable with new ones on the examples they were scored on
+        if state.get("active_example_indices") is not None:
+            self.prompt_tester.set_active_examples(state["active_example_indices"])
+
+    def save_checkpoint(self):
+        if self.checkpoint is None:
+            return
+        with self.checkpoint_lock:
+            # Only the latest state is written if several saves are requested while one is being written
+            self.pending_checkpoint_state = self.get_state()
+            score_store = getattr(self.prompt_tester, "score_store", None)
+            if score_store is not None:
+                # Scores accumulate across saves which are skipped, so none is missing from the journal
+                self.pending_checkpoint_scores.update(score_store.take_unsaved())
+            if self.checkpoint_scheduled:
+                return
+            self.checkpoint_scheduled = True
+        self.writer.submit(self.write_pending_checkpoint)
+
+    def write_pending_checkpoint(self):
+        with self.checkpoint_lock:
+            state = self.pending_checkpoint_state
+            scores = self.pending_checkpoint_scores
+            self.pending_checkpoint_state = None
+            self.pending_checkpoint_scores = {}
+            self.checkpoint_scheduled = False
+        try:
+            self.checkpoint.save(state, scores)
+        except Exception as e:
+            print(f"Could not save checkpoint: {e}")
+            with self.checkpoint_lock:
+                # Scores which may not have reached the journal are written with the next checkpoint
+                self.pending_checkpoint_scores = {**scores, **self.pending_checkpoint_scores}
+
+    def write_prompt_file(self, path: str, text: str):
+        def write():
+            try:
+                with open(path, "w") as f:
+                    f.write(text)
+            except Exception as e:
+                print(f"Could not write {path}: {e}")
+        self.writer.submit(write)
+
+    def save_example_results(self):
+        example_store = getattr(self.prompt_tester, "example_store", None)
+        if example_store is not None:
+            self.writer.submit(example_store.write_shard, example_store.take_unsaved())
+
+    def close(self):
+        """Waits for pending prompt files, checkpoints and example results to be written."""
+        self.save_example_results()
+        self.writer.shutdown(wait=True)
 
     async def initialise_solutions(self, base_solution, num_solutions=5):
         with Progress(*Progress.get_default_columns(),
@@ -39,6 +161,7 @@ class MAPElites:
             progress.update(task, advance=1)
         self.initial_prompt_score = initial_scores[0]
         self.initial_prompt_score_per_space = initial_scores[1]
+        await self.expire_context_caches([base_solution])
 
         async def generate_solution(space, progress, task):
             solution = await self.solution_generator.generate_solution_for_search_space(space)
@@ -54,12 +177,67 @@ class MAPElites:
             initial_solutions = await asyncio.gather(*solution_tasks)
 
         await self.evaluate_and_update_solutions(list(itertools.chain.from_iterable(initial_solutions)))
+        self.save_checkpoint()
+        self.record_round("initialisation")
 
     async def run_mutation_and_replacement(self):
-        mutated_solutions = await self.mutate_solutions()
-        crossover_solutions = await self.crossover_solutions()
-            
-        await self.evaluate_and_update_solutions(mutated_solutions+crossover_solutions+ list(itertools.chain.from_iterable(self.best_solution_per_space.values())))
+        with telemetry.time("round"):
+            await self.update_evaluation_set()
+            mutated_solutions = await self.mutate_solutions()
+            crossover_solutions = await self.crossover_solutions()
+
+            candidates = self.screen_candidates(mutated_solutions + crossover_solutions)
+            await self.evaluate_and_update_solutions(candidates + list(itertools.chain.from_iterable(self.best_solution_per_space.values())))
+        self.rounds_completed += 1
+        self.save_checkpoint()
+        self.record_round(f"round {self.rounds_completed}")
+
+    async def update_evaluation_set(self):
+        """Lets the tester move to a different set of training examples, then scores the elites again on it."""
+        if getattr(self.prompt_tester, "evaluation_subset", None) is None:
+            return
+        elites = list(dict.fromkeys(itertools.chain.from_iterable(self.best_solution_per_space.values())))
+        with Progress(*Progress.get_default_columns(),
+                      TimeElapsedColumn(),
+                      MofNCompleteColumn()
+                      ) as progress:
+            if not await self.prompt_tester.update_evaluation_subset(elites, progress):
+                return
+            task = progress.add_task("[yellow]Scoring elites on the new evaluation set...", total=len(self.best_solution_per_space))
+
+            async def rescore(space):
+                space_elites = self.best_solution_per_space[space]
+                scores_data = await self.prompt_tester.get_scores_for_solutions(space_elites, progress, self.search_space_definitions.index(space))
+                progress.update(task, advance=1)
+                return space_elites, scores_data
+
+            spaces = list(self.best_solution_per_space)
+            results = await asyncio.gather(*[rescore(space) for space in spaces])
+
+        # The archive is rebuilt from the new scores, a space whose elites could not be scored again keeps its previous score
+        previous_best_score_per_space = self.best_score_per_space
+        self.best_score_per_space = {}
+        for space, (space_elites, scores_data) in zip(spaces, results):
+            if not self.update_archive(space, space_elites, scores_data):
+                self.best_score_per_space[space] = previous_best_score_per_space[space]
+        self.previous_best_score_per_space = {}
+        if self.budget is not None:
+            # Archive scores before and after the change are not comparable, so the plateau is measured from here
+            self.budget.reset_plateau()
+        await self.expire_context_caches(elites)
+
+    def record_round(self, label: str):
+        telemetry.end_round(label)
+        self.save_example_results()
+        if self.budget is not None:
+            self.budget.record_round(self.best_score_per_space)
+
+    def get_stop_reason(self) -> str | None:
+        """Why the run should stop before its next round or candidate, None while it is within its budget."""
+        return self.budget.get_stop_reason() if self.budget is not None else None
+
+    def get_fan_out(self, full_fan_out: int) -> int:
+        return self.budget.get_fan_out(full_fan_out) if self.budget is not None else full_fan_out
 
     async def evaluate_and_update_solutions(self, solutions):
         search_spaces_of_solutions = await self.get_search_space_of_solutions(solutions)
@@ -67,20 +245,44 @@ class MAPElites:
         solutions = await self.generate_extra_solutions(search_spaces_of_solutions, solutions)
 
         await self.evaluate_solutions(solutions, search_spaces_of_solutions)
-
-    async def get_search_space_of_solutions(self, solutions):
+        self.observe_solutions(solutions)
+
+    def screen_candidates(self, candidates: list[str]) -> list[str]:
+        if self.near_duplicate_index is not None:
+            candidates = self.near_duplicate_index.filter(candidates, getattr(self.prompt_tester, "score_store", None))
+        return self.surrogate.select(candidates) if self.surrogate is not None else candidates
+
+    def observe_solutions(self, solutions: list[str]):
+        """Indexes evaluated solutions, trains the surrogate on their full scores and records whether screened ones entered the archive."""
+        if self.near_duplicate_index is not None:
+            for solution in solutions:
+                self.near_duplicate_index.add(solution)
+        if self.surrogate is None:
+            return
+        archive = set(itertools.chain.from_iterable(self.best_solution_per_space.values()))
+        score_store = getattr(self.prompt_tester, "score_store", None)
+        for solution in dict.fromkeys(solutions):
+            score = score_store.peek(solution) if score_store is not None else None
+            self.surrogate.observe(solution, score[0] if score is not None else None, solution in archive)
+
+    async def get_search_space_of_solutions(self, solutions, description="Determining search spaces..."):
 
         with (Progress(*Progress.get_default_columns(),
                        TimeElapsedColumn(),
                        MofNCompleteColumn()
                        )
               as progress):
-            task = progress.add_task("[magenta]Determining search spaces...", total=len(solutions))
-            search_spaces_of_solutions = await asyncio.gather(
-                *[self.get_search_space(solution, progress, task) for solution in solutions]
-            )
+            task = progress.add_task(f"[magenta]{description}", total=len(solutions))
+            search_spaces_of_solutions = await self.classify_solutions(solutions, progress, task)
         return search_spaces_of_solutions
 
+    async def classify_solutions(self, solutions, progress, task):
+        if self.search_space_classifier is not None:
+            search_spaces_of_solutions = await self.search_space_classifier.classify(solutions)
+            progress.update(task, advance=len(solutions))
+            return search_spaces_of_solutions
+        return await asyncio.gather(*[self.get_search_space(solution, progress, task) for solution in solutions])
+
     async def get_search_space(self, solution, progress, task):
         space = await self.solution_generator.get_search_space_of_solution(self.search_space_definitions, solution)
         progress.update(task, advance=1)
@@ -90,11 +292,13 @@ class MAPElites:
         async def get_scores(search_spaces_of_solutions, space, p, t, j):
             indices_of_solutions_in_space = [i for i in range(len(search_spaces_of_solutions)) if search_spaces_of_solutions[i] == space]
             se = [solutions[i] for i in indices_of_solutions_in_space] + (self.best_solution_per_space.get(space, []))
+            # Incumbents are passed in alongside new candidates, so only keep the first copy of each prompt
+            se = list(dict.fromkeys(se))
 
             if len(se) == 0:
                 return [], se
 
-            score_task = asyncio.create_task(self.prompt_tester.get_scores_for_solutions(se, p, j))
+            score_task = asyncio.create_task(self.prompt_tester.get_scores_for_solutions(se, p, j, self.best_score_per_space.get(space)))
 
             sd = await score_task
 
@@ -111,49 +315,53 @@ class MAPElites:
             results = await asyncio.gather(*tasks)
 
             for (scores_data, solutions_to_evaluate), space in zip(results, self.search_space_definitions):
-                if scores_data is None:
-                    continue
-                scores = [data[0] for data in scores_data]
-                scores_by_field = [data[1] for data in scores_data]
-                examples_by_field = [data[2] for data in scores_data]
-
-                if scores:
-                    sorted_indexes = np.argsort(scores)
-                    best_index = sorted_indexes[-1]
-                    if space not in self.best_score_per_space or scores[best_index] > self.best_score_per_space[space]:
-                        self.best_solution_per_space[space] = [solutions_to_evaluate[best_index]]
-                        self.best_score_per_space[space] = scores[best_index]
-                        if len(scores) > 1 and (scores[sorted_indexes[-1]] - scores[sorted_indexes[-2]] < 0.01):
-                            self.best_solution_per_space[space].append(solutions_to_evaluate[sorted_indexes[-2]])
-                    
-                        self.best_field_score_per_space[space] = scores_by_field[best_index]
-                        self.worst_example_by_field[space] = examples_by_field[best_index]
+                self.update_archive(space, solutions_to_evaluate, scores_data)
+
+        await self.expire_context_caches(list(itertools.chain.from_iterable(solutions_to_evaluate for _, solutions_to_evaluate in results)))
+
+    def update_archive(self, space, solutions_to_evaluate, scores_data) -> bool:
+        """Makes the best evaluated solution the elite of its search space if it beats the current elite."""
+        if scores_data is None:
+            return False
+        scores = [data[0] for data in scores_data]
+        scores_by_field = [data[1] for data in scores_data]
+        examples_by_field = [data[2] for data in scores_data]
+
+        if scores:
+            sorted_indexes = np.argsort(scores)
+            best_index = sorted_indexes[-1]
+            if space not in self.best_score_per_space or scores[best_index] > self.best_score_per_space[space]:
+                self.best_solution_per_space[space] = [solutions_to_evaluate[best_index]]
+                self.best_score_per_space[space] = scores[best_index]
+                if len(scores) > 1 and (scores[sorted_indexes[-1]] - scores[sorted_indexes[-2]] < 0.01):
+                    self.best_solution_per_space[space].append(solutions_to_evaluate[sorted_indexes[-2]])
+
+                self.best_field_score_per_space[space] = scores_by_field[best_index]
+                self.worst_example_by_field[space] = examples_by_field[best_index]
+                return True
+        return False
 
     async def generate_extra_solutions(self, search_spaces_of_solutions, solutions):
         search_spaces_to_generate_for = random.choices(self.search_space_definitions, k=(
                                                                     max(0, self.min_spaces_with_solutions - len(set(search_spaces_of_solutions))) + 2
         )
                                                        )
-        new_sols = []
+        async def generate_solution(space, progress, task):
+            solution = await self.solution_generator.generate_solution_for_search_space(space)
+            progress.update(task, advance=1)
+            return solution
+
         with Progress(*Progress.get_default_columns(),
                       TimeElapsedColumn(),
                       MofNCompleteColumn()
                       ) as progress:
             sol = progress.add_task(f"[magenta]Generating solution for empty search spaces...",
                                     total=len(search_spaces_to_generate_for))
-            for space in search_spaces_to_generate_for:
-                new_sols += await self.solution_generator.generate_solution_for_search_space(space)
-                progress.update(sol, advance=1)
+            new_sols = await asyncio.gather(*[generate_solution(space, progress, sol) for space in search_spaces_to_generate_for])
+        new_sols = list(itertools.chain.from_iterable(new_sols))
         solutions += new_sols
         
-        with Progress(*Progress.get_default_columns(),
-                      TimeElapsedColumn(),
-                      MofNCompleteColumn()
-                      ) as progress:
-            task = progress.add_task("[magenta]Determining search spaces for new solutions...", total=len(new_sols))
-            search_spaces_of_solutions += await asyncio.gather(
-                *[self.get_search_space(solution, progress, task) for solution in new_sols]
-            )
+        search_spaces_of_solutions += await self.get_search_space_of_solutions(new_sols, "Determining search spaces for new solutions...")
         return solutions
 
     async def mutate_solutions(self) -> list[str]:
@@ -161,16 +369,23 @@ class MAPElites:
             return await self.solution_generator.mutate_solution(solution, bad_example)
 
         solutions_to_mutate = list(itertools.chain.from_iterable(self.best_solution_per_space.values()))
+        # Fewer elites are mutated as the budget runs low
+        fan_out = self.get_fan_out(len(solutions_to_mutate))
+        if fan_out < len(solutions_to_mutate):
+            solutions_to_mutate = random.sample(solutions_to_mutate, fan_out)
         with Progress(*Progress.get_default_columns(),
                       TimeElapsedColumn(),
                       MofNCompleteColumn()
                       )  as progress:
             task = progress.add_task("[green]Running mutations...", total=len(solutions_to_mutate))
-            mutations = await asyncio.gather(*[mutate(solution, random.choices(list(set([json.dumps(obj, indent=4) for obj in self.worst_example_by_field.values()])), k=5)) for solution in solutions_to_mutate])
+            mutations = await asyncio.gather(*[mutate(solution, self.get_worst_examples()) for solution in solutions_to_mutate])
             progress.update(task, advance=len(solutions_to_mutate))
 
         return list(itertools.chain.from_iterable(mutations))
 
+    def get_worst_examples(self, k=5) -> list[str]:
+        return random.choices(list(set([json.dumps(obj, indent=4) for obj in self.worst_example_by_field.values()])), k=k)
+
     async def crossover_solutions(self) -> list[str]:
         async def crossover(solution1,solution2):
             return await self.solution_generator.crossover_solutions(solution1, solution2)
@@ -181,13 +396,97 @@ class MAPElites:
                       MofNCompleteColumn()
                       )  as progress:
             task = progress.add_task("[green]Running crossover...", total=len(solutions_to_mutate))
-            mutations = await asyncio.gather(*[crossover(random.choice(solutions_to_mutate),random.choice(solutions_to_mutate)) for _ in range(self.num_crossovers)])
+            mutations = await asyncio.gather(*[crossover(random.choice(solutions_to_mutate),random.choice(solutions_to_mutate)) for _ in range(self.get_fan_out(self.num_crossovers))])
             progress.update(task, advance=len(solutions_to_mutate))
 
         return list(itertools.chain.from_iterable(mutations))
 
-    def output_current_status(self):
-        self.console.clear()
+    async def run_steady_state(self, num_candidates, max_in_flight=8, crossover_fraction=0.25):
+        """
+        Runs candidates through generation, classification, evaluation and insertion without generational barriers.
+        Each of `max_in_flight` workers starts its next candidate as soon as its previous one has been inserted,
+        so one slow call only holds up its own candidate.
+        """
+        # A resumed run continues from the candidates completed before the checkpoint
+        self.steady_state_stats = {"started": self.candidates_completed, "completed": self.candidates_completed, "evaluated": 0, "failed": 0, "start_time": time.monotonic()}
+        # Per-call progress bars of the tester are not shown, they would pile up over a long run
+        candidate_progress = Progress(disable=True)
+        candidate_task = candidate_progress.add_task("Classifying candidates...", total=None)
+
+        async def worker(worker_index, progress, task):
+            while self.steady_state_stats["started"] < num_candidates:
+                stop_reason = self.get_stop_reason()
+                if stop_reason is not None:
+                    self.steady_state_stats["stop_reason"] = stop_reason
+                    return
+                # Fewer candidates are kept in flight as the budget runs low
+                if worker_index >= self.get_fan_out(max_in_flight):
+                    return
+                self.steady_state_stats["started"] += 1
+                try:
+                    with telemetry.time("candidate"):
+                        await self.run_candidate(candidate_progress, candidate_task, crossover_fraction)
+                except Exception as e:
+                    print(f"Candidate failed: {e}")
+                    self.steady_state_stats["failed"] += 1
+                self.steady_state_stats["completed"] += 1
+                self.candidates_completed = self.steady_state_stats["completed"]
+                progress.update(task, advance=1)
+                if self.steady_state_stats["completed"] % max_in_flight == 0:
+                    # Steady state has no rounds, so a telemetry round is each group of max_in_flight candidates
+                    self.record_round(f"{self.steady_state_stats['completed']} candidates")
+                    # Printed above the live progress bar through the same console, clearing the screen would tear it
+                    self.output_current_status(clear_screen=False)
+
+        with Progress(*Progress.get_default_columns(),
+                      TimeElapsedColumn(),
+                      MofNCompleteColumn(),
+                      console=self.console
+                      ) as progress:
+            task = progress.add_task("[green]Running candidates...", total=num_candidates, completed=self.candidates_completed)
+            await asyncio.gather(*[worker(worker_index, progress, task) for worker_index in range(max_in_flight)])
+        if "stop_reason" in self.steady_state_stats:
+            print(f"Stopping early: {self.steady_state_stats['stop_reason']}")
+        self.save_checkpoint()
+
+    async def run_candidate(self, progress, task, crossover_fraction):
+        solutions = self.screen_candidates(await self.generate_candidate(crossover_fraction))
+        if not solutions:
+            return
+        search_spaces_of_solutions = await self.classify_solutions(solutions, progress, task)
+        await asyncio.gather(*[
+            self.evaluate_candidate(solution, space, progress)
+            for solution, space in zip(solutions, search_spaces_of_solutions) if space in self.search_space_definitions
+        ])
+        self.observe_solutions(solutions)
+
+    async def generate_candidate(self, crossover_fraction) -> list[str]:
+        elites = list(itertools.chain.from_iterable(self.best_solution_per_space.values()))
+        if len(elites) == 0 or len(self.best_solution_per_space) < self.min_spaces_with_solutions:
+            empty_spaces = [space for space in self.search_space_definitions if space not in self.best_solution_per_space]
+            return await self.solution_generator.generate_solution_for_search_space(random.choice(empty_spaces or self.search_space_definitions))
+        if len(elites) > 1 and random.random() < crossover_fraction:
+            return await self.solution_generator.crossover_solutions(random.choice(elites), random.choice(elites))
+        return await self.solution_generator.mutate_solution(random.choice(elites), self.get_worst_examples())
+
+    async def evaluate_candidate(self, solution, space, progress):
+        # The elites of the space are scored from the score store, so only the candidate costs model calls
+        solutions_to_evaluate = list(dict.fromkeys([solution] + self.best_solution_per_space.get(space, [])))
+        scores_data = await self.prompt_tester.get_scores_for_solutions(solutions_to_evaluate, progress, self.search_space_definitions.index(space), self.best_score_per_space.get(space))
+        # The archive may have changed while the candidate was evaluated, update_archive compares against the current elite
+        if self.update_archive(space, solutions_to_evaluate, scores_data):
+            self.save_checkpoint()
+        await self.expire_context_caches(solutions_to_evaluate)
+        self.steady_state_stats["evaluated"] += 1
+
+    async def expire_context_caches(self, solutions):
+        """Deletes the provider context caches of evaluated prompts which did not make it into the archive or dropped out of it."""
+        archive = set(itertools.chain.from_iterable(self.best_solution_per_space.values()))
+        await asyncio.gather(*[self.prompt_tester.model.release_context_cache(solution) for solution in set(solutions) - archive])
+
+    def output_current_status(self, clear_screen: bool = True):
+        if clear_screen:
+            self.console.clear()
 
         table = Table(title="MAP-Elites Status")
         table.add_column("Category", style="cyan")
@@ -212,8 +511,7 @@ class MAPElites:
                           f"[{diff_color}]{score_diff:+.4f}[/]",
                           f"[{prev_diff_color}]{prev_score_diff:+.4f}[/]")
 
-            with open(f"prompts/best_prompt_{category}.txt", "w") as f:
-                f.write(prompt[0])
+            self.write_prompt_file(f"prompts/best_prompt_{category}.txt", prompt[0])
 
         self.console.print(table)
 
@@ -246,24 +544,98 @@ class MAPElites:
 
         self.console.print(field_table)
 
-        with open("prompts/best_prompt.txt", "w") as f:
-            f.write(self.best_solution_per_space[best_solution_space][0])
+        call_counters = self.solution_generator.model_caller.get_call_counters()
+        self.console.print(f"Cached model requests: {call_counters['requests']} "
+                           f"(model calls: {call_counters['model_calls']}, "
+                           f"cache hits: {call_counters['cache_hits']}, "
+                           f"coalesced in flight: {call_counters['coalesced']})")
+
+        if self.search_space_classifier is not None:
+            classifier_stats = self.search_space_classifier.stats
+            self.console.print(f"Embedding classifier: {classifier_stats['classified']} prompts classified, "
+                               f"{classifier_stats['llm_fallbacks']} LLM fallbacks, {classifier_stats['embedded']} texts embedded")
+
+        score_store = getattr(self.prompt_tester, "score_store", None)
+        if score_store is not None:
+            self.console.print(f"Stored prompt scores: {len(score_store)} (reused {score_store.hits} times)")
+
+        parse_stats = getattr(self.prompt_tester, "parse_stats", None)
+        if parse_stats is not None and parse_stats["responses"] > 0:
+            self.console.print(f"Parsed responses: {parse_stats['responses']} ({parse_stats['failed_responses']} unparseable), "
+                               f"records: {parse_stats['records']} ({parse_stats['failed_records']} malformed)")
+
+        batch_planner = getattr(self.prompt_tester, "batch_planner", None)
+        if batch_planner is not None:
+            self.console.print(f"Batch plan: {len(self.prompt_tester.batch_plan.batch_payloads)} batches of up to {batch_planner.target_tokens} tokens "
+                               f"(shrunk {batch_planner.shrink_count} times)")
+            for line in batch_planner.get_report():
+                self.console.print(f"  {line}")
+
+        racing_stats = getattr(self.prompt_tester, "racing_stats", None)
+        if racing_stats is not None and racing_stats["batches_without_racing"] > 0:
+            self.console.print(f"Racing: dropped {racing_stats['dropped']}/{racing_stats['candidates']} candidates early, "
+                               f"evaluated {racing_stats['batches_evaluated']}/{racing_stats['batches_without_racing']} batches")
+
+        if self.solution_generator.model_caller.context_caching:
+            events = telemetry.get_snapshot()["events"]
+            self.console.print(f"Context caches: {events.get('context_caches_created', 0)} created, {events.get('context_caches_deleted', 0)} deleted, "
+                               f"{len(self.solution_generator.model_caller.context_cache_tasks)} held")
+
+        coordinator = getattr(self.prompt_tester, "coordinator", None)
+        if coordinator is not None:
+            self.console.print(f"Evaluation workers: {len(coordinator.worker_writers)} connected ({coordinator.stats['workers_connected']} in total), "
+                               f"{coordinator.stats['jobs']} batches sent, {coordinator.stats['retried']} retried, {coordinator.stats['failed']} failed")
+
+        if self.surrogate is not None:
+            snapshot = telemetry.get_snapshot()
+            events = snapshot["events"]
+            self.console.print(f"Surrogate: trained on {self.surrogate.num_observations} prompts, skipped {events.get('surrogate_skipped', 0)}/{events.get('surrogate_screened', 0)} candidates, "
+                               f"{snapshot['surrogate_precision']:.0%} of forwarded and {snapshot['surrogate_exploration_precision']:.0%} of explored candidates entered the archive")
+
+        evaluation_subset = getattr(self.prompt_tester, "evaluation_subset", None)
+        if evaluation_subset is not None:
+            active_examples = self.prompt_tester.active_example_indices
+            rank_correlation = evaluation_subset.stats["rank_correlation"]
+            self.console.print(f"Evaluation set: {len(active_examples) if active_examples is not None else len(self.prompt_tester.input_data)} of {len(self.prompt_tester.input_data)} examples"
+                               + (f", rank correlation with the full set {rank_correlation:.3f} over {len(evaluation_subset.example_results)} prompts" if rank_correlation is not None and active_examples is not None else "")
+                               + f", validated {evaluation_subset.stats['validations']} times")
+
+        if self.near_duplicate_index is not None:
+            stats = self.near_duplicate_index.stats
+            self.console.print(f"Near duplicates: {stats['skipped']} skipped and {stats['inherited']} given a known score of {stats['checked']} candidates, "
+                               f"{len(self.near_duplicate_index.prompts)} prompts indexed")
+
+        if self.budget is not None:
+            usage = self.budget.get_usage()
+            self.console.print(f"Budget: {usage['calls']} calls, {usage['tokens']} tokens, ${usage['cost_usd']:.4f}, {usage['wall_seconds'] / 60:.1f} minutes used, "
+                               f"{self.budget.get_remaining_fraction():.0%} left of the tightest limit")
+
+        steady_state_stats = getattr(self, "steady_state_stats", None)
+        if steady_state_stats is not None and steady_state_stats["evaluated"] > 0:
+            seconds_per_candidate = (time.monotonic() - steady_state_stats["start_time"]) / steady_state_stats["evaluated"]
+            self.console.print(f"Steady state: {steady_state_stats['completed']} candidates generated ({steady_state_stats['failed']} failed), "
+                               f"{steady_state_stats['evaluated']} evaluated, {seconds_per_candidate:.2f}s per evaluated candidate")
+
+        telemetry_snapshot = telemetry.get_snapshot()
+        model_call_stats = telemetry_snapshot["operations"].get("model_call")
+        if model_call_stats is not None and "p50" in model_call_stats:
+            self.console.print(f"Model call latency: p50 {model_call_stats['p50']:.2f}s, p90 {model_call_stats['p90']:.2f}s, p99 {model_call_stats['p99']:.2f}s, "
+                               f"retries: {telemetry_snapshot['events'].get('retries', 0)}, timeouts: {telemetry_snapshot['events'].get('timeouts', 0)}, "
+                               f"estimated spend: ${telemetry_snapshot['spend_usd']:.4f}")
+
+        self.write_prompt_file("prompts/best_prompt.txt", self.best_solution_per_space[best_solution_space][0])
 
         if len(sorted_solution_indexes) > 1:
-            with open("prompts/second_best_prompt.txt", "w") as f:
-                f.write(self.best_solution_per_space[sorted_solution_indexes[1][0]][0])
+            self.write_prompt_file("prompts/second_best_prompt.txt", self.best_solution_per_space[sorted_solution_indexes[1][0]][0])
 
         if len(sorted_solution_indexes) > 2:
-            with open("prompts/third_best_prompt.txt", "w") as f:
-                f.write(self.best_solution_per_space[sorted_solution_indexes[2][0]][0])
+            self.write_prompt_file("prompts/third_best_prompt.txt", self.best_solution_per_space[sorted_solution_indexes[2][0]][0])
 
         if len(sorted_solution_indexes) > 3:
-            with open("prompts/fourth_best_prompt.txt", "w") as f:
-                f.write(self.best_solution_per_space[sorted_solution_indexes[3][0]][0])
+            self.write_prompt_file("prompts/fourth_best_prompt.txt", self.best_solution_per_space[sorted_solution_indexes[3][0]][0])
 
         if len(sorted_solution_indexes) > 4:
-            with open("prompts/fifth_best_prompt.txt", "w") as f:
-                f.write(self.best_solution_per_space[sorted_solution_indexes[4][0]][0])
+            self.write_prompt_file("prompts/fifth_best_prompt.txt", self.best_solution_per_space[sorted_solution_indexes[4][0]][0])
 
         # Store previous best scores for future comparison
         self.previous_best_score_per_space = self.best_score_per_space.copy()
@@ -0,0 +1,76 @@
+import json
+import os
+import random
+
+
+class MAPElitesCheckpoint:
+    """
+    Atomic JSON checkpoint of a MAPElites run.
+
+    Each save writes the archive, counters and random state to a temporary file and renames it over the
+    checkpoint, so a crash while saving leaves the previous checkpoint intact. The random state at the start of the
+    run is stored with it, so a resumed run picks the same search spaces and training split before the archive is
+    restored. Prompt scores are appended to a journal next to the checkpoint, only those set since the previous
+    save, and the journal is written before the checkpoint so every prompt in the archive has its score in it.
+    """
+    def __init__(self, path: str = "checkpoints/map_elites.json"):
+        self.path = path
+        self.scores_path = f"{path}.scores.jsonl"
+        self.initial_random_state = random.getstate()
+        # A new run starts a new journal, a resumed one appends to the journal it loaded
+        self.append_scores = False
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def save(self, state: dict, scores: dict | None = None):
+        state = dict(state, initial_random_state=self.initial_random_state)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.save_scores(scores or {})
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w") as f:
+            json.dump(state, f, default=float)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def save_scores(self, scores: dict):
+        if not scores and self.append_scores:
+            return
+        with open(self.scores_path, "a" if self.append_scores else "w") as f:
+            for key, score in scores.items():
+                f.write(json.dumps([key, score], default=float) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.append_scores = True
+
+    def load_scores(self) -> dict:
+        scores = {}
+        if not os.path.exists(self.scores_path):
+            return scores
+        with open(self.scores_path, "r") as f:
+            for line in f:
+                try:
+                    key, score = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash while appending is skipped
+                    continue
+                scores[key] = score
+        return scores
+
+    def load(self) -> dict:
+        with open(self.path, "r") as f:
+            state = json.load(f)
+        self.initial_random_state = self.to_random_state(state["initial_random_state"])
+        # Checkpoints written before the journal hold their scores in the state
+        state["scores"] = {**state.get("scores", {}), **self.load_scores()}
+        self.append_scores = True
+        return state
+
+    @staticmethod
+    def to_random_state(state: list):
+        # JSON turns the tuples of random.getstate() into lists
+        version, internal_state, gauss_next = state
+        return version, tuple(internal_state), gauss_next
@@ -4,16 +4,22 @@ class AsyncCache:
     def __init__(self):
         self.cache = {}
 
-    def generate_cache_key(*args):
-        return hashlib.sha256(str(args).encode()).hexdigest()
-    async def get(self, key):
-        hashed_key = self.generate_cache_key(key)
+    @staticmethod
+    def generate_cache_key(key) -> str:
+        return hashlib.sha256(str(key).encode()).hexdigest()
+
+    async def get_hashed(self, hashed_key):
         return self.cache.get(hashed_key)
 
-    async def set(self, key, value):
-        hashed_key = self.generate_cache_key(key)
+    async def set_hashed(self, hashed_key, value):
         self.cache[hashed_key] = value
 
+    async def get(self, key):
+        return await self.get_hashed(self.generate_cache_key(key))
+
+    async def set(self, key, value):
+        await self.set_hashed(self.generate_cache_key(key), value)
+
     async def exists(self, key):
         hashed_key = self.generate_cache_key(key)
-        return hashed_key in self.cache
\ No newline at end of file
+        return hashed_key in self.cache
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+
+class CallPriority:
+    EVALUATION = 0
+    CLASSIFICATION = 1
+    GENERATION = 2
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count used for rate limiting, roughly four characters per token."""
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute: float, capacity: float | None = None):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    def time_until_available(self, amount: float) -> float:
+        self.refill()
+        # Requests larger than the bucket would never fit, so they only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount: float):
+        self.refill()
+        self.tokens -= amount
+
+
+class CallScheduler:
+    """
+    Shared client-side limiter for model calls.
+
+    Calls wait for a free concurrency slot and for the requests/minute and tokens/minute buckets.
+    The concurrency limit grows additively on success and halves on rate limit errors (AIMD).
+    Waiting calls are served by priority, with each priority level costing `priority_handicap_seconds`
+    of queueing time so lower priority calls are delayed but never starved.
+    """
+    def __init__(self, requests_per_minute: float | None = None, tokens_per_minute: float | None = None, max_concurrency: int = 32, min_concurrency: int = 1, priority_handicap_seconds: float = 30.0, rate_limit_pause_seconds: float = 5.0):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency_limit = float(max_concurrency)
+        self.priority_handicap_seconds = priority_handicap_seconds
+        self.rate_limit_pause_seconds = rate_limit_pause_seconds
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.active = 0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.timer = None
+        self.timer_loop = None
+        self.stats = {"calls": 0, "rate_limited": 0, "max_active": 0}
+
+    @asynccontextmanager
+    async def slot(self, priority: int = CallPriority.GENERATION, estimated_tokens: int = 0):
+        await self.acquire(priority, estimated_tokens)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: int = CallPriority.GENERATION, estimated_tokens: int = 0):
+        future = asyncio.get_running_loop().create_future()
+        sort_key = time.monotonic() + priority * self.priority_handicap_seconds
+        heapq.heappush(self.waiters, (sort_key, next(self.sequence), future, estimated_tokens))
+        self.dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before cancellation, so hand it back
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        self.dispatch()
+
+    def record_tokens(self, tokens: int):
+        """Charges tokens only known after the call, such as output tokens, against the tokens/minute bucket."""
+        if self.token_bucket is not None:
+            self.token_bucket.consume(tokens)
+
+    def on_success(self):
+        self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1 / self.concurrency_limit)
+
+    def on_rate_limited(self):
+        self.stats["rate_limited"] += 1
+        now = time.monotonic()
+        # A burst of errors from the same overloaded window should only halve the limit once
+        if now - self.last_decrease > self.rate_limit_pause_seconds:
+            self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit / 2)
+            self.last_decrease = now
+        self.paused_until = max(self.paused_until, now + self.rate_limit_pause_seconds)
+
+    def dispatch(self):
+        while self.waiters and self.active < max(self.min_concurrency, int(self.concurrency_limit)):
+            _, _, future, estimated_tokens = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+
+            wait = self.paused_until - time.monotonic()
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.time_until_available(1))
+            if self.token_bucket is not None:
+                wait = max(wait, self.token_bucket.time_until_available(estimated_tokens))
+            if wait > 0:
+                self.schedule_dispatch(wait)
+                return
+
+            heapq.heappop(self.waiters)
+            if self.request_bucket is not None:
+                self.request_bucket.consume(1)
+            if self.token_bucket is not None:
+                self.token_bucket.consume(estimated_tokens)
+            self.active += 1
+            self.stats["calls"] += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.active)
+            future.set_result(None)
+
+    def schedule_dispatch(self, delay: float):
+        loop = asyncio.get_running_loop()
+        # Timers left over from a previous event loop never fire, so only a timer on the running loop counts
+        if self.timer is not None and self.timer_loop is loop:
+            return
+        self.timer_loop = loop
+        self.timer = loop.call_later(delay, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.dispatch()
@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from model_caller.call_scheduler import CallPriority
+from model_caller.model_caller import ModelCaller
+
+
+class Cassette:
+    """
+    Append-only recording of model traffic, stored as a data file and an index file.
+
+    The data file holds the zlib-compressed responses back to back. Each index entry is fixed size and holds the
+    SHA-256 digest of the request, the offset and length of the response in the data file and the original
+    latency. A request made several times, such as a generation at a non-zero temperature, keeps one entry per
+    call, and replay returns them in the order they were recorded.
+    """
+    index_entry = struct.Struct("<32sQId")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data_path = f"{path}.data"
+        self.index_path = f"{path}.index"
+
+    @staticmethod
+    def get_request_digest(*request) -> bytes:
+        return hashlib.sha256(json.dumps(request).encode()).digest()
+
+
+class CassetteWriter(Cassette):
+    def __init__(self, path: str, compression_level: int = 6):
+        super().__init__(path)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.compression_level = compression_level
+        self.data_file = open(self.data_path, "ab")
+        self.index_file = open(self.index_path, "ab")
+        self.offset = self.data_file.tell()
+
+    def append(self, digest: bytes, response: str, latency: float):
+        compressed = zlib.compress(response.encode(), self.compression_level)
+        self.data_file.write(compressed)
+        # The response is flushed before its index entry, so a crash never leaves an entry pointing at missing data
+        self.data_file.flush()
+        self.index_file.write(self.index_entry.pack(digest, self.offset, len(compressed), latency))
+        self.index_file.flush()
+        self.offset += len(compressed)
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+
+class CassetteReader(Cassette):
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.entries = {}
+        self.data_file = open(self.data_path, "rb")
+        # The data file is memory mapped, so only the responses which are replayed are read from disk
+        self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.data_path) > 0 else b""
+        with open(self.index_path, "rb") as f:
+            index = f.read()
+        # A partly written last entry from an interrupted recording is ignored
+        index = index[:len(index) - len(index) % self.index_entry.size]
+        for digest, offset, length, latency in self.index_entry.iter_unpack(index):
+            self.entries.setdefault(digest, []).append((offset, length, latency))
+        self.replay_counts = {}
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.entries.values())
+
+    def get(self, digest: bytes) -> tuple[str, float] | None:
+        """Returns the next recorded (response, latency) for a request, repeating the last one once all are used."""
+        entries = self.entries.get(digest)
+        if entries is None:
+            return None
+        count = self.replay_counts.get(digest, 0)
+        self.replay_counts[digest] = count + 1
+        offset, length, latency = entries[min(count, len(entries) - 1)]
+        return zlib.decompress(self.data[offset:offset + length]).decode(), latency
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data_file.close()
+
+
+class RecordingCaller(ModelCaller):
+    """
+    Passes calls through to another model caller and records each request, response and latency to a cassette.
+
+    Cached calls are recorded whether they were served by the model, the cache or an identical call in flight, so a
+    replay without the cache sees every response the recorded run saw.
+    """
+    def __init__(self, model_caller: ModelCaller, path: str):
+        self.model_caller = model_caller
+        self.model_name = model_caller.model_name
+        self.embedding_model_name = model_caller.embedding_model_name
+        self.scheduler = model_caller.scheduler
+        self.writer = CassetteWriter(path)
+
+    async def call_model(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature:float = 0.7, priority: int=CallPriority.GENERATION) -> str:
+        start_time = time.monotonic()
+        response = await self.model_caller.call_model(chat_history, system_prompt, user_prompt, max_length, temperature, priority)
+        self.record_call(chat_history, system_prompt, user_prompt, max_length, temperature, response, time.monotonic() - start_time)
+        return response
+
+    async def call_model_cached(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature: float=0.7, priority: int=CallPriority.GENERATION) -> str:
+        start_time = time.monotonic()
+        response = await super().call_model_cached(chat_history, system_prompt, user_prompt, max_length, temperature, priority)
+        self.record_call(chat_history, system_prompt, user_prompt, max_length, temperature, response, time.monotonic() - start_time)
+        return response
+
+    async def call_model_and_cache(self, hashed_key: str, chat_history: str, system_prompt: str, user_prompt: str, max_length: int, temperature: float, priority: int) -> str:
+        # Calls made through the cache are recorded in call_model_cached, so the wrapped caller is called directly here
+        ModelCaller.call_counters["model_calls"] += 1
+        result = await self.model_caller.call_model(chat_history, system_prompt, user_prompt, max_length, temperature, priority)
+        if result.strip() != "":
+            await self.async_cache.set_hashed(hashed_key, result)
+        return result
+
+    def record_call(self, chat_history: str, system_prompt: str, user_prompt: str, max_length: int, temperature: float, response: str, latency: float):
+        # Failed calls return an empty response, they are not recorded so a replay does not repeat the failure
+        if response != "":
+            self.writer.append(Cassette.get_request_digest("call", chat_history, system_prompt, user_prompt, max_length, temperature), response, latency)
+
+    async def create_context_cache(self, system_prompt: str) -> str | None:
+        return await self.model_caller.create_context_cache(system_prompt)
+
+    async def delete_context_cache(self, handle: str):
+        await self.model_caller.delete_context_cache(handle)
+
+    def embed_text(self, text_to_embed: str):
+        start_time = time.monotonic()
+        embedding = self.model_caller.embed_text(text_to_embed)
+        # Recorded as a bulk request of one, which is how ReplayCaller looks single embeddings up
+        self.writer.append(Cassette.get_request_digest("embed", [text_to_embed]), json.dumps([list(embedding)]), time.monotonic() - start_time)
+        return embedding
+
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        start_time = time.monotonic()
+        embeddings = await self.model_caller.embed_texts(texts_to_embed)
+        self.writer.append(Cassette.get_request_digest("embed", texts_to_embed), json.dumps([list(embedding) for embedding in embeddings]), time.monotonic() - start_time)
+        return embeddings
+
+    def close(self):
+        self.writer.close()
+
+
+class ReplayCaller(ModelCaller):
+    """
+    Serves calls from a recorded cassette instead of a provider.
+
+    With `replay_timings`, each response is returned after its recorded latency multiplied by `time_scale`,
+    otherwise immediately, which isolates the CPU cost of the search. Requests which were not recorded return
+    an empty response, like a failed call, and are counted in `misses`.
+    """
+    def __init__(self, path: str, model_name: str = "replay", replay_timings: bool = False, time_scale: float = 1.0):
+        self.model_name = model_name
+        self.embedding_model_name = f"{model_name}-embedding"
+        self.reader = CassetteReader(path)
+        self.replay_timings = replay_timings
+        self.time_scale = time_scale
+        self.hits = 0
+        self.misses = 0
+
+    async def replay(self, digest: bytes) -> str | None:
+        recorded = self.get_recorded(digest)
+        if recorded is None:
+            return None
+        response, latency = recorded
+        if self.replay_timings:
+            await asyncio.sleep(latency * self.time_scale)
+        return response
+
+    def get_recorded(self, digest: bytes) -> tuple[str, float] | None:
+        recorded = self.reader.get(digest)
+        if recorded is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return recorded
+
+    async def call_model(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature:float = 0.7, priority: int=CallPriority.GENERATION) -> str:
+        response = await self.replay(Cassette.get_request_digest("call", chat_history, system_prompt, user_prompt, max_length, temperature))
+        if response is None:
+            print(f"Request not found in cassette: {user_prompt[:100]}")
+            return ""
+        return response
+
+    def embed_text(self, text_to_embed: str):
+        # Single embeddings are recorded as bulk requests of one, they are replayed without their latency as this call is synchronous
+        recorded = self.get_recorded(Cassette.get_request_digest("embed", [text_to_embed]))
+        if recorded is None:
+            raise KeyError("Embedding request not found in cassette")
+        return json.loads(recorded[0])[0]
+
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        response = await self.replay(Cassette.get_request_digest("embed", texts_to_embed))
+        if response is None:
+            raise KeyError("Embedding request not found in cassette")
+        return json.loads(response)
+
+    def close(self):
+        self.reader.close()
@@ -0,0 +1,292 @@
+import asyncio
+import collections
+import hashlib
+import json
+import random
+import re
+import time
+
+from model_caller.call_scheduler import CallScheduler, CallPriority, estimate_tokens
+from model_caller.model_caller import ModelCaller
+from telemetry import telemetry
+
+
+class FakeModelError(Exception):
+    pass
+
+
+class FakeRateLimitError(FakeModelError):
+    def __init__(self):
+        super().__init__("429 RESOURCE_EXHAUSTED: fake rate limit")
+
+
+class FakeModelCaller(ModelCaller):
+    """
+    Local stand-in for a model provider, for running and benchmarking the search without API keys.
+
+    Latency is drawn from a log-normal distribution plus a per output token cost, and errors, rate limit
+    responses and malformed records can be injected at configurable rates. Responses are generated from a hash
+    of the request, so the same request always gets the same answer: prompts for generation, mutation and
+    crossover requests, a category number for classification requests and NameParses JSON for evaluation
+    requests. Each prompt is given a hidden quality which sets how many fields of its parses are correct,
+    so the search has something to find.
+    """
+    model_name = "fake"
+    embedding_model_name = "fake-embedding"
+    embedding_dimensions = 64
+
+    brands = ["Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne", "Tyrell", "Cyberdyne", "Soylent", "Hooli",
+              "Vandelay", "Wonka", "Gringotts", "Oscorp", "Aperture", "Massive", "Dynamic", "Blue Sun"]
+    descriptors = ["Industries", "Holdings", "Logistics", "Foods", "Systems", "Capital", "Energy", "Pharma", "Media", "Motors"]
+    locations = ["UK", "Europe", "Asia Pacific", "North America", "Deutschland", "France"]
+    legal_suffixes = ["Ltd", "Limited", "Inc", "LLC", "GmbH", "PLC", "SA", "AG"]
+    corporate_types = ["Holding Company", "Subsidiary", "Branch", "Group"]
+    instruction_sentences = [
+        "Parse each organisation name into its components.",
+        "Identify the top level brand and any lower level brand.",
+        "List legal suffixes exactly as written and give their full forms.",
+        "Record locations and nationalities mentioned in the name.",
+        "Return the output as JSON with a NameParses list, one object per input, keeping each Id.",
+        "Mark brands which are likely acronyms.",
+        "Do not invent components which are not present in the name.",
+        "Think step by step about which words form the brand.",
+        "Keep the PresentedName exactly as given.",
+        "Classify the organisation type from words such as Group, Holdings or Branch.",
+        "Use empty lists for components which are missing.",
+        "Transliterate names written in non-Latin scripts.",
+    ]
+
+    def __init__(self, scheduler: CallScheduler | None = None, latency_seconds: float = 0.5, latency_sigma: float = 0.5,
+                 seconds_per_output_token: float = 0.002, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 requests_per_minute: float | None = None, malformed_record_rate: float = 0.0, time_scale: float = 1.0, seed: int = 0,
+                 min_context_cache_tokens: int = 0):
+        if scheduler is not None:
+            self.scheduler = scheduler
+        self.latency_seconds = latency_seconds
+        self.latency_sigma = latency_sigma
+        self.seconds_per_output_token = seconds_per_output_token
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.requests_per_minute = requests_per_minute
+        self.malformed_record_rate = malformed_record_rate
+        # Multiplies every sleep, so benchmarks can keep the shape of the latency distribution but run faster
+        self.time_scale = time_scale
+        # Only latency and injected failures use this generator, responses depend on the request alone
+        self.random = random.Random(seed)
+        self.recent_request_times = collections.deque()
+        self.call_counts = {"evaluation": 0, "classification": 0, "generation": 0, "embedding": 0, "errors": 0, "rate_limited": 0}
+        # System prompts shorter than this are not cached, like the minimum cache size of real providers
+        self.min_context_cache_tokens = min_context_cache_tokens
+        self.context_cache_stats = {"created": 0, "deleted": 0, "calls": 0, "prefix_tokens_saved": 0}
+
+    async def call_model(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature:float = 0.7, priority: int=CallPriority.GENERATION) -> str:
+        response = None
+        retries = 10
+        attempt = 0
+        estimated_tokens = estimate_tokens(system_prompt + chat_history + user_prompt)
+
+        while retries > 0 and response is None:
+            cached_tokens = estimate_tokens(system_prompt) if system_prompt and self.get_context_cache_handle(system_prompt) is not None else 0
+            try:
+                async with self.scheduler.slot(priority, estimated_tokens):
+                    start_time = time.monotonic()
+                    response = await self.generate_response(chat_history, system_prompt, user_prompt, max_length)
+                self.scheduler.on_success()
+                self.scheduler.record_tokens(estimate_tokens(response))
+                telemetry.record_model_call(self.model_name, estimated_tokens, estimate_tokens(response), time.monotonic() - start_time, cached_input_tokens=cached_tokens)
+                if cached_tokens > 0:
+                    self.context_cache_stats["calls"] += 1
+                    self.context_cache_stats["prefix_tokens_saved"] += cached_tokens
+            except FakeModelError as e:
+                print(f"Error during fake call: {e}")
+                telemetry.increment("errors")
+                if isinstance(e, FakeRateLimitError):
+                    self.scheduler.on_rate_limited()
+                    telemetry.increment("rate_limited")
+                retries -= 1
+                if retries > 0:
+                    telemetry.increment("retries")
+                attempt += 1
+                await asyncio.sleep(min(60, 2 ** attempt) * self.random.uniform(0.5, 1.5) * self.time_scale)
+
+        return response if response is not None else ""
+
+    async def generate_response(self, chat_history: str, system_prompt: str, user_prompt: str, max_length: int) -> str:
+        self.check_rate_limit()
+        if self.random.random() < self.error_rate:
+            self.call_counts["errors"] += 1
+            await asyncio.sleep(self.get_latency(0))
+            raise FakeModelError("500 INTERNAL: fake server error")
+
+        if "Category number of prompt" in user_prompt:
+            self.call_counts["classification"] += 1
+            response = self.generate_category_number(user_prompt)
+        elif system_prompt and user_prompt.lstrip().startswith("{"):
+            # Evaluation calls send the candidate prompt as the system prompt and only input objects as the user prompt
+            self.call_counts["evaluation"] += 1
+            response = self.generate_name_parses(system_prompt, user_prompt)
+        else:
+            self.call_counts["generation"] += 1
+            response = self.generate_prompts(chat_history + user_prompt)
+
+        output_tokens = min(estimate_tokens(response), max_length)
+        await asyncio.sleep(self.get_latency(output_tokens))
+        # Responses longer than the output limit are cut off, like a provider stopping at max tokens
+        return response[:max_length * 4]
+
+    async def create_context_cache(self, system_prompt: str) -> str | None:
+        if estimate_tokens(system_prompt) < self.min_context_cache_tokens:
+            return None
+        # A fixed delay, drawing one would shift the latencies of later calls and change the run
+        await asyncio.sleep(self.latency_seconds * self.time_scale)
+        self.context_cache_stats["created"] += 1
+        telemetry.increment("context_caches_created")
+        return f"fakeCachedContents/{hashlib.sha256(system_prompt.encode()).hexdigest()[:16]}"
+
+    async def delete_context_cache(self, handle: str):
+        self.context_cache_stats["deleted"] += 1
+        telemetry.increment("context_caches_deleted")
+
+    def check_rate_limit(self):
+        if self.random.random() < self.rate_limit_rate:
+            self.call_counts["rate_limited"] += 1
+            raise FakeRateLimitError()
+        if self.requests_per_minute is None:
+            return
+        now = time.monotonic()
+        while self.recent_request_times and now - self.recent_request_times[0] > 60 * self.time_scale:
+            self.recent_request_times.popleft()
+        if len(self.recent_request_times) >= self.requests_per_minute:
+            self.call_counts["rate_limited"] += 1
+            raise FakeRateLimitError()
+        self.recent_request_times.append(now)
+
+    def get_latency(self, output_tokens: int) -> float:
+        latency = self.random.lognormvariate(0, self.latency_sigma) * self.latency_seconds + output_tokens * self.seconds_per_output_token
+        return latency * self.time_scale
+
+    @staticmethod
+    def get_request_random(*parts: str) -> random.Random:
+        return random.Random(hashlib.sha256("\n".join(parts).encode()).digest())
+
+    def generate_category_number(self, user_prompt: str) -> str:
+        categories_section = user_prompt.split("Categories:")[-1]
+        num_categories = max(1, len(re.findall(r"^\s*\d+\. ", categories_section, re.MULTILINE)))
+        return str(self.get_request_random(user_prompt).randrange(num_categories))
+
+    def generate_prompts(self, request: str) -> str:
+        request_random = self.get_request_random(request)
+        prompts = []
+        for _ in range(request_random.randint(1, 2)):
+            sentences = request_random.sample(self.instruction_sentences, request_random.randint(3, len(self.instruction_sentences)))
+            prompts.append(f"<prompt>\n{' '.join(sentences)}\nVariant {request_random.getrandbits(32):08x}.\n</prompt>")
+        return "Here are the new prompts:\n" + "\n".join(prompts)
+
+    def get_prompt_quality(self, system_prompt: str) -> float:
+        """Hidden probability that each field of a parse is correct under this prompt."""
+        return 0.5 + 0.45 * self.get_request_random("quality", system_prompt).random()
+
+    def generate_name_parses(self, system_prompt: str, user_prompt: str) -> str:
+        quality = self.get_prompt_quality(system_prompt)
+        records = []
+        for input_object in self.parse_input_objects(user_prompt):
+            record_random = self.get_request_random(system_prompt, json.dumps(input_object, sort_keys=True))
+            parse = self.get_name_parse(input_object.get("PresentedName", ""))
+            parse["Id"] = input_object.get("Id", "")
+            for field in ["TopLevelBrand", "LowLevelBrand", "LegalSuffixes", "LegalSuffixesFullForms", "Locations", "OrganizationType", "TopLevelBrandLikelyAcronym"]:
+                if record_random.random() > quality:
+                    parse[field] = self.corrupt_value(parse[field], record_random)
+            record = json.dumps(parse, indent=4)
+            if record_random.random() < self.malformed_record_rate:
+                record = record.replace('"Id":', '"Id"', 1)
+            records.append(record)
+        return "```json\n{\n\"NameParses\": [\n" + ",\n".join(records) + "\n]\n}\n```"
+
+    @staticmethod
+    def corrupt_value(value, record_random: random.Random):
+        if isinstance(value, bool):
+            return not value
+        if isinstance(value, list):
+            return value[:-1] if value else ["Unknown"]
+        if value:
+            return value.split(" ")[0].lower()
+        return "Unknown"
+
+    @staticmethod
+    def parse_input_objects(user_prompt: str) -> list[dict]:
+        decoder = json.JSONDecoder()
+        objects = []
+        position = user_prompt.find("{")
+        while position != -1:
+            try:
+                input_object, end = decoder.raw_decode(user_prompt, position)
+            except json.JSONDecodeError:
+                position = user_prompt.find("{", position + 1)
+                continue
+            if isinstance(input_object, dict):
+                objects.append(input_object)
+            position = user_prompt.find("{", end)
+        return objects
+
+    @classmethod
+    def generate_org_names(cls, num_names: int, seed: int = 0) -> list[str]:
+        names_random = random.Random(seed)
+        names = []
+        for _ in range(num_names):
+            words = [names_random.choice(cls.brands)]
+            if names_random.random() < 0.6:
+                words.append(names_random.choice(cls.descriptors))
+            if names_random.random() < 0.3:
+                words.append(names_random.choice(cls.locations))
+            if names_random.random() < 0.2:
+                words.append(names_random.choice(cls.corporate_types))
+            if names_random.random() < 0.8:
+                words.append(names_random.choice(cls.legal_suffixes))
+            names.append(" ".join(words))
+        return names
+
+    @classmethod
+    def get_name_parse(cls, name: str) -> dict:
+        """The correct parse of a generated name, in the model's output format."""
+        words = name.split(" ")
+        legal_suffixes = [words.pop()] if words and words[-1] in cls.legal_suffixes else []
+        name_without_suffixes = " ".join(words)
+        locations = [location for location in cls.locations if f" {location}" in f" {name_without_suffixes}"]
+        corporate_types = [corporate_type for corporate_type in cls.corporate_types if name_without_suffixes.endswith(corporate_type)]
+        top_level_brand = next((brand for brand in cls.brands if name_without_suffixes.startswith(brand)), words[0] if words else "")
+        low_level_brand = name_without_suffixes
+        for removed in locations + corporate_types:
+            low_level_brand = low_level_brand.replace(removed, "").strip()
+        return {
+            "Id": "",
+            "PresentedName": name,
+            "PresentedNameWithLegalSuffixesRemoved": name_without_suffixes,
+            "TopLevelBrand": top_level_brand,
+            "TopLevelBrandLikelyAcronym": top_level_brand.isupper(),
+            "LowLevelBrand": low_level_brand,
+            "LowLevelBrandLikelyAcronym": False,
+            "LegalSuffixes": legal_suffixes,
+            "LegalSuffixesFullForms": ["Limited" if suffix == "Ltd" else suffix for suffix in legal_suffixes],
+            "Locations": locations,
+            "Nationalities": [],
+            "SectorRelated": [],
+            "OrganizationType": corporate_types,
+            "GroupStructure": [],
+            "Alias": [],
+            "IsNonLatin": False,
+        }
+
+    def embed_text(self, text_to_embed: str) -> list[float]:
+        vector = [0.0] * self.embedding_dimensions
+        for word in re.findall(r"\w+", text_to_embed.lower()):
+            digest = hashlib.sha256(word.encode()).digest()
+            vector[digest[0] % self.embedding_dimensions] += 1.0 if digest[1] % 2 else -1.0
+        return vector
+
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        self.call_counts["embedding"] += 1
+        async with self.scheduler.slot(CallPriority.CLASSIFICATION, estimate_tokens("".join(texts_to_embed))):
+            start_time = time.monotonic()
+            await asyncio.sleep(self.get_latency(0))
+        telemetry.record_model_call(self.embedding_model_name, estimate_tokens("".join(texts_to_embed)), 0, time.monotonic() - start_time, "embedding_call")
+        return [self.embed_text(text) for text in texts_to_embed]
@@ -2,55 +2,152 @@ import asyncio
 import logging
 import os
 import random
+import time
 
 from google import genai
 from google.genai import types
 from google.genai.types import ContentEmbedding
 
+from model_caller.call_scheduler import CallScheduler, CallPriority, estimate_tokens
 from model_caller.model_caller import ModelCaller
+from telemetry import telemetry
 
 logger = logging.getLogger(__name__)
 
 class GeminiCaller(ModelCaller):
-    def __init__(self):
+    model_name = "gemini-1.5-flash"
+    embedding_model_name = "text-embedding-004"
+    max_embeddings_per_request = 100
+    # The API rejects context caches smaller than this for 1.5 models, shorter system prompts are sent in full
+    min_context_cache_tokens = 32_768
+    context_cache_ttl_seconds = 3600
+
+    def __init__(self, scheduler: CallScheduler | None = None, timeout: float = 600):
         api_key = os.environ["GEMINI_API_KEY"]
-        self.client = genai.Client(api_key=api_key)        
+        self.timeout = timeout
+        self.client = genai.Client(api_key=api_key, http_options=types.HttpOptions(timeout=int(timeout * 1000)))
+        if scheduler is not None:
+            self.scheduler = scheduler
 
-    async def call_model(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature:float = 0.7) -> str:
+    async def call_model(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature:float = 0.7, priority: int=CallPriority.GENERATION) -> str:
         response = None
         retries = 10
-        timeout = 600  # 10 minutes in seconds
+        attempt = 0
+        estimated_tokens = estimate_tokens(system_prompt + chat_history + user_prompt)
         
         while retries > 0 and response is None:
+            # Looked up on every attempt, the cache may have been created or released since the last one
+            cached_content = self.get_context_cache_handle(system_prompt) if system_prompt else None
             try:
-                # Enforce timeout on the blocking operation
-                response = await asyncio.wait_for(
-                    asyncio.to_thread(
-                        self.client.models.generate_content,
-                        model='gemini-1.5-flash', #2
-                        contents=chat_history + user_prompt,
-                        config=types.GenerateContentConfig(
-                            max_output_tokens=max_length,
-                            temperature=temperature,
-                            system_instruction=system_prompt,
-                        )
-                    ),
-                    timeout=timeout
-                )
+                async with self.scheduler.slot(priority, estimated_tokens):
+                    start_time = time.monotonic()
+                    # The native async client runs on the event loop, so cancelling on timeout aborts the request itself
+                    response = await asyncio.wait_for(
+                        self.client.aio.models.generate_content(
+                            model=self.model_name,
+                            contents=chat_history + user_prompt,
+                            config=types.GenerateContentConfig(
+                                max_output_tokens=max_length,
+                                temperature=temperature,
+                                system_instruction=system_prompt if cached_content is None else None,
+                                cached_content=cached_content,
+                            )
+                        ),
+                        timeout=self.timeout
+                    )
+                self.scheduler.on_success()
+                self.scheduler.record_tokens(estimate_tokens(response.text or ""))
+                usage = response.usage_metadata
+                telemetry.record_model_call(self.model_name,
+                                            (usage.prompt_token_count or 0) if usage is not None else estimated_tokens,
+                                            (usage.candidates_token_count or 0) if usage is not None else estimate_tokens(response.text or ""),
+                                            time.monotonic() - start_time,
+                                            cached_input_tokens=(usage.cached_content_token_count or 0) if usage is not None else 0)
             except asyncio.TimeoutError:
-                print("generate_content timed out after 10 minutes.")
+                print(f"generate_content timed out after {self.timeout} seconds.")
+                telemetry.increment("timeouts")
                 return ""
             except Exception as e:
                 print(f"Error during generate_content: {str(e)[:100]}")
+                telemetry.increment("errors")
+                if self.is_rate_limit_error(e):
+                    self.scheduler.on_rate_limited()
+                    telemetry.increment("rate_limited")
                 retries -= 1
-                await asyncio.sleep(random.randint(30, 90))
+                if retries > 0:
+                    telemetry.increment("retries")
+                attempt += 1
+                await asyncio.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
 
         logger.info(f"request: {chat_history + user_prompt}")
         logger.info(f"response: {response.text if response is not None else ""}")
         return response.text if response is not None else ""
 
+    async def create_context_cache(self, system_prompt: str) -> str | None:
+        if estimate_tokens(system_prompt) < self.min_context_cache_tokens:
+            return None
+        try:
+            cached_content = await self.client.aio.caches.create(
+                model=self.model_name,
+                config=types.CreateCachedContentConfig(system_instruction=system_prompt, ttl=f"{self.context_cache_ttl_seconds}s")
+            )
+        except Exception as e:
+            print(f"Error creating context cache: {str(e)[:100]}")
+            return None
+        telemetry.increment("context_caches_created")
+        return cached_content.name
+
+    async def delete_context_cache(self, handle: str):
+        try:
+            await self.client.aio.caches.delete(name=handle)
+        except Exception as e:
+            # The cache still expires after its TTL
+            print(f"Error deleting context cache: {str(e)[:100]}")
+            return
+        telemetry.increment("context_caches_deleted")
+
+    @staticmethod
+    def is_rate_limit_error(error: Exception) -> bool:
+        message = str(error)
+        return "429" in message or "RESOURCE_EXHAUSTED" in message
+
     def embed_text(self, text_to_embed:str) -> list[ContentEmbedding]:
         result = self.client.models.embed_content(
-            model="text-embedding-004",
+            model=self.embedding_model_name,
             contents=text_to_embed)
-        return result.embeddings
\ No newline at end of file
+        return result.embeddings
+
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        embeddings = []
+        for start in range(0, len(texts_to_embed), self.max_embeddings_per_request):
+            embeddings += await self.embed_chunk(texts_to_embed[start:start + self.max_embeddings_per_request])
+        return embeddings
+
+    async def embed_chunk(self, chunk: list[str]) -> list[list[float]]:
+        """Embeds one request's worth of texts, raising the last error if every attempt fails."""
+        retries = 10
+        attempt = 0
+        while True:
+            try:
+                async with self.scheduler.slot(CallPriority.CLASSIFICATION, estimate_tokens("".join(chunk))):
+                    start_time = time.monotonic()
+                    result = await asyncio.wait_for(self.client.aio.models.embed_content(model=self.embedding_model_name, contents=chunk), timeout=self.timeout)
+                self.scheduler.on_success()
+                telemetry.record_model_call(self.embedding_model_name, estimate_tokens("".join(chunk)), 0, time.monotonic() - start_time, "embedding_call")
+                return [embedding.values for embedding in result.embeddings]
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    print(f"embed_content timed out after {self.timeout} seconds.")
+                    telemetry.increment("timeouts")
+                else:
+                    print(f"Error during embed_content: {str(e)[:100]}")
+                    telemetry.increment("errors")
+                if self.is_rate_limit_error(e):
+                    self.scheduler.on_rate_limited()
+                    telemetry.increment("rate_limited")
+                retries -= 1
+                attempt += 1
+                if retries == 0:
+                    raise
+                telemetry.increment("retries")
+                await asyncio.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
\ No newline at end of file
@@ -1,28 +1,77 @@
+import asyncio
 import os
-from functools import lru_cache
+import random
+import time
 
-from openai import OpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, RateLimitError
 
+from model_caller.call_scheduler import CallScheduler, CallPriority, estimate_tokens
 from model_caller.model_caller import ModelCaller
+from telemetry import telemetry
 
 
 class GPTCaller(ModelCaller):
-    @lru_cache(maxsize=None)
-    async def call_model_cached(self, chat_history: str, system_prompt: str, user_prompt: str, max_length: int = 500,
-                          temperature: float = 0.7) :
-        return await self.call_model(chat_history, system_prompt, user_prompt, max_length, temperature)
+    model_name = "gpt-4o"
+    embedding_model_name = "text-embedding-3-small"
+    max_embeddings_per_request = 2048
 
     def embed_text(self, text_to_embed: str) -> str:
         pass
 
-    def __init__(self):
-        api_key = os.environ["OPENAI_API_KEY"]
-        self.client = OpenAI(api_key=api_key)
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        embeddings = []
+        for start in range(0, len(texts_to_embed), self.max_embeddings_per_request):
+            embeddings += await self.embed_chunk(texts_to_embed[start:start + self.max_embeddings_per_request])
+        return embeddings
 
-    async def call_model(self, chat_history: str="", system_prompt: str="", user_prompt: str="", max_length: int = 500, temperature: float=0.7) -> str:
-        response = None
+    async def embed_chunk(self, chunk: list[str]) -> list[list[float]]:
+        """Embeds one request's worth of texts, raising the last error if every attempt fails."""
         retries = 3
+        attempt = 0
+        while True:
+            try:
+                async with self.scheduler.slot(CallPriority.CLASSIFICATION, estimate_tokens("".join(chunk))):
+                    start_time = time.monotonic()
+                    response = await asyncio.wait_for(self.client.embeddings.create(model=self.embedding_model_name, input=chunk), timeout=self.timeout)
+                self.scheduler.on_success()
+                telemetry.record_model_call(self.embedding_model_name, response.usage.prompt_tokens, 0, time.monotonic() - start_time, "embedding_call")
+                return [data.embedding for data in response.data]
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    print(f"embedding request timed out after {self.timeout} seconds.")
+                    telemetry.increment("timeouts")
+                else:
+                    print(f"Error during embedding request: {str(e)[:100]}")
+                    telemetry.increment("errors")
+                if isinstance(e, RateLimitError):
+                    self.scheduler.on_rate_limited()
+                    telemetry.increment("rate_limited")
+                retries -= 1
+                attempt += 1
+                if retries == 0:
+                    raise
+                telemetry.increment("retries")
+                print(f"Retrying... {retries} attempts left.")
+                await asyncio.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
 
+    def __init__(self, scheduler: CallScheduler | None = None, max_connections: int = 64, timeout: float = 600):
+        api_key = os.environ["OPENAI_API_KEY"]
+        self.timeout = timeout
+        # One pooled async HTTP client shared by every call, retries are handled below so the scheduler sees rate limits
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            max_retries=0,
+            timeout=timeout,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
+        if scheduler is not None:
+            self.scheduler = scheduler
+
+    @staticmethod
+    def get_messages(chat_history: str, system_prompt: str, user_prompt: str) -> list[dict]:
         chat_history_encoded = []
 
         if system_prompt != "" and system_prompt is not None:
@@ -34,22 +83,54 @@ class GPTCaller(ModelCaller):
         if user_prompt != "" and user_prompt is not None:
             chat_history_encoded += [{"role": "user", "content": user_prompt}]
 
-        # print(f"\n\n Calling model with prompt: \n{chat_history_encoded}\n\n")
+        return chat_history_encoded
+
+    async def call_model(self, chat_history: str="", system_prompt: str="", user_prompt: str="", max_length: int = 500, temperature: float=0.7, priority: int=CallPriority.GENERATION) -> str:
+        response = None
+        retries = 3
+        attempt = 0
+
+        chat_history_encoded = self.get_messages(chat_history, system_prompt, user_prompt)
+        estimated_tokens = estimate_tokens(system_prompt + chat_history + user_prompt)
+
         while retries > 0 and response is None:
-            # try:
-
-            response = self.client.chat.completions.create(model="gpt-4o",
-                                                           messages=chat_history_encoded,
-                                                           max_tokens=max_length,
-                                                           temperature=0.7)
-
-            # print(response.choices)
-            return response.choices[0].message.content
-
-            # except Exception as e:
-            #     print(f"Error: {e}")
-            #     retries -= 1
-            #     if retries > 0:
-            #         print(f"Retrying... {retries} attempts left.")
-            #         time.sleep(5)  # sleep for 5 seconds before retrying
-        return ""  # return empty string if unable to get a response after retries
\ No newline at end of file
+            try:
+                async with self.scheduler.slot(priority, estimated_tokens):
+                    start_time = time.monotonic()
+                    # Cancelling the awaitable closes the underlying HTTP request, so the deadline is enforced end to end
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(model=self.model_name,
+                                                            messages=chat_history_encoded,
+                                                            max_tokens=max_length,
+                                                            temperature=temperature),
+                        timeout=self.timeout
+                    )
+                self.scheduler.on_success()
+                if response.usage is not None:
+                    self.scheduler.record_tokens(response.usage.completion_tokens)
+                    # OpenAI caches long prompt prefixes automatically, so there are no explicit context caches to create
+                    prompt_tokens_details = response.usage.prompt_tokens_details
+                    cached_tokens = (prompt_tokens_details.cached_tokens or 0) if prompt_tokens_details is not None else 0
+                    telemetry.record_model_call(self.model_name, response.usage.prompt_tokens, response.usage.completion_tokens, time.monotonic() - start_time, cached_input_tokens=cached_tokens)
+                else:
+                    telemetry.record_model_call(self.model_name, estimated_tokens, estimate_tokens(response.choices[0].message.content or ""), time.monotonic() - start_time)
+            except asyncio.TimeoutError:
+                print(f"chat completion timed out after {self.timeout} seconds.")
+                telemetry.increment("timeouts")
+                return ""
+            except Exception as e:
+                print(f"Error during chat completion: {str(e)[:100]}")
+                telemetry.increment("errors")
+                if isinstance(e, RateLimitError):
+                    self.scheduler.on_rate_limited()
+                    telemetry.increment("rate_limited")
+                retries -= 1
+                attempt += 1
+                if retries > 0:
+                    telemetry.increment("retries")
+                    print(f"Retrying... {retries} attempts left.")
+                    await asyncio.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
+
+        if response is None:
+            return ""  # return empty string if unable to get a response after retries
+        return response.choices[0].message.content or ""
@@ -1,31 +1,117 @@
+import asyncio
 from abc import abstractmethod, ABC
 
 from model_caller.async_cache import AsyncCache
+from model_caller.call_scheduler import CallScheduler, CallPriority
+from telemetry import telemetry
 
 
 class ModelCaller(ABC):
     async_cache = AsyncCache()
+    # Pending calls keyed by hashed cache key, so concurrent identical calls share one request
+    in_flight_calls: dict[str, asyncio.Task] = {}
+    call_counters = {"requests": 0, "cache_hits": 0, "coalesced": 0, "model_calls": 0}
+    # Provider-side context caches of system prompts, keyed by system prompt, each task resolves to a handle or None
+    context_caching = False
+    context_cache_tasks: dict[str, asyncio.Task] = {}
+    scheduler = CallScheduler()
+    model_name = ""
+    embedding_model_name = ""
+
+    @classmethod
+    def set_cache(cls, cache: AsyncCache):
+        ModelCaller.async_cache = cache
+
+    @classmethod
+    def get_call_counters(cls) -> dict[str, int]:
+        return dict(ModelCaller.call_counters)
+
+    def get_hashed_cache_key(self, chat_history: str, system_prompt: str, user_prompt: str, max_length: int, temperature: float) -> str:
+        # Define a unique key based on the model and the function arguments, hashed once per lookup
+        cache_key = (self.model_name, chat_history, system_prompt, user_prompt, max_length, temperature)
+        return self.async_cache.generate_cache_key(cache_key)
+
     @abstractmethod
-    async def call_model(self, chat_history: str, system_prompt:str, user_prompt:str, max_length: int=5_000, temperature: float=0.7) -> str:
+    async def call_model(self, chat_history: str, system_prompt:str, user_prompt:str, max_length: int=5_000, temperature: float=0.7, priority: int=CallPriority.GENERATION) -> str:
         pass
 
-    async def call_model_cached(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature: float=0.7) -> str:
-        # Define a unique key based on the function arguments
-        cache_key = (chat_history, system_prompt, user_prompt, max_length, temperature)
+    async def call_model_cached(self, chat_history: str="", system_prompt:str="", user_prompt:str="", max_length: int=5_000, temperature: float=0.7, priority: int=CallPriority.GENERATION) -> str:
+        hashed_key = self.get_hashed_cache_key(chat_history, system_prompt, user_prompt, max_length, temperature)
+        ModelCaller.call_counters["requests"] += 1
+        telemetry.increment("cache_requests")
 
-        # Check if the result is in the cache
-        if await self.async_cache.exists(cache_key):
-            return await self.async_cache.get(cache_key)
+        in_flight = self.in_flight_calls.get(hashed_key)
+        if in_flight is None:
+            # Check if the result is in the cache
+            cached_result = await self.async_cache.get_hashed(hashed_key)
+            if cached_result is not None:
+                ModelCaller.call_counters["cache_hits"] += 1
+                telemetry.increment("cache_hits")
+                return cached_result
+            # An identical call may have started while the cache was being checked
+            in_flight = self.in_flight_calls.get(hashed_key)
 
-        # If not cached, call the model and store the result
-        result = await self.call_model(chat_history, system_prompt, user_prompt, max_length, temperature)
+        if in_flight is not None:
+            ModelCaller.call_counters["coalesced"] += 1
+            telemetry.increment("coalesced")
+            return await asyncio.shield(in_flight)
+
+        # If not cached or in flight, call the model and share the pending result with identical calls
+        task = asyncio.create_task(self.call_model_and_cache(hashed_key, chat_history, system_prompt, user_prompt, max_length, temperature, priority))
+        self.in_flight_calls[hashed_key] = task
+        task.add_done_callback(lambda t: self.in_flight_calls.pop(hashed_key) if self.in_flight_calls.get(hashed_key) is t else None)
+        return await asyncio.shield(task)
+
+    async def call_model_and_cache(self, hashed_key: str, chat_history: str, system_prompt: str, user_prompt: str, max_length: int, temperature: float, priority: int) -> str:
+        ModelCaller.call_counters["model_calls"] += 1
+        result = await self.call_model(chat_history, system_prompt, user_prompt, max_length, temperature, priority)
 
         if result.strip() != "":
             # Cache the result for future use
-            await self.async_cache.set(cache_key, result)
+            await self.async_cache.set_hashed(hashed_key, result)
 
         return result
 
+    async def create_context_cache(self, system_prompt: str) -> str | None:
+        """Caches a system prompt on the provider, returning its handle, or None if the provider has no context caching."""
+        return None
+
+    async def delete_context_cache(self, handle: str):
+        pass
+
+    async def get_context_cache(self, system_prompt: str) -> str | None:
+        """Returns the context cache handle of a system prompt, creating it on first use when context caching is on."""
+        if not ModelCaller.context_caching:
+            return None
+        task = self.context_cache_tasks.get(system_prompt)
+        if task is None:
+            task = asyncio.create_task(self.create_context_cache(system_prompt))
+            self.context_cache_tasks[system_prompt] = task
+        return await asyncio.shield(task)
+
+    def get_context_cache_handle(self, system_prompt: str) -> str | None:
+        """The handle calls with this system prompt should use, None while it is still being created or if there is none."""
+        task = self.context_cache_tasks.get(system_prompt)
+        if task is None or not task.done() or task.cancelled() or task.exception() is not None:
+            return None
+        return task.result()
+
+    async def release_context_cache(self, system_prompt: str):
+        """Deletes the context cache of a system prompt, later calls with it send the system prompt in full again."""
+        task = self.context_cache_tasks.pop(system_prompt, None)
+        if task is None:
+            return
+        try:
+            handle = await task
+        except Exception:
+            return
+        if handle is not None:
+            await self.delete_context_cache(handle)
+
     @abstractmethod
     def embed_text(self, text_to_embed:str) -> str:
-        pass
\ No newline at end of file
+        pass
+
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        """Embeds several texts in bulk, returning one vector per text."""
+        raise NotImplementedError(f"{type(self).__name__} does not support bulk embeddings")
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from model_caller.async_cache import AsyncCache
+
+
+class SQLiteCache(AsyncCache):
+    """
+    Persistent, size-bounded response cache shared between runs.
+
+    Values are zlib-compressed and evicted least-recently-used once `max_entries` is exceeded,
+    or dropped once they are older than `ttl_seconds`. The database runs in WAL mode so several
+    tuning runs on the same machine can read and write the same file concurrently.
+    """
+    eviction_interval = 100
+
+    def __init__(self, path: str = "cache/model_responses.sqlite", max_entries: int = 500_000, ttl_seconds: float | None = 30 * 24 * 60 * 60, compression_level: int = 6):
+        super().__init__()
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.compression_level = compression_level
+        self.lock = threading.Lock()
+        self.sets_since_eviction = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.evict()
+
+    async def get_hashed(self, hashed_key):
+        return await asyncio.to_thread(self.get_hashed_sync, hashed_key)
+
+    async def set_hashed(self, hashed_key, value):
+        await asyncio.to_thread(self.set_hashed_sync, hashed_key, value)
+
+    async def exists(self, key):
+        return await self.get(key) is not None
+
+    def get_hashed_sync(self, hashed_key):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (hashed_key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self.connection.execute("DELETE FROM responses WHERE key = ?", (hashed_key,))
+                return None
+            self.connection.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, hashed_key))
+        return zlib.decompress(value).decode()
+
+    def set_hashed_sync(self, hashed_key, value):
+        now = time.time()
+        compressed = zlib.compress(value.encode(), self.compression_level)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (hashed_key, compressed, now, now)
+            )
+            self.sets_since_eviction += 1
+            should_evict = self.sets_since_eviction >= self.eviction_interval
+        if should_evict:
+            self.evict()
+
+    def evict(self):
+        with self.lock:
+            self.sets_since_eviction = 0
+            if self.ttl_seconds is not None:
+                self.connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+            (count,) = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > self.max_entries:
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,106 @@
+import math
+
+from model_caller.call_scheduler import estimate_tokens
+
+
+class BatchPlanner:
+    """
+    Packs consecutive examples into evaluation batches up to a token budget and sizes each batch's output limit.
+
+    The budget covers the input payload and the expected output of every example in the batch, so batches of
+    short names hold more examples and the prompt sent with every call is repeated less often. The output limit
+    of each call is the expected output size with a safety margin. When too many recent batches come back
+    truncated or with malformed records, the budget is halved and the batches are planned again.
+    """
+    def __init__(self, target_tokens: int = 6_000, max_batch_size: int = 50, output_token_margin: float = 1.5,
+                 output_token_overhead: int = 128, min_output_tokens: int = 256, max_output_tokens: int = 8_192,
+                 min_target_tokens: int = 500, max_failure_rate: float = 0.1, min_observations: int = 20):
+        self.target_tokens = target_tokens
+        self.max_batch_size = max_batch_size
+        self.output_token_margin = output_token_margin
+        self.output_token_overhead = output_token_overhead
+        self.min_output_tokens = min_output_tokens
+        self.max_output_tokens = max_output_tokens
+        self.min_target_tokens = min_target_tokens
+        self.max_failure_rate = max_failure_rate
+        self.min_observations = min_observations
+
+        # Outcomes of batches parsed since the last plan
+        self.recent_batches = 0
+        self.recent_failed_batches = 0
+        # Throughput statistics keyed by number of examples in a batch
+        self.stats_per_batch_size = {}
+        self.shrink_count = 0
+
+    def plan(self, input_tokens: list[int], output_tokens: list[int]) -> list[list[int]]:
+        """Returns the example indices of each batch, keeping examples in their original order."""
+        batches = []
+        current_batch = []
+        current_tokens = 0
+        for index, (example_input_tokens, example_output_tokens) in enumerate(zip(input_tokens, output_tokens)):
+            example_tokens = example_input_tokens + example_output_tokens
+            if current_batch and (current_tokens + example_tokens > self.target_tokens or len(current_batch) >= self.max_batch_size):
+                batches.append(current_batch)
+                current_batch = []
+                current_tokens = 0
+            current_batch.append(index)
+            current_tokens += example_tokens
+        if current_batch:
+            batches.append(current_batch)
+
+        self.recent_batches = 0
+        self.recent_failed_batches = 0
+        return batches
+
+    def get_max_output_tokens(self, output_tokens: list[int]) -> int:
+        max_output_tokens = math.ceil(sum(output_tokens) * self.output_token_margin) + self.output_token_overhead
+        return min(self.max_output_tokens, max(self.min_output_tokens, max_output_tokens))
+
+    def get_batch_stats(self, batch_size: int) -> dict:
+        if batch_size not in self.stats_per_batch_size:
+            self.stats_per_batch_size[batch_size] = {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "payload_tokens": 0, "parsed": 0, "failed": 0}
+        return self.stats_per_batch_size[batch_size]
+
+    def record_call(self, batch_size: int, prompt: str, payload: str, seconds: float):
+        batch_stats = self.get_batch_stats(batch_size)
+        batch_stats["calls"] += 1
+        batch_stats["seconds"] += seconds
+        batch_stats["prompt_tokens"] += estimate_tokens(prompt)
+        batch_stats["payload_tokens"] += estimate_tokens(payload)
+
+    def record_parse(self, batch_size: int, converted: list | None):
+        self.record_parse_outcome(batch_size, self.is_failed_parse(batch_size, converted))
+
+    @staticmethod
+    def is_failed_parse(batch_size: int, converted: list | None) -> bool:
+        """A batch failed if it could not be parsed, was cut short or had malformed records."""
+        return converted is None or len(converted) < batch_size or any(record is None for record in converted)
+
+    def record_parse_outcome(self, batch_size: int, failed: bool):
+        batch_stats = self.get_batch_stats(batch_size)
+        batch_stats["parsed"] += 1
+        self.recent_batches += 1
+        if failed:
+            batch_stats["failed"] += 1
+            self.recent_failed_batches += 1
+
+    def should_shrink(self) -> bool:
+        if self.recent_batches < self.min_observations or self.target_tokens <= self.min_target_tokens:
+            return False
+        return self.recent_failed_batches / self.recent_batches > self.max_failure_rate
+
+    def shrink(self):
+        self.target_tokens = max(self.min_target_tokens, self.target_tokens // 2)
+        self.shrink_count += 1
+
+    def get_report(self) -> list[str]:
+        report = []
+        for batch_size, batch_stats in sorted(self.stats_per_batch_size.items()):
+            if batch_stats["calls"] == 0:
+                continue
+            examples_per_second = batch_size * batch_stats["calls"] / batch_stats["seconds"] if batch_stats["seconds"] > 0 else math.inf
+            prompt_share = batch_stats["prompt_tokens"] / max(1, batch_stats["prompt_tokens"] + batch_stats["payload_tokens"])
+            failure_rate = batch_stats["failed"] / batch_stats["parsed"] if batch_stats["parsed"] > 0 else 0.0
+            report.append(f"{batch_size} examples: {batch_stats['calls']} calls, {examples_per_second:.1f} examples/s per call, "
+                          f"{prompt_share:.0%} of input tokens spent on the prompt, {failure_rate:.0%} failed")
+        return report
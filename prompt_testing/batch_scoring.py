@@ -0,0 +1,262 @@
+import json
+
+from custom_converters.converter import Converter
+from prompt_testing.streaming_json import StreamingRecordExtractor
+from telemetry import telemetry
+
+
+class Evaluator:
+    def __init__(self, fields_to_ignore: list[str], fields_weightings: dict[str, float]):
+        self.fields_to_ignore = fields_to_ignore
+        self.fields_weightings = fields_weightings
+
+    def get_score_for_object(self, actual_output: dict, expected_output: dict, expected_value_sets: dict[str, set[str]] | None = None) -> tuple[float, dict, dict]:
+        total_penalty = 0.0
+        field_scores = {}
+        list_field_metrics = {}
+
+        all_keys = set(actual_output.keys()).union(set(expected_output.keys()))
+        total_fields = len(all_keys)
+
+        for key in all_keys:
+            if key in self.fields_to_ignore:
+                continue
+            actual_value = self.as_list(actual_output.get(key))
+            if expected_value_sets is not None:
+                metrics = self.compare_list_to_set(actual_value, expected_value_sets.get(key, set()))
+            else:
+                metrics = self.compare_lists(actual_value, self.as_list(expected_output.get(key)))
+            list_field_metrics[key] = metrics
+            penalty = metrics["false_positives"] + metrics["false_negatives"]
+            total_penalty += penalty
+        
+        overall_score = max(0.0, 1.0 - (total_penalty / total_fields))
+        return overall_score, field_scores, list_field_metrics
+
+    def get_expected_value_sets(self, expected_output: dict) -> dict[str, set[str]]:
+        """Pre-converts every compared field of an expected output to the string set used by compare_lists."""
+        return {
+            key: set([str(item) for item in self.as_list(value)])
+            for key, value in expected_output.items() if key not in self.fields_to_ignore
+        }
+
+    @staticmethod
+    def as_list(value) -> list:
+        if isinstance(value, list):
+            return value
+        if value is None:
+            return []
+        return [value]
+
+    def compare_lists(self, actual_list, expected_list):
+        try:
+            expected_set = set([str(item) for item in expected_list])
+        except Exception as e:
+            print("Exception:", e)
+            print("Actual list:", actual_list)
+            print("Expected list:", expected_list)
+            return self.get_failed_comparison_metrics()
+        return self.compare_list_to_set(actual_list, expected_set)
+
+    def compare_list_to_set(self, actual_list, expected_set):
+        try:
+            actual_set = set([str(item) for item in actual_list])
+            true_positives = len(actual_set & expected_set)
+            false_positives = len(actual_set - expected_set)
+            false_negatives = len(expected_set - actual_set)
+            true_negatives = 0
+        except Exception as e:
+            print("Exception:", e)
+            print("Actual list:", actual_list)
+            print("Expected set:", expected_set)
+            return self.get_failed_comparison_metrics()
+
+        return {
+            "true_positives": true_positives,
+            "false_positives": false_positives,
+            "false_negatives": false_negatives,
+            "true_negatives": true_negatives
+        }
+
+    @staticmethod
+    def get_failed_comparison_metrics():
+        return {
+            "true_positives": 0,
+            "false_positives": 0,
+            "false_negatives": 1,
+            "true_negatives": 0
+        }
+
+class RecordParser:
+    """Turns model responses into converted output records, counting unparseable responses and malformed records."""
+    def __init__(self, output_converter: Converter, records_key: str):
+        self.output_converter = output_converter
+        self.records_key = records_key
+        self.record_extractor = StreamingRecordExtractor(records_key)
+        self.parse_stats = {"responses": 0, "failed_responses": 0, "records": 0, "failed_records": 0}
+
+    def convert_batch_result(self, result) -> list | None:
+        return self.parse_result(result)[1]
+
+    def parse_result(self, result) -> tuple[list | None, list | None]:
+        """
+        Returns the records of a model response before and after conversion, or (None, None) if it cannot be parsed.
+        A malformed record is None in both lists. A response whose records cannot be read one by one is converted as
+        a whole by the output converter, and has no raw records.
+        """
+        self.parse_stats["responses"] += 1
+        telemetry.increment("parse_responses")
+        if result is None or not self.record_extractor.found_records(result):
+            stripped_result = self.get_outer_curly_bracket_value(result)
+            try:
+                result_obj = json.loads(stripped_result)
+            except Exception as e:
+                print(f"Could not parse result: {e}")
+                self.parse_stats["failed_responses"] += 1
+                telemetry.increment("parse_failed_responses")
+                return None, None
+            return None, self.output_converter.convert(result_obj)
+        raw_records = list(self.record_extractor.iter_records(result))
+        return raw_records, self.convert_raw_records(raw_records)
+
+    def convert_raw_records(self, raw_records: list) -> list:
+        converted = []
+        for record in raw_records:
+            record = self.convert_record(record)
+            self.parse_stats["records"] += 1
+            telemetry.increment("parse_records")
+            if record is None:
+                self.parse_stats["failed_records"] += 1
+                telemetry.increment("parse_failed_records")
+            converted.append(record)
+        return converted
+
+    def convert_record(self, record: dict | None) -> dict | None:
+        if record is None:
+            return None
+        converted_record = self.output_converter.convert({self.records_key: [record]})
+        return converted_record[0] if len(converted_record) > 0 else None
+
+    @staticmethod
+    def get_outer_curly_bracket_value(s):
+        if s is None:
+            return ''
+
+        start = s.find('{')
+        if start == -1:
+            return '}'
+
+        # Counter to track the nesting level of curly brackets
+        brace_count = 0
+        for i in range(start, len(s)):
+            if s[i] == '{':
+                brace_count += 1
+            elif s[i] == '}':
+                brace_count -= 1
+                if brace_count == 0:
+                    return s[start:i + 1]
+
+        return s[start:] + '}'
+
+
+class BatchScorer:
+    """Scores the converted records of a batch against their expected outputs, and aggregates batch scores into a prompt score."""
+    def __init__(self, evaluator: Evaluator):
+        self.evaluator = evaluator
+
+    @staticmethod
+    def get_empty_batch_score() -> dict:
+        return {
+            "total_score": 0.0,
+            "num_scored": 0,
+            "field_score_sums": {},
+            "field_count": {},
+            "list_field_metrics_sums": {},
+            "worst_score": 1,
+            "worst_out": None,
+            "worst_actual": None,
+            # Object score and field metrics of each example in the batch, in order
+            "example_results": [],
+        }
+
+    def score_converted_batch(self, converted: list | None, expected_converted_batch: list, expected_value_set_batch: list) -> dict:
+        batch_score = self.get_empty_batch_score()
+        if converted is None:
+            return batch_score
+
+        for res, expected_converted, expected_value_sets in zip(converted, expected_converted_batch, expected_value_set_batch):
+            if res is None:
+                object_score = 0
+                field_scores = {}
+                list_field_metrics = {}
+            else:
+                object_score, field_scores, list_field_metrics = self.evaluator.get_score_for_object(res, expected_converted, expected_value_sets)
+            if object_score < batch_score["worst_score"]:
+                batch_score["worst_score"] = object_score
+                batch_score["worst_out"] = expected_converted
+                batch_score["worst_actual"] = res
+            batch_score["total_score"] += object_score
+            batch_score["num_scored"] += 1
+            batch_score["example_results"].append((object_score, list_field_metrics))
+
+            for field, score in field_scores.items():
+                batch_score["field_score_sums"][field] = batch_score["field_score_sums"].get(field, 0) + score
+                batch_score["field_count"][field] = batch_score["field_count"].get(field, 0) + 1
+
+            self.add_field_metrics(batch_score["list_field_metrics_sums"], list_field_metrics)
+
+        return batch_score
+
+    def aggregate_batch_scores(self, batch_scores: list[dict], report_worst: bool = True):
+        field_score_sums = {}
+        field_count = {}
+        list_field_metrics_sums = {}
+        worst_score = 1
+        worst_out = None
+        worst_actual = None
+
+        for batch_score in batch_scores:
+            if batch_score["worst_score"] < worst_score:
+                worst_score = batch_score["worst_score"]
+                worst_out = batch_score["worst_out"]
+                worst_actual = batch_score["worst_actual"]
+
+            for field, score in batch_score["field_score_sums"].items():
+                field_score_sums[field] = field_score_sums.get(field, 0) + score
+                field_count[field] = field_count.get(field, 0) + batch_score["field_count"][field]
+
+            self.add_field_metrics(list_field_metrics_sums, batch_score["list_field_metrics_sums"])
+
+        if report_worst and worst_out is not None:
+            print("actual:")
+            print(worst_actual)
+            print("expected_converted:")
+            print(worst_out)
+            print()
+
+        average_field_scores = {}
+
+        for field in field_score_sums:
+            average_field_scores[field] = field_score_sums[field] / field_count[field]
+
+        for field, metrics in list_field_metrics_sums.items():
+            tp, fp, fn = metrics["true_positives"], metrics["false_positives"], metrics["false_negatives"]
+            precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+            recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+            f1_score = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+            average_field_scores[field] = f1_score
+
+        return (
+            (sum(average_field_scores.values()) / len(average_field_scores)) if (len(average_field_scores)> 0) else 0,
+            average_field_scores,
+            worst_out
+        )
+
+    @staticmethod
+    def add_field_metrics(list_field_metrics_sums: dict, list_field_metrics: dict):
+        for field, metrics in list_field_metrics.items():
+            if field not in list_field_metrics_sums:
+                list_field_metrics_sums[field] = dict(metrics)
+            else:
+                for key in metrics:
+                    list_field_metrics_sums[field][key] += metrics[key]
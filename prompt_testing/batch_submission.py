@@ -0,0 +1,244 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+from model_caller.call_scheduler import CallPriority
+from model_caller.cassette import RecordingCaller
+from model_caller.model_caller import ModelCaller
+from telemetry import telemetry
+
+
+class BatchBackend(ABC):
+    """Submits a JSONL file of evaluation requests to a bulk endpoint and collects the responses."""
+    finished_statuses = ("completed", "failed", "expired", "cancelled")
+
+    @abstractmethod
+    async def submit(self, requests_path: str) -> str:
+        pass
+
+    @abstractmethod
+    async def get_status(self, batch_id: str) -> str:
+        pass
+
+    @abstractmethod
+    async def get_results(self, batch_id: str) -> dict[str, str]:
+        """Returns the response text for each request, keyed by custom_id."""
+        pass
+
+    def take_usage(self, batch_id: str) -> dict[str, dict]:
+        """
+        Returns the input, cached input and output tokens of each answered request, keyed by custom_id, once results
+        were fetched. Backends whose calls are already recorded as model calls return nothing.
+        """
+        return {}
+
+
+class LocalFileBatchBackend(BatchBackend):
+    """
+    Offline stand-in for a provider batch endpoint.
+
+    Requests are answered by a ModelCaller in the background and written next to the input file,
+    and the batch is reported as completed once the output file exists. The ModelCaller records the usage of its calls.
+    """
+    def __init__(self, model_caller: ModelCaller, directory: str = "batch_requests/local"):
+        self.model_caller = model_caller
+        self.directory = directory
+        self.jobs = {}
+        os.makedirs(directory, exist_ok=True)
+
+    async def submit(self, requests_path: str) -> str:
+        batch_id = uuid.uuid4().hex
+        with open(requests_path, "r") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        self.jobs[batch_id] = asyncio.create_task(self.process(batch_id, requests))
+        return batch_id
+
+    async def process(self, batch_id: str, requests: list[dict]):
+        responses = await asyncio.gather(*[
+            self.model_caller.call_model(
+                request["chat_history"], request["system_prompt"], request["user_prompt"],
+                request["max_length"], request["temperature"], CallPriority.EVALUATION
+            )
+            for request in requests
+        ])
+        output_path = self.get_output_path(batch_id)
+        with open(output_path + ".tmp", "w") as f:
+            for request, response in zip(requests, responses):
+                f.write(json.dumps({"custom_id": request["custom_id"], "response": response}) + "\n")
+        os.replace(output_path + ".tmp", output_path)
+
+    async def get_status(self, batch_id: str) -> str:
+        if os.path.exists(self.get_output_path(batch_id)):
+            return "completed"
+        job = self.jobs.get(batch_id)
+        if job is None or (job.done() and job.exception() is not None):
+            return "failed"
+        return "in_progress"
+
+    async def get_results(self, batch_id: str) -> dict[str, str]:
+        with open(self.get_output_path(batch_id), "r") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        return {line["custom_id"]: line["response"] for line in lines}
+
+    def get_output_path(self, batch_id: str) -> str:
+        return os.path.join(self.directory, f"{batch_id}.output.jsonl")
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Uses the OpenAI Batch API, which bills chat completions at a discount with a 24 hour completion window."""
+    def __init__(self, client, model_name: str):
+        self.client = client
+        self.model_name = model_name
+        self.usage_per_batch = {}
+
+    async def submit(self, requests_path: str) -> str:
+        from model_caller.gpt_caller import GPTCaller
+
+        openai_requests_path = requests_path.replace(".jsonl", ".openai.jsonl")
+        with open(requests_path, "r") as f, open(openai_requests_path, "w") as out:
+            for line in f:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                out.write(json.dumps({
+                    "custom_id": request["custom_id"],
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": self.model_name,
+                        "messages": GPTCaller.get_messages(request["chat_history"], request["system_prompt"], request["user_prompt"]),
+                        "max_tokens": request["max_length"],
+                        "temperature": request["temperature"],
+                    }
+                }) + "\n")
+
+        with open(openai_requests_path, "rb") as f:
+            uploaded = await self.client.files.create(file=f, purpose="batch")
+        batch = await self.client.batches.create(input_file_id=uploaded.id, endpoint="/v1/chat/completions", completion_window="24h")
+        return batch.id
+
+    async def get_status(self, batch_id: str) -> str:
+        batch = await self.client.batches.retrieve(batch_id)
+        return batch.status
+
+    async def get_results(self, batch_id: str) -> dict[str, str]:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.output_file_id is None:
+            return {}
+        content = await self.client.files.content(batch.output_file_id)
+        results = {}
+        usage_per_request = {}
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            body = response.get("body", {})
+            choices = body.get("choices", [])
+            results[result["custom_id"]] = (choices[0]["message"]["content"] or "") if choices else ""
+            usage = body.get("usage")
+            if usage is not None:
+                usage_per_request[result["custom_id"]] = {
+                    "input_tokens": usage.get("prompt_tokens", 0),
+                    "cached_input_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0),
+                    "output_tokens": usage.get("completion_tokens", 0),
+                }
+        self.usage_per_batch[batch_id] = usage_per_request
+        return results
+
+    def take_usage(self, batch_id: str) -> dict[str, dict]:
+        return self.usage_per_batch.pop(batch_id, {})
+
+
+class BatchSubmitter:
+    """
+    Collects the evaluation calls made during a round and sends them as one batch.
+
+    Calls arriving within `collection_window_seconds` of each other are grouped, answered from the
+    model response cache where possible, and resolved once the backend reports the batch finished.
+    Responses are written back to the cache so later rounds and runs reuse them. When `model_caller` records a
+    cassette, responses are recorded as the calls they stand for, so a replay without batch mode serves them.
+    """
+    def __init__(self, backend: BatchBackend, model_caller: ModelCaller, requests_directory: str = "batch_requests", collection_window_seconds: float = 1.0, poll_interval_seconds: float = 30.0):
+        self.backend = backend
+        self.model_caller = model_caller
+        self.requests_directory = requests_directory
+        self.collection_window_seconds = collection_window_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.pending_requests = {}
+        self.pending_futures = {}
+        self.flush_task = None
+        os.makedirs(requests_directory, exist_ok=True)
+
+    async def get_result(self, chat_history: str, system_prompt: str, user_prompt: str, max_length: int = 5_000, temperature: float = 0.0) -> str:
+        hashed_key = self.model_caller.get_hashed_cache_key(chat_history, system_prompt, user_prompt, max_length, temperature)
+        cached_result = await self.model_caller.async_cache.get_hashed(hashed_key)
+        if cached_result is not None:
+            return cached_result
+
+        if hashed_key not in self.pending_futures:
+            self.pending_requests[hashed_key] = {
+                "custom_id": hashed_key,
+                "chat_history": chat_history,
+                "system_prompt": system_prompt,
+                "user_prompt": user_prompt,
+                "max_length": max_length,
+                "temperature": temperature,
+            }
+            self.pending_futures[hashed_key] = asyncio.get_running_loop().create_future()
+            if self.flush_task is None:
+                self.flush_task = asyncio.create_task(self.flush_after_window())
+
+        return await asyncio.shield(self.pending_futures[hashed_key])
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.collection_window_seconds)
+        requests, futures = self.pending_requests, self.pending_futures
+        self.pending_requests, self.pending_futures, self.flush_task = {}, {}, None
+
+        try:
+            results = await self.run_batch(list(requests.values()))
+        except Exception as e:
+            for future in futures.values():
+                future.set_exception(e)
+            return
+
+        for custom_id, future in futures.items():
+            result = results.get(custom_id, "")
+            if result.strip() != "":
+                await self.model_caller.async_cache.set_hashed(custom_id, result)
+            if isinstance(self.model_caller, RecordingCaller):
+                request = requests[custom_id]
+                # The batch's turnaround is not the latency of a call, so replays serve batch responses at once
+                self.model_caller.record_call(request["chat_history"], request["system_prompt"], request["user_prompt"],
+                                              request["max_length"], request["temperature"], result, 0.0)
+            future.set_result(result)
+
+    async def run_batch(self, requests: list[dict]) -> dict[str, str]:
+        requests_path = os.path.join(self.requests_directory, f"evaluation_requests_{int(time.time())}_{uuid.uuid4().hex[:8]}.jsonl")
+        with open(requests_path, "w") as f:
+            for request in requests:
+                f.write(json.dumps(request) + "\n")
+
+        start_time = time.monotonic()
+        batch_id = await self.backend.submit(requests_path)
+        print(f"Submitted batch {batch_id} with {len(requests)} evaluation requests")
+
+        status = await self.backend.get_status(batch_id)
+        while status not in self.backend.finished_statuses:
+            await asyncio.sleep(self.poll_interval_seconds)
+            status = await self.backend.get_status(batch_id)
+
+        if status != "completed":
+            print(f"Batch {batch_id} finished with status {status}")
+        # Partially completed batches may still have usable output
+        results = await self.backend.get_results(batch_id)
+        # Each answered request counts as a model call towards the run's usage, taking as long as the whole batch
+        seconds = time.monotonic() - start_time
+        for usage in self.backend.take_usage(batch_id).values():
+            telemetry.record_model_call(self.model_caller.model_name, usage["input_tokens"], usage["output_tokens"], seconds,
+                                        "batch_model_call", cached_input_tokens=usage["cached_input_tokens"])
+        return results
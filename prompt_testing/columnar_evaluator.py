@@ -0,0 +1,168 @@
+import numpy as np
+
+from prompt_testing.batch_scoring import Evaluator
+
+
+class ColumnarEvaluator:
+    """
+    Scores many prompts at once with the same results as Evaluator and PromptTesterObjectSimilarity.
+
+    Field names and the string form of every field value are interned to integer IDs. Expected outputs are
+    interned once per dataset. True positive, false positive and false negative counts are then held in
+    NumPy arrays shaped (prompts x examples x fields), so set comparisons, per-field sums and the worst
+    example are computed with array operations instead of per-object dictionaries.
+    """
+    def __init__(self, evaluator: Evaluator, expected_converted: list[dict | None]):
+        self.evaluator = evaluator
+        self.expected_converted = expected_converted
+        self.field_ids = {}
+        self.field_names = []
+        self.value_ids = {}
+
+        self.expected_keys = [set(expected.keys()) if expected is not None else None for expected in expected_converted]
+
+        expected_examples, expected_fields, expected_values = [], [], []
+        for example_index, expected in enumerate(expected_converted):
+            if expected is None:
+                continue
+            for field, value_set in self.evaluator.get_expected_value_sets(expected).items():
+                field_id = self.get_field_id(field)
+                for value in value_set:
+                    expected_examples.append(example_index)
+                    expected_fields.append(field_id)
+                    expected_values.append(self.get_value_id(value))
+
+        # Expected (example, field, value) triples, grouped by example for fast gathering per prompt
+        order = np.argsort(np.array(expected_examples, dtype=np.int64), kind="stable")
+        self.expected_examples = np.array(expected_examples, dtype=np.int64)[order]
+        self.expected_fields = np.array(expected_fields, dtype=np.int64)[order]
+        self.expected_values = np.array(expected_values, dtype=np.int64)[order]
+        self.expected_offsets = np.searchsorted(self.expected_examples, np.arange(len(expected_converted) + 1))
+
+    def get_field_id(self, field: str) -> int:
+        if field not in self.field_ids:
+            self.field_ids[field] = len(self.field_names)
+            self.field_names.append(field)
+        return self.field_ids[field]
+
+    def get_value_id(self, value: str) -> int:
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = len(self.value_ids)
+            self.value_ids[value] = value_id
+        return value_id
+
+    def score_prompts(self, records_per_prompt: list[list[tuple[int, dict | None]]]) -> list[tuple[float, dict, dict | None]]:
+        """
+        Scores each prompt from its parsed records, given as (example index, record) pairs in evaluation order.
+        Returns the same (score, field_scores, worst_example) tuples as PromptTesterObjectSimilarity.
+        """
+        num_prompts = len(records_per_prompt)
+        num_examples = len(self.expected_converted)
+
+        actual_cells, actual_values = [], []
+        scored_prompts, scored_examples, total_fields = [], [], []
+        field_orders = []
+
+        for prompt_index, records in enumerate(records_per_prompt):
+            field_order = {}
+            for example_index, record in records:
+                scored_prompts.append(prompt_index)
+                scored_examples.append(example_index)
+                if record is None:
+                    # A null record scores 0 and contributes no field metrics
+                    total_fields.append(0)
+                    continue
+
+                all_keys = set(record.keys()).union(self.expected_keys[example_index])
+                total_fields.append(len(all_keys))
+                for key in all_keys:
+                    if key in self.evaluator.fields_to_ignore:
+                        continue
+                    field_id = self.get_field_id(key)
+                    field_order.setdefault(key, field_id)
+                    for item in self.evaluator.as_list(record.get(key)):
+                        actual_cells.append((prompt_index, example_index, field_id))
+                        actual_values.append(self.get_value_id(str(item)))
+            field_orders.append(field_order)
+
+        num_fields = max(1, len(self.field_names))
+        shape = (num_prompts, num_examples, num_fields)
+        num_cells = num_prompts * num_examples * num_fields
+
+        actual_pairs = self.get_unique_pairs(actual_cells, actual_values, shape)
+
+        # Expected values only count for cells where the field was compared, i.e. non-null records
+        scored_prompts = np.array(scored_prompts, dtype=np.int64)
+        scored_examples = np.array(scored_examples, dtype=np.int64)
+        total_fields = np.array(total_fields, dtype=np.int64)
+        compared = total_fields > 0
+        expected_pairs = self.gather_expected_pairs(scored_prompts[compared], scored_examples[compared], shape)
+
+        actual_counts = np.bincount(actual_pairs[:, 0], minlength=num_cells)
+        expected_counts = np.bincount(expected_pairs[:, 0], minlength=num_cells)
+        both = np.concatenate([actual_pairs, expected_pairs])
+        if len(both) > 0:
+            unique_pairs, counts = np.unique(both, axis=0, return_counts=True)
+            true_positives = np.bincount(unique_pairs[counts == 2, 0], minlength=num_cells)
+        else:
+            true_positives = np.zeros(num_cells, dtype=np.int64)
+
+        true_positives = true_positives.reshape(shape)
+        false_positives = actual_counts.reshape(shape) - true_positives
+        false_negatives = expected_counts.reshape(shape) - true_positives
+
+        # Per-object scores, in the same order the objects were evaluated
+        penalties = (false_positives + false_negatives)[scored_prompts, scored_examples].sum(axis=1)
+        object_scores = np.where(compared, np.maximum(0.0, 1.0 - penalties / np.maximum(total_fields, 1)), 0.0)
+
+        field_true_positives = true_positives.sum(axis=1)
+        field_false_positives = false_positives.sum(axis=1)
+        field_false_negatives = false_negatives.sum(axis=1)
+
+        scores = []
+        for prompt_index in range(num_prompts):
+            average_field_scores = {}
+            for field, field_id in field_orders[prompt_index].items():
+                tp = int(field_true_positives[prompt_index, field_id])
+                fp = int(field_false_positives[prompt_index, field_id])
+                fn = int(field_false_negatives[prompt_index, field_id])
+                precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+                recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+                f1_score = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+                average_field_scores[field] = f1_score
+
+            worst_out = None
+            prompt_mask = scored_prompts == prompt_index
+            if prompt_mask.any():
+                prompt_object_scores = object_scores[prompt_mask]
+                worst_position = int(np.argmin(prompt_object_scores))
+                if prompt_object_scores[worst_position] < 1:
+                    worst_out = self.expected_converted[int(scored_examples[prompt_mask][worst_position])]
+
+            scores.append((
+                (sum(average_field_scores.values()) / len(average_field_scores)) if (len(average_field_scores)> 0) else 0,
+                average_field_scores,
+                worst_out
+            ))
+        return scores
+
+    def gather_expected_pairs(self, prompts: np.ndarray, examples: np.ndarray, shape) -> np.ndarray:
+        starts = self.expected_offsets[examples]
+        lengths = self.expected_offsets[examples + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros((0, 2), dtype=np.int64)
+        # Index of every expected triple belonging to each scored (prompt, example) pair
+        repeated_starts = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+        indices = repeated_starts + np.arange(total)
+        cells = np.ravel_multi_index((np.repeat(prompts, lengths), self.expected_examples[indices], self.expected_fields[indices]), shape)
+        return np.stack([cells, self.expected_values[indices]], axis=1)
+
+    @staticmethod
+    def get_unique_pairs(cells: list[tuple[int, int, int]], values: list[int], shape) -> np.ndarray:
+        if not cells:
+            return np.zeros((0, 2), dtype=np.int64)
+        flat_cells = np.ravel_multi_index(np.array(cells, dtype=np.int64).T, shape)
+        # Each (cell, value) pair counts once, like the string sets compared by Evaluator
+        return np.unique(np.stack([flat_cells, np.array(values, dtype=np.int64)], axis=1), axis=0)
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import json
+
+from telemetry import telemetry
+
+# Jobs carry a whole batch payload and its expected outputs, so lines can be far longer than asyncio's 64KiB default
+max_message_bytes = 64 * 2 ** 20
+
+
+def encode_message(message: dict) -> bytes:
+    return (json.dumps(message, default=str) + "\n").encode()
+
+
+class EvaluationCoordinator:
+    """
+    Hands evaluation batches to remote workers over TCP and collects their batch scores.
+
+    Workers connect to the coordinator, say how many batches they take at once and are sent the evaluator
+    configuration. A worker whose model differs from `worker_config["model_name"]` is turned away, as its scores
+    would be stored under this run's configuration. Messages are newline-delimited JSON. Each job holds a prompt, a batch payload, its output limit
+    and the expected outputs of the batch, so workers need no data of their own. Jobs in flight on a worker whose
+    connection is lost, or which fail on a worker, are queued again for another worker, up to `max_attempts` times,
+    after which the batch counts as a failed call. Jobs wait in the queue while no worker is connected.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, worker_config: dict | None = None, max_attempts: int = 3):
+        self.host = host
+        self.port = port
+        self.worker_config = worker_config or {}
+        self.max_attempts = max_attempts
+        self.server = None
+        self.jobs = asyncio.Queue()
+        self.job_ids = itertools.count()
+        self.worker_writers = set()
+        self.stats = {"workers_connected": 0, "workers_lost": 0, "jobs": 0, "retried": 0, "failed": 0}
+
+    async def start(self):
+        if self.server is None:
+            self.server = await asyncio.start_server(self.handle_worker, self.host, self.port, limit=max_message_bytes)
+            print(f"Waiting for evaluation workers on {self.host}:{self.port}")
+
+    async def close(self):
+        """Tells connected workers to exit and stops accepting new ones."""
+        for writer in list(self.worker_writers):
+            writer.write(encode_message({"type": "shutdown"}))
+            writer.close()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+    async def score_batch(self, job: dict) -> dict | None:
+        """Returns the worker's metrics for the batch, or None if it failed on every attempt."""
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.stats["jobs"] += 1
+        self.jobs.put_nowait((next(self.job_ids), job, future, 1))
+        return await future
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        in_flight = {}
+        sender = None
+        name = str(writer.get_extra_info("peername"))
+        try:
+            hello = json.loads(await reader.readline())
+            name = hello.get("worker", name)
+            model_name = self.worker_config.get("model_name")
+            if model_name is not None and hello.get("model_name") != model_name:
+                print(f"Evaluation worker {name} uses model {hello.get('model_name')}, not {model_name}, turning it away")
+                writer.write(encode_message({"type": "rejected", "reason": f"the coordinator evaluates with model {model_name}, not {hello.get('model_name')}"}))
+                await writer.drain()
+                return
+            writer.write(encode_message({"type": "config", **self.worker_config}))
+            self.worker_writers.add(writer)
+            self.stats["workers_connected"] += 1
+            print(f"Evaluation worker {name} connected, taking {hello.get('capacity', 1)} batches at once")
+
+            slots = asyncio.Semaphore(hello.get("capacity", 1))
+            sender = asyncio.create_task(self.send_jobs(writer, in_flight, slots))
+            while line := await reader.readline():
+                message = json.loads(line)
+                # Usage is counted even for a job which was already answered, the model calls were still made
+                if "usage" in message:
+                    telemetry.record_remote_usage(message["usage"])
+                item = in_flight.pop(message["job_id"], None)
+                if item is None:
+                    continue
+                slots.release()
+                if message["type"] == "result":
+                    if not item[2].done():
+                        item[2].set_result(message["metrics"])
+                else:
+                    self.retry(item, f"failed on worker {name}: {message.get('error')}")
+        except (ConnectionError, json.JSONDecodeError) as e:
+            print(f"Lost evaluation worker {name}: {e}")
+        finally:
+            if sender is not None:
+                sender.cancel()
+            self.worker_writers.discard(writer)
+            writer.close()
+            if in_flight:
+                self.stats["workers_lost"] += 1
+                telemetry.increment("workers_lost")
+            for item in in_flight.values():
+                self.retry(item, f"worker {name} was lost")
+
+    async def send_jobs(self, writer: asyncio.StreamWriter, in_flight: dict, slots: asyncio.Semaphore):
+        try:
+            while True:
+                await slots.acquire()
+                item = await self.jobs.get()
+                if item[2].done():
+                    # The evaluation waiting for this batch was cancelled
+                    slots.release()
+                    continue
+                job_id, job, _, _ = item
+                in_flight[job_id] = item
+                writer.write(encode_message({"type": "job", "job_id": job_id, **job}))
+                await writer.drain()
+        except ConnectionError:
+            # The reading side sees the closed connection and queues the jobs in flight again
+            pass
+
+    def retry(self, item, reason: str):
+        job_id, job, future, attempt = item
+        if future.done():
+            return
+        if attempt >= self.max_attempts:
+            print(f"Evaluation batch {job_id} {reason}, giving up after {attempt} attempts")
+            self.stats["failed"] += 1
+            telemetry.increment("remote_batches_failed")
+            future.set_result(None)
+            return
+        print(f"Evaluation batch {job_id} {reason}, retrying")
+        self.stats["retried"] += 1
+        telemetry.increment("remote_batches_retried")
+        self.jobs.put_nowait((job_id, job, future, attempt + 1))
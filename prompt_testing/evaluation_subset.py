@@ -0,0 +1,122 @@
+import collections
+import math
+from typing import Callable
+
+import numpy as np
+
+from telemetry import telemetry
+
+
+class EvaluationSubsetSelector:
+    """
+    Picks a smaller set of training examples which ranks prompts the same way as the full training set.
+
+    The per-example results of every prompt evaluated on the full set are kept, up to the last `max_prompts`.
+    Examples are split into `num_strata` strata by how well prompts do on them on average, and `subset_fraction`
+    of the examples are shared out between strata in proportion to the sum of their per-example score spread
+    across prompts (Neyman allocation). Each stratum keeps its examples with the most spread, so examples which
+    every prompt gets right or wrong are the first to go. A subset is only used if the Spearman correlation of
+    prompt scores on it with scores on the full set is at least `min_rank_correlation`, otherwise it grows until
+    it is, up to the full set. Every `validation_interval` updates the tester evaluates the elites on the full
+    set again, and the subset is kept only if it still ranks every known prompt well enough.
+    """
+    def __init__(self, subset_fraction: float = 0.3, min_rank_correlation: float = 0.9, validation_interval: int = 5, num_strata: int = 4,
+                 min_prompts: int = 20, max_prompts: int = 200, growth_factor: float = 1.5):
+        self.subset_fraction = subset_fraction
+        self.min_rank_correlation = min_rank_correlation
+        self.validation_interval = validation_interval
+        self.num_strata = num_strata
+        self.min_prompts = min_prompts
+        self.growth_factor = growth_factor
+        # Object score and field metrics of each example, for prompts evaluated on the full set
+        self.example_results = collections.OrderedDict()
+        self.max_prompts = max_prompts
+        self.subset = None
+        self.updates_since_validation = 0
+        self.stats = {"selections": 0, "validations": 0, "rank_correlation": None}
+
+    def observe(self, prompt: str, example_results: list[tuple[float, dict]]):
+        self.example_results[prompt] = example_results
+        self.example_results.move_to_end(prompt)
+        while len(self.example_results) > self.max_prompts:
+            self.example_results.popitem(last=False)
+
+    def should_validate(self) -> bool:
+        self.updates_since_validation += 1
+        if self.updates_since_validation < self.validation_interval:
+            return False
+        self.updates_since_validation = 0
+        self.stats["validations"] += 1
+        telemetry.increment("evaluation_subset_validations")
+        return True
+
+    def select(self, get_score: Callable[[list[dict]], float]) -> list[int] | None:
+        """
+        Returns the sorted example indices to evaluate on, or None for the full set.
+        `get_score` turns the field metrics of a list of examples into a prompt's score.
+        """
+        if len(self.example_results) < self.min_prompts:
+            return self.subset
+
+        full_scores = [get_score([metrics for _, metrics in results]) for results in self.example_results.values()]
+        if self.subset is not None:
+            rank_correlation = self.get_rank_correlation(self.subset, full_scores, get_score)
+            if rank_correlation >= self.min_rank_correlation:
+                self.stats["rank_correlation"] = rank_correlation
+                return self.subset
+
+        object_scores = np.array([[score for score, _ in results] for results in self.example_results.values()])
+        num_examples = object_scores.shape[1]
+        fraction = self.subset_fraction
+        subset = None
+        rank_correlation = 1.0
+        while fraction < 1:
+            subset = self.get_stratified_subset(object_scores, math.ceil(fraction * num_examples))
+            if subset is None:
+                break
+            rank_correlation = self.get_rank_correlation(subset, full_scores, get_score)
+            if rank_correlation >= self.min_rank_correlation:
+                break
+            subset = None
+            fraction *= self.growth_factor
+
+        self.subset = subset
+        self.stats["selections"] += 1
+        self.stats["rank_correlation"] = rank_correlation if subset is not None else None
+        telemetry.increment("evaluation_subset_selections")
+        return subset
+
+    def get_stratified_subset(self, object_scores: np.ndarray, subset_size: int) -> list[int] | None:
+        spread = object_scores.std(axis=0)
+        if spread.sum() == 0:
+            # No example tells the known prompts apart, so there is nothing to choose a subset by
+            return None
+
+        strata = [stratum for stratum in np.array_split(np.argsort(object_scores.mean(axis=0), kind="stable"), self.num_strata) if len(stratum) > 0]
+        stratum_weights = np.array([spread[stratum].sum() for stratum in strata])
+        allocations = np.floor(subset_size * stratum_weights / stratum_weights.sum()).astype(int)
+        # Rounding down leaves a few examples over, they go to the strata with the largest remainders
+        remainders = subset_size * stratum_weights / stratum_weights.sum() - allocations
+        for stratum_index in np.argsort(-remainders, kind="stable")[:subset_size - allocations.sum()]:
+            allocations[stratum_index] += 1
+
+        subset = []
+        for stratum, allocation in zip(strata, allocations):
+            subset += stratum[np.argsort(-spread[stratum], kind="stable")[:allocation]].tolist()
+        return sorted(subset)
+
+    def get_rank_correlation(self, subset: list[int], full_scores: list[float], get_score: Callable[[list[dict]], float]) -> float:
+        subset_scores = [get_score([results[index][1] for index in subset]) for results in self.example_results.values()]
+        full_ranks = self.get_ranks(np.array(full_scores))
+        subset_ranks = self.get_ranks(np.array(subset_scores))
+        if full_ranks.std() == 0 or subset_ranks.std() == 0:
+            # A subset which ties prompts that the full set tells apart loses the ranking
+            return 1.0 if full_ranks.std() == subset_ranks.std() else 0.0
+        return float(np.corrcoef(full_ranks, subset_ranks)[0, 1])
+
+    @staticmethod
+    def get_ranks(values: np.ndarray) -> np.ndarray:
+        # Tied values share their average rank, as in the Spearman correlation
+        _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+        first_ranks = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        return (first_ranks + (counts - 1) / 2)[inverse]
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import socket
+import time
+from typing import Callable
+
+from custom_converters.converter import Converter
+from model_caller.call_scheduler import CallPriority
+from model_caller.model_caller import ModelCaller
+from prompt_testing.batch_planner import BatchPlanner
+from prompt_testing.batch_scoring import BatchScorer, Evaluator, RecordParser
+from prompt_testing.evaluation_coordinator import encode_message, max_message_bytes
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity
+from telemetry import telemetry
+
+
+class RemoteBatchScorer:
+    """Calls the model for batches sent by a coordinator and scores them, jobs carry their own data so it holds none."""
+    records_key = PromptTesterObjectSimilarity.records_key
+
+    def __init__(self, model_caller: ModelCaller, evaluator: Evaluator, output_converter: Converter):
+        self.model = model_caller
+        self.evaluator = evaluator
+        self.record_parser = RecordParser(output_converter, self.records_key)
+        self.batch_scorer = BatchScorer(evaluator)
+
+    async def score_job(self, job: dict) -> dict:
+        start_time = time.monotonic()
+        result = await self.model.call_model_cached("", job["prompt"], job["payload"], temperature=0.0, max_length=job["max_length"], priority=CallPriority.EVALUATION)
+        seconds = time.monotonic() - start_time
+
+        converted = self.record_parser.convert_batch_result(result)
+        expected_converted_batch = job["expected"]
+        expected_value_set_batch = [self.evaluator.get_expected_value_sets(expected) if expected is not None else None for expected in expected_converted_batch]
+        return {
+            "batch_score": self.batch_scorer.score_converted_batch(converted, expected_converted_batch, expected_value_set_batch),
+            "seconds": seconds,
+            "parsed": converted is not None,
+            "records": len(converted) if converted is not None else 0,
+            "failed_records": sum(record is None for record in converted) if converted is not None else 0,
+            "failed": BatchPlanner.is_failed_parse(len(expected_converted_batch), converted),
+        }
+
+
+class EvaluationWorker:
+    """
+    Connects to an EvaluationCoordinator and evaluates the batches it is sent with its own model caller.
+
+    The evaluator and output converter are set from the coordinator's configuration, so every worker scores the
+    same way. If the coordinator cannot be reached or the connection drops, the worker connects again after
+    `reconnect_seconds`, and it exits when the coordinator shuts down or turns it away for using a different model.
+    """
+    def __init__(self, model_caller: ModelCaller, load_output_converter: Callable[[str], Converter], capacity: int = 16, name: str | None = None, reconnect_seconds: float = 5):
+        self.model_caller = model_caller
+        self.load_output_converter = load_output_converter
+        self.capacity = capacity
+        self.name = name or socket.gethostname()
+        self.reconnect_seconds = reconnect_seconds
+        self.stats = {"jobs": 0, "failed": 0}
+        # Model usage already sent to a coordinator, each response carries what was used since, so run budgets count it
+        self.reported_usage = telemetry.get_model_usage()
+
+    async def run(self, host: str, port: int):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(host, port, limit=max_message_bytes)
+            except OSError as e:
+                print(f"Could not connect to coordinator at {host}:{port}: {e}")
+                await asyncio.sleep(self.reconnect_seconds)
+                continue
+            if await self.serve(reader, writer):
+                return
+            await asyncio.sleep(self.reconnect_seconds)
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Evaluates jobs until the connection ends, returning True if the coordinator shut down or turned the worker away."""
+        tasks = set()
+        try:
+            writer.write(encode_message({"type": "hello", "worker": self.name, "capacity": self.capacity, "model_name": self.model_caller.model_name}))
+            config = json.loads(await reader.readline())
+            if config["type"] == "rejected":
+                # Connecting again would be turned away again, so the worker exits
+                print(f"Coordinator turned this worker away: {config['reason']}")
+                return True
+            scorer = RemoteBatchScorer(self.model_caller, Evaluator(config["fields_to_ignore"], config["fields_weightings"]), self.load_output_converter(config["output_converter"]))
+            print(f"Connected to coordinator as {self.name}")
+
+            while line := await reader.readline():
+                message = json.loads(line)
+                if message["type"] == "shutdown":
+                    return True
+                task = asyncio.create_task(self.run_job(scorer, message, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, json.JSONDecodeError) as e:
+            print(f"Lost connection to coordinator: {e}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+        print("Coordinator closed the connection")
+        return False
+
+    async def run_job(self, scorer: RemoteBatchScorer, job: dict, writer: asyncio.StreamWriter):
+        self.stats["jobs"] += 1
+        try:
+            response = {"type": "result", "job_id": job["job_id"], "metrics": await scorer.score_job(job)}
+        except Exception as e:
+            print(f"Evaluation batch {job['job_id']} failed: {e}")
+            self.stats["failed"] += 1
+            response = {"type": "error", "job_id": job["job_id"], "error": str(e)}
+        response["usage"] = self.take_usage()
+        writer.write(encode_message(response))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    def take_usage(self) -> dict:
+        usage = telemetry.get_model_usage()
+        usage_since_report = telemetry.get_usage_difference(usage, self.reported_usage)
+        self.reported_usage = usage
+        return usage_since_report
@@ -0,0 +1,125 @@
+import glob
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+
+class ExampleResultStore:
+    """
+    Parsed model record of every (model, prompt, example) evaluated, so scores can be recomputed without model calls.
+
+    Prompts and examples are addressed by the hash of their text, examples by the payload sent to the model, so
+    records stay valid when examples are added, relabelled or reordered, and when the evaluator or output converter
+    changes. Records are kept as they came from the model, before the output converter. Malformed records are not
+    stored, so their examples are sent to the model again.
+
+    Records added since the last save are written to `directory` as one compressed .npz shard of columns: the
+    interned model names, prompt hashes and texts and example hashes, an index into each of them per record, and
+    the records as a UTF-8 JSON blob with offsets. All shards in the directory are loaded on start.
+    """
+    def __init__(self, directory: str | None = None):
+        self.directory = directory
+        self.records = {}
+        self.prompts = {}
+        self.unsaved_keys = []
+        self.unsaved_prompt_hashes = set()
+        if directory:
+            self.load()
+
+    @staticmethod
+    def get_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+    def add_prompt(self, prompt: str) -> str:
+        prompt_hash = self.get_hash(prompt)
+        if prompt_hash not in self.prompts:
+            self.prompts[prompt_hash] = prompt
+            self.unsaved_prompt_hashes.add(prompt_hash)
+        return prompt_hash
+
+    def get(self, model_name: str, prompt_hash: str, example_hash: str) -> tuple[bool, dict | None]:
+        """Returns whether a record is stored, and the record."""
+        record = self.records.get((model_name, prompt_hash, example_hash))
+        if record is None:
+            return False, None
+        return True, json.loads(record)
+
+    def set(self, model_name: str, prompt_hash: str, example_hash: str, record: dict | None):
+        key = (model_name, prompt_hash, example_hash)
+        if key not in self.records:
+            self.unsaved_keys.append(key)
+        self.records[key] = json.dumps(record)
+
+    def get_records_by_prompt(self) -> dict[tuple[str, str], dict[str, dict | None]]:
+        """Groups every stored record by model and prompt hash, keyed by example hash."""
+        records_by_prompt = {}
+        for (model_name, prompt_hash, example_hash), record in self.records.items():
+            records_by_prompt.setdefault((model_name, prompt_hash), {})[example_hash] = json.loads(record)
+        return records_by_prompt
+
+    def take_unsaved(self) -> dict[str, np.ndarray] | None:
+        """Columns of the records added since the last call, taken between awaits so they can be written on another thread."""
+        if not self.unsaved_keys:
+            return None
+        keys, self.unsaved_keys = self.unsaved_keys, []
+        prompt_hashes = sorted(self.unsaved_prompt_hashes | {prompt_hash for _, prompt_hash, _ in keys})
+        self.unsaved_prompt_hashes = set()
+
+        model_names = sorted({model_name for model_name, _, _ in keys})
+        example_hashes = sorted({example_hash for _, _, example_hash in keys})
+        model_ids = {model_name: index for index, model_name in enumerate(model_names)}
+        prompt_ids = {prompt_hash: index for index, prompt_hash in enumerate(prompt_hashes)}
+        example_ids = {example_hash: index for index, example_hash in enumerate(example_hashes)}
+        prompt_texts = [self.prompts[prompt_hash].encode() for prompt_hash in prompt_hashes]
+        records = [self.records[key].encode() for key in keys]
+        return {
+            "model_names": np.array(model_names, dtype=np.str_),
+            "prompt_hashes": np.array(prompt_hashes, dtype=np.str_),
+            "prompt_text_offsets": np.cumsum([0] + [len(text) for text in prompt_texts], dtype=np.int64),
+            "prompt_text_blob": np.frombuffer(b"".join(prompt_texts), dtype=np.uint8),
+            "example_hashes": np.array(example_hashes, dtype=np.str_),
+            "record_models": np.array([model_ids[model_name] for model_name, _, _ in keys], dtype=np.int32),
+            "record_prompts": np.array([prompt_ids[prompt_hash] for _, prompt_hash, _ in keys], dtype=np.int32),
+            "record_examples": np.array([example_ids[example_hash] for _, _, example_hash in keys], dtype=np.int32),
+            "record_offsets": np.cumsum([0] + [len(record) for record in records], dtype=np.int64),
+            "record_blob": np.frombuffer(b"".join(records), dtype=np.uint8),
+        }
+
+    def write_shard(self, columns: dict[str, np.ndarray] | None):
+        if columns is None or not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Named by time and process, so runs sharing a directory do not overwrite each other's shards
+            name = f"results-{time.time_ns()}-{os.getpid()}.npz"
+            partial_path = os.path.join(self.directory, f".partial-{name}")
+            np.savez_compressed(partial_path, **columns)
+            os.replace(partial_path, os.path.join(self.directory, name))
+        except Exception as e:
+            print(f"Could not save example results: {e}")
+
+    def save(self):
+        self.write_shard(self.take_unsaved())
+
+    def load(self):
+        for path in sorted(glob.glob(os.path.join(self.directory, "results-*.npz"))):
+            try:
+                with np.load(path, allow_pickle=False) as shard:
+                    columns = {name: shard[name] for name in shard.files}
+            except Exception as e:
+                print(f"Could not load example results from {path}: {e}")
+                continue
+            prompt_text_blob = columns["prompt_text_blob"].tobytes()
+            for prompt_hash, start, end in zip(columns["prompt_hashes"], columns["prompt_text_offsets"][:-1], columns["prompt_text_offsets"][1:]):
+                self.prompts[str(prompt_hash)] = prompt_text_blob[start:end].decode()
+            record_blob = columns["record_blob"].tobytes()
+            for model_id, prompt_id, example_id, start, end in zip(columns["record_models"], columns["record_prompts"], columns["record_examples"],
+                                                                  columns["record_offsets"][:-1], columns["record_offsets"][1:]):
+                key = (str(columns["model_names"][model_id]), str(columns["prompt_hashes"][prompt_id]), str(columns["example_hashes"][example_id]))
+                self.records[key] = record_blob[start:end].decode()
+
+    def __len__(self) -> int:
+        return len(self.records)
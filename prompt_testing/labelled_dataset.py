@@ -0,0 +1,110 @@
+import json
+import mmap
+import os
+import random
+from collections.abc import Sequence
+
+import numpy as np
+
+
+class RecordFile:
+    """
+    Line-per-record file, memory-mapped and read through an index of line offsets.
+
+    The index is built in one pass over the file in chunks with NumPy, so even a file of millions of lines is never
+    held in memory as Python objects. It is saved next to the file and reused while the file's size and
+    modification time are unchanged. Lines are decoded, and parsed as JSON for .jsonl files, only when accessed.
+    """
+    chunk_bytes = 64 * 1024 * 1024
+
+    def __init__(self, path: str, parse_json: bool | None = None):
+        self.path = path
+        self.parse_json = path.endswith(".jsonl") if parse_json is None else parse_json
+        self.size = os.path.getsize(path)
+        self.file = open(path, "rb")
+        # An empty file cannot be memory-mapped, it has no records anyway
+        self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size > 0 else b""
+        self.offsets = self.load_offsets()
+
+    def get_index_path(self) -> str:
+        return self.path + ".offsets.npz"
+
+    def load_offsets(self) -> np.ndarray:
+        modified_ns = os.stat(self.path).st_mtime_ns
+        try:
+            with np.load(self.get_index_path()) as index:
+                if int(index["size"]) == self.size and int(index["modified_ns"]) == modified_ns:
+                    return index["offsets"]
+        except Exception:
+            # A missing or unreadable index is built again
+            pass
+
+        offsets = self.build_offsets()
+        try:
+            np.savez(self.get_index_path(), offsets=offsets, size=self.size, modified_ns=modified_ns)
+        except OSError as e:
+            print(f"Could not save the line index of {self.path}: {e}")
+        return offsets
+
+    def build_offsets(self) -> np.ndarray:
+        # Record i spans offsets[i] to offsets[i + 1], a last line without a newline is still a record
+        line_starts = [np.zeros(1, dtype=np.int64)]
+        for start in range(0, self.size, self.chunk_bytes):
+            chunk = np.frombuffer(self.mmap, dtype=np.uint8, count=min(self.chunk_bytes, self.size - start), offset=start)
+            line_starts.append(np.flatnonzero(chunk == ord("\n")).astype(np.int64) + start + 1)
+        offsets = np.concatenate(line_starts)
+        if offsets[-1] != self.size:
+            offsets = np.append(offsets, self.size)
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def get_record(self, index: int):
+        line = self.mmap[self.offsets[index]:self.offsets[index + 1]].decode()
+        return json.loads(line) if self.parse_json else line
+
+
+class RecordView(Sequence):
+    """Records of a RecordFile at the given indices, or all of them, decoded when accessed."""
+    def __init__(self, record_file: RecordFile, indices: np.ndarray | None = None):
+        self.record_file = record_file
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.record_file) if self.indices is None else len(self.indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            indices = np.arange(len(self.record_file), dtype=np.int64) if self.indices is None else self.indices
+            return RecordView(self.record_file, indices[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Record {index} out of range")
+        return self.record_file.get_record(int(index if self.indices is None else self.indices[index]))
+
+
+class LabelledDataset:
+    """
+    Inputs and expected outputs read lazily from a line-per-input file and a JSONL file of expected outputs.
+
+    `get_split` samples the training examples by index, so only the sampled records are ever read.
+    """
+    def __init__(self, input_path: str, output_path: str):
+        self.inputs = RecordFile(input_path, parse_json=False)
+        self.expected_outputs = RecordFile(output_path, parse_json=True)
+        if len(self.inputs) != len(self.expected_outputs):
+            print(f"{input_path} has {len(self.inputs)} lines and {output_path} has {len(self.expected_outputs)}, only the first {len(self)} of each are used")
+
+    def __len__(self) -> int:
+        return min(len(self.inputs), len(self.expected_outputs))
+
+    def get_split(self, size: int, seed: int | None = None) -> tuple[RecordView, RecordView]:
+        """Samples `size` examples in random order, with a generator seeded by `seed`, or the global one if None."""
+        generator = random.Random(seed) if seed is not None else random
+        indices = np.array(generator.sample(range(len(self)), min(size, len(self))), dtype=np.int64)
+        return RecordView(self.inputs, indices), RecordView(self.expected_outputs, indices)
+
+    def get_all(self) -> tuple[RecordView, RecordView]:
+        return RecordView(self.inputs)[:len(self)], RecordView(self.expected_outputs)[:len(self)]
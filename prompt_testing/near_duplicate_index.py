@@ -0,0 +1,113 @@
+import re
+import zlib
+
+import numpy as np
+
+from prompt_testing.score_store import ScoreStore
+from telemetry import telemetry
+
+
+class NearDuplicateIndex:
+    """
+    MinHash signatures of word shingles of known prompts, with locality-sensitive hashing to find near duplicates.
+
+    A prompt's estimated Jaccard similarity to another is the fraction of equal MinHash values. Signatures are
+    split into bands and each band is hashed into a bucket, so a lookup only compares against prompts which share a
+    bucket. Lookups stay fast however many prompts are indexed. Bands are sized so prompts well below `threshold`
+    already become candidates, and candidates are then checked against the threshold on their full signature.
+
+    Candidates within `threshold` of a known prompt are dropped with the "skip" policy. With the "inherit" policy,
+    they are given the known prompt's stored score, so they enter the archive without evaluation calls.
+    """
+    prime = (1 << 31) - 1
+
+    def __init__(self, threshold: float = 0.9, policy: str = "skip", num_permutations: int = 128, shingle_size: int = 3, seed: int = 0):
+        self.threshold = threshold
+        self.policy = policy
+        self.shingle_size = shingle_size
+        generator = np.random.default_rng(seed)
+        self.multipliers = generator.integers(1, self.prime, num_permutations, dtype=np.uint64)
+        self.offsets = generator.integers(0, self.prime, num_permutations, dtype=np.uint64)
+        self.rows_per_band = self.get_rows_per_band(num_permutations, threshold)
+        self.buckets = [{} for _ in range(num_permutations // self.rows_per_band)]
+        self.prompts = []
+        self.signatures = []
+        self.indexed = set()
+        self.stats = {"checked": 0, "skipped": 0, "inherited": 0}
+
+    @staticmethod
+    def get_rows_per_band(num_permutations: int, threshold: float) -> int:
+        # The similarity at which a pair becomes a candidate with probability 1/2 is about (1 / bands) ** (1 / rows),
+        # the most rows which keep it well below the threshold give the fewest false candidates without missing matches
+        rows_per_band = 1
+        for rows in range(1, num_permutations + 1):
+            if num_permutations % rows == 0 and (rows / num_permutations) ** (1 / rows) <= threshold - 0.1:
+                rows_per_band = rows
+        return rows_per_band
+
+    def get_signature(self, prompt: str) -> np.ndarray:
+        words = re.findall(r"\w+", prompt.lower())
+        shingles = [" ".join(words[i:i + self.shingle_size]) for i in range(max(1, len(words) - self.shingle_size + 1))]
+        hashes = np.array([zlib.crc32(shingle.encode()) for shingle in shingles], dtype=np.uint64)
+        return ((self.multipliers[:, None] * hashes[None, :] + self.offsets[:, None]) % self.prime).min(axis=1).astype(np.uint32)
+
+    def get_bands(self, signature: np.ndarray) -> list[bytes]:
+        return [signature[start:start + self.rows_per_band].tobytes() for start in range(0, len(signature), self.rows_per_band)]
+
+    def add(self, prompt: str, signature: np.ndarray | None = None):
+        if prompt in self.indexed:
+            return
+        if signature is None:
+            signature = self.get_signature(prompt)
+        self.indexed.add(prompt)
+        prompt_index = len(self.prompts)
+        self.prompts.append(prompt)
+        self.signatures.append(signature)
+        for band_buckets, band in zip(self.buckets, self.get_bands(signature)):
+            band_buckets.setdefault(band, []).append(prompt_index)
+
+    def find(self, signature: np.ndarray) -> tuple[str, float] | None:
+        """Returns the most similar known prompt at or above the threshold, with its estimated similarity."""
+        candidate_indices = set()
+        for band_buckets, band in zip(self.buckets, self.get_bands(signature)):
+            candidate_indices.update(band_buckets.get(band, ()))
+        best = None
+        for prompt_index in candidate_indices:
+            similarity = float(np.mean(self.signatures[prompt_index] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (self.prompts[prompt_index], similarity)
+        return best
+
+    def filter(self, candidates: list[str], score_store: ScoreStore | None = None) -> list[str]:
+        """
+        Returns the candidates which still need evaluating. Nothing is indexed here, candidates are added once they are
+        evaluated, so ones dropped by a later screen do not hide their near duplicates in later rounds.
+        """
+        kept = []
+        # Kept candidates of this call, so near duplicates within one round are caught before any of them is indexed
+        seen = []
+        with telemetry.time("near_duplicate_lookup"):
+            for candidate in candidates:
+                self.stats["checked"] += 1
+                signature = self.get_signature(candidate)
+                match = self.find(signature)
+                if match is None:
+                    if any(float(np.mean(seen_signature == signature)) >= self.threshold for seen_signature in seen):
+                        self.stats["skipped"] += 1
+                        telemetry.increment("near_duplicates_skipped")
+                        continue
+                    seen.append(signature)
+                    kept.append(candidate)
+                    continue
+
+                # A known prompt may not have a full score yet, e.g. if its evaluation failed, its duplicates are skipped
+                known_score = score_store.peek(match[0]) if score_store is not None and self.policy == "inherit" else None
+                if known_score is not None:
+                    score_store.set(candidate, known_score)
+                    self.stats["inherited"] += 1
+                    telemetry.increment("near_duplicates_inherited")
+                    kept.append(candidate)
+                else:
+                    self.stats["skipped"] += 1
+                    telemetry.increment("near_duplicates_skipped")
+        return kept
@@ -0,0 +1,48 @@
+from collections.abc import Sequence
+
+from custom_converters.converter import Converter
+from prompt_testing.batch_scoring import BatchScorer, Evaluator, RecordParser
+from prompt_testing.example_result_store import ExampleResultStore
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity
+
+
+class OfflineRescorer:
+    """
+    Scores prompts from their stored records on a labelled dataset, without a model or batches.
+
+    Expected outputs are only converted for examples which have records, so a large memory-mapped dataset is read
+    once for its example hashes and its other examples are never converted.
+    """
+    def __init__(self, evaluator: Evaluator, output_converter: Converter, input_converter: Converter, input_data: Sequence[str], expected_outputs: Sequence[dict]):
+        self.evaluator = evaluator
+        self.output_converter = output_converter
+        self.expected_outputs = expected_outputs
+        self.record_parser = RecordParser(output_converter, PromptTesterObjectSimilarity.records_key)
+        self.batch_scorer = BatchScorer(evaluator)
+        self.expected_converted = {}
+        self.expected_value_sets = {}
+        # Hashed like the tester hashes examples, so records stored by a run are found here
+        self.example_hashes = [
+            ExampleResultStore.get_hash(PromptTesterObjectSimilarity.format_example_payload(input_converter, example))
+            for example in zip(input_data, expected_outputs)
+        ]
+
+    def score_records(self, records: dict[str, dict | None]) -> tuple[tuple[float, dict, dict | None], int]:
+        """Returns the score of a prompt over the examples it has records for, and the number of those examples."""
+        # Older stores may hold None for a malformed record, which a run sends to the model again rather than scoring
+        covered_indices = [index for index, example_hash in enumerate(self.example_hashes) if records.get(example_hash) is not None]
+        for index in covered_indices:
+            self.convert_expected(index)
+        batch_score = self.batch_scorer.score_converted_batch(
+            [self.record_parser.convert_record(records[self.example_hashes[index]]) for index in covered_indices],
+            [self.expected_converted[index] for index in covered_indices],
+            [self.expected_value_sets[index] for index in covered_indices],
+        )
+        return self.batch_scorer.aggregate_batch_scores([batch_score], report_worst=False), len(covered_indices)
+
+    def convert_expected(self, index: int):
+        if index in self.expected_converted:
+            return
+        expected = self.output_converter.reverse_convert_single_parse(self.expected_outputs[index])
+        self.expected_converted[index] = expected
+        self.expected_value_sets[index] = self.evaluator.get_expected_value_sets(expected) if expected is not None else None
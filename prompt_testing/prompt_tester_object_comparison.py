@@ -1,198 +1,396 @@
 import asyncio
+import hashlib
 import json
+import time
 from difflib import SequenceMatcher
 from rich.progress import Progress
 
 from custom_converters.converter import Converter
+from model_caller.call_scheduler import CallPriority, estimate_tokens
 from model_caller.model_caller import ModelCaller
+from prompt_testing.batch_planner import BatchPlanner
+from prompt_testing.batch_scoring import BatchScorer, Evaluator, RecordParser
+from prompt_testing.batch_submission import BatchSubmitter
+from prompt_testing.evaluation_coordinator import EvaluationCoordinator
+from prompt_testing.evaluation_subset import EvaluationSubsetSelector
+from prompt_testing.example_result_store import ExampleResultStore
 from prompt_testing.prompt_tester import PromptTester
+from prompt_testing.score_store import ScoreStore
+from telemetry import telemetry
 
 
-class Evaluator:
-    def __init__(self, fields_to_ignore: list[str], fields_weightings: dict[str, float]):
-        self.fields_to_ignore = fields_to_ignore
-        self.fields_weightings = fields_weightings
+class BatchPlan:
+    """
+    The evaluation batches planned for a set of training examples, with the configuration hash scores under them are stored by.
 
-    def get_score_for_object(self, actual_output: dict, expected_output: dict) -> tuple[float, dict, dict]:
-        total_penalty = 0.0
-        field_scores = {}
-        list_field_metrics = {}
+    An evaluation holds on to the plan it started with, so batches can be planned again while evaluations are
+    running, and the batches started before then are still scored and stored against the plan they were sent with.
+    """
+    def __init__(self, example_indices: list[int] | None, batch_example_indices: list[list[int]], batch_max_output_tokens: list[int]):
+        # Training examples the batches cover, None for all of them
+        self.example_indices = example_indices
+        self.batch_example_indices = batch_example_indices
+        self.batch_max_output_tokens = batch_max_output_tokens
+        self.batch_payloads = []
+        self.expected_converted_batches = []
+        self.expected_value_set_batches = []
+        self.evaluation_config_hash = ""
 
-        all_keys = set(actual_output.keys()).union(set(expected_output.keys()))
-        total_fields = len(all_keys)
-
-        for key in all_keys:
-            if key in self.fields_to_ignore:
-                continue
-            actual_value = actual_output.get(key)
-            expected_value = expected_output.get(key)
-            if not isinstance(expected_value, list):
-                if expected_value is None:
-                    expected_value = []
-                else:
-                    expected_value = [expected_value]
-            if not isinstance(actual_value, list):
-                if actual_value is None:
-                    actual_value = []
-                else:
-                    actual_value = [actual_value]
-            metrics = self.compare_lists(actual_value, expected_value)
-            list_field_metrics[key] = metrics
-            penalty = metrics["false_positives"] + metrics["false_negatives"]
-            total_penalty += penalty
-        
-        overall_score = max(0.0, 1.0 - (total_penalty / total_fields))
-        return overall_score, field_scores, list_field_metrics
-
-    def compare_lists(self, actual_list, expected_list):
-        try:
-            actual_set, expected_set = set([str(item) for item in actual_list]), set([str(item) for item in expected_list])
-            true_positives = len(actual_set & expected_set)
-            false_positives = len(actual_set - expected_set)
-            false_negatives = len(expected_set - actual_set)
-            true_negatives = 0
-        except Exception as e:
-            print("Exception:", e)
-            print("Actual list:", actual_list)
-            print("Expected list:", expected_list)
-            return {
-                "true_positives": 0,
-                "false_positives": 0,
-                "false_negatives": 1,
-                "true_negatives": 0
-            }
-
-        return {
-            "true_positives": true_positives,
-            "false_positives": false_positives,
-            "false_negatives": false_negatives,
-            "true_negatives": true_negatives
-        }
 
 class PromptTesterObjectSimilarity(PromptTester):
     batch_size = 10
-    def __init__(self, model_caller: ModelCaller, input_data:list[str], expected_outputs:list[dict], evaluator: Evaluator, output_converter: Converter, input_converter: Converter, train_split):
+    records_key = "NameParses"
+    def __init__(self, model_caller: ModelCaller, input_data:list[str], expected_outputs:list[dict], evaluator: Evaluator, output_converter: Converter, input_converter: Converter, train_split, batch_submitter: BatchSubmitter | None = None, score_store: ScoreStore | None = None, columnar_scoring: bool = False, batch_planner: BatchPlanner | None = None, coordinator: EvaluationCoordinator | None = None, evaluation_subset: EvaluationSubsetSelector | None = None, example_store: ExampleResultStore | None = None):
         super().__init__(model_caller, input_data, expected_outputs, output_converter, input_converter, train_split)
         self.evaluator = evaluator
+        # When set, evaluation calls are collected per round and sent through a bulk batch endpoint instead of one by one
+        self.batch_submitter = batch_submitter
+        # When set, batches are called and scored by remote workers and only their batch scores are aggregated here
+        self.coordinator = coordinator
+        self.record_parser = RecordParser(output_converter, self.records_key)
+        self.parse_stats = self.record_parser.parse_stats
+        self.batch_scorer = BatchScorer(evaluator)
+        # When set, prompts are evaluated on a subset of the training examples which ranks them like the full set
+        self.evaluation_subset = evaluation_subset
+        self.active_example_indices = None
+        # When set, the parsed record of every example is stored per prompt, and only examples without one are sent to the model
+        self.example_store = example_store
+        if example_store is not None:
+            self.example_hashes = [ExampleResultStore.get_hash(self.get_example_payload(example)) for example in zip(self.input_data, self.expected_outputs)]
+
+        # Packs examples by token budget and sizes output limits per batch when set, otherwise batches are batch_size examples
+        self.batch_planner = batch_planner
+        self.expected_converted = [self.output_converter.reverse_convert_single_parse(expected) for expected in self.expected_outputs]
+        self.build_batches()
+        # Number of evaluations in progress, the training examples are only changed when none are running
+        self.active_evaluations = 0
+
+        # Scores all prompts of an evaluation together over interned field values when enabled
+        self.columnar_evaluator = None
+        if columnar_scoring:
+            from prompt_testing.columnar_evaluator import ColumnarEvaluator
+            self.columnar_evaluator = ColumnarEvaluator(evaluator, self.expected_converted)
+
+        self.score_store = score_store if score_store is not None else ScoreStore()
+        self.score_store.evaluation_config_hash = self.batch_plan.evaluation_config_hash
+
+    def build_batches(self):
+        # Batch payloads and expected outputs only depend on the data, so they are built once and reused for every prompt
+        examples = list(zip(self.input_data, self.expected_outputs))
+        active_indices = list(range(len(examples))) if self.active_example_indices is None else self.active_example_indices
+        if self.batch_planner is None:
+            batch_example_indices = self.batch_list(active_indices, self.batch_size)
+            plan = BatchPlan(self.active_example_indices, batch_example_indices, [5_000] * len(batch_example_indices))
+        else:
+            input_tokens = [estimate_tokens(self.get_example_payload(examples[index])) for index in active_indices]
+            output_tokens = [estimate_tokens(json.dumps(self.expected_converted[index], indent=4)) for index in active_indices]
+            planned_batches = self.batch_planner.plan(input_tokens, output_tokens)
+            plan = BatchPlan(
+                self.active_example_indices,
+                [[active_indices[position] for position in batch] for batch in planned_batches],
+                [self.batch_planner.get_max_output_tokens([output_tokens[position] for position in batch]) for batch in planned_batches],
+            )
+
+        plan.batch_payloads = [self.get_batch_payload([examples[index] for index in example_indices]) for example_indices in plan.batch_example_indices]
+        plan.expected_converted_batches = [[self.expected_converted[index] for index in example_indices] for example_indices in plan.batch_example_indices]
+        plan.expected_value_set_batches = [
+            [self.evaluator.get_expected_value_sets(expected) if expected is not None else None for expected in expected_batch]
+            for expected_batch in plan.expected_converted_batches
+        ]
+        plan.evaluation_config_hash = self.get_evaluation_config_hash(plan)
+        # Evaluations already running keep the plan they started with
+        self.batch_plan = plan
 
-    async def get_scores_for_solutions(self, prompts, progress, j):
-        tasks = [asyncio.create_task(self.get_prompt_score(prompt, progress, j, i)) for i, prompt in enumerate(prompts)]
+    def replan_batches_if_needed(self):
+        if self.batch_planner is None or not self.batch_planner.should_shrink():
+            return
+        self.batch_planner.shrink()
+        self.build_batches()
+        # Scores under the previous batches are not comparable, so stored scores are keyed by the new configuration
+        self.score_store.evaluation_config_hash = self.batch_plan.evaluation_config_hash
+        print(f"Too many truncated or malformed batches, using {len(self.batch_plan.batch_payloads)} batches of up to {self.batch_planner.target_tokens} tokens")
+
+    def set_active_examples(self, example_indices: list[int] | None):
+        """Evaluates prompts on these training examples from now on, or on all of them if None."""
+        if example_indices == self.active_example_indices:
+            return
+        self.active_example_indices = example_indices
+        self.build_batches()
+        # Scores on different examples are not comparable, and the batch payloads are part of the configuration hash
+        self.score_store.evaluation_config_hash = self.batch_plan.evaluation_config_hash
+
+    async def update_evaluation_subset(self, prompts: list[str], progress) -> bool:
+        """
+        Chooses the examples to evaluate on from the results of prompts evaluated on the full set so far, every
+        few updates after evaluating `prompts` on the full set first. Returns whether the examples changed,
+        in which case earlier scores cannot be compared with new ones.
+        """
+        if self.evaluation_subset is None or self.active_evaluations > 0:
+            return False
+        previous_indices = self.active_example_indices
+        if previous_indices is not None:
+            if not self.evaluation_subset.should_validate():
+                return False
+            self.set_active_examples(None)
+            await self.get_scores_for_solutions(prompts, progress, 0)
+
+        with telemetry.time("evaluation_subset_selection"):
+            self.set_active_examples(self.evaluation_subset.select(self.get_score_for_example_metrics))
+        if self.active_example_indices != previous_indices:
+            print(f"Evaluating on {len(self.active_example_indices) if self.active_example_indices is not None else len(self.input_data)} of {len(self.input_data)} training examples")
+        return self.active_example_indices != previous_indices
+
+    def record_example_results(self, plan: BatchPlan, prompt, batch_indices, batch_scores: list[dict]):
+        """Passes the per-example results of a prompt evaluated on the full set to the subset selector."""
+        if self.evaluation_subset is None or plan.example_indices is not None or len(batch_indices) != len(plan.batch_payloads):
+            return
+        example_results = [(0.0, {})] * len(self.input_data)
+        for batch_index, batch_score in zip(batch_indices, batch_scores):
+            # A batch cut short has no results for its last examples, they score nothing as in the aggregate score
+            for example_index, (object_score, list_field_metrics) in zip(plan.batch_example_indices[batch_index], batch_score["example_results"]):
+                example_results[example_index] = (object_score, list_field_metrics)
+        self.evaluation_subset.observe(prompt, example_results)
+
+    def get_score_for_example_metrics(self, example_metrics: list[dict]) -> float:
+        batch_score = self.batch_scorer.get_empty_batch_score()
+        for list_field_metrics in example_metrics:
+            self.batch_scorer.add_field_metrics(batch_score["list_field_metrics_sums"], list_field_metrics)
+        return self.batch_scorer.aggregate_batch_scores([batch_score], report_worst=False)[0]
+
+    def get_evaluation_config_hash(self, plan: BatchPlan) -> str:
+        """Identifies everything other than the prompt which a score under the plan depends on."""
+        evaluation_config = [
+            self.model.model_name,
+            plan.batch_payloads,
+            plan.batch_max_output_tokens,
+            plan.expected_converted_batches,
+            sorted(self.evaluator.fields_to_ignore),
+            self.evaluator.fields_weightings,
+        ]
+        return hashlib.sha256(json.dumps(evaluation_config, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def get_scores_for_solutions(self, prompts, progress, j, incumbent_score=None):
+        self.replan_batches_if_needed()
+        plan = self.batch_plan
+        # Prompts scored before under the same configuration, such as incumbents, are not evaluated again
+        known_scores = {prompt: self.score_store.get(prompt) for prompt in prompts}
+        new_prompts = [prompt for prompt, score in known_scores.items() if score is None]
+        self.active_evaluations += 1
+        try:
+            new_scores = await self.evaluate_prompts(plan, new_prompts, progress, j, incumbent_score)
+        finally:
+            self.active_evaluations -= 1
+        known_scores.update(zip(new_prompts, new_scores))
+        return [known_scores[prompt] for prompt in prompts]
+
+    async def evaluate_prompts(self, plan: BatchPlan, prompts, progress, j, incumbent_score=None):
+        if self.columnar_evaluator is not None:
+            return await self.get_prompt_scores_columnar(plan, prompts, progress, j)
+        tasks = [asyncio.create_task(self.get_prompt_score(plan, prompt, progress, j, i)) for i, prompt in enumerate(prompts)]
         return await asyncio.gather(*tasks)
 
-    async def call_model_and_update_progress(self, prompt, inp_out, progress, sub_progress_task):
-        res = await self.model.call_model_cached(
-            "", prompt,
-            '\n'.join([json.dumps(self.input_converter.convert(inp[1]["PresentedName"] if inp[1]["PresentedName"] is not None else ""), indent=4) for inp in inp_out]),
-            temperature=0.0, max_length=5_000
-        )
+    async def get_prompt_scores_columnar(self, plan: BatchPlan, prompts, progress, j):
+        results_per_prompt = await asyncio.gather(*[self.get_batch_results(plan, prompt, progress, j, i) for i, prompt in enumerate(prompts)])
+        records_per_prompt = []
+        for results in results_per_prompt:
+            records = []
+            for batch_index, (result, example_indices) in enumerate(zip(results, plan.batch_example_indices)):
+                converted = self.parse_batch_result(result, plan, batch_index)
+                if converted is not None:
+                    records += list(zip(example_indices, converted))
+            records_per_prompt.append(records)
+
+        with telemetry.time("score_prompts"):
+            scores = self.columnar_evaluator.score_prompts(records_per_prompt)
+        for prompt, score in zip(prompts, scores):
+            self.score_store.set(prompt, score, plan.evaluation_config_hash)
+        return scores
+
+    def get_batch_payload(self, inp_out) -> str:
+        return '\n'.join([self.get_example_payload(inp) for inp in inp_out])
+
+    def get_example_payload(self, inp) -> str:
+        return self.format_example_payload(self.input_converter, inp)
+
+    @staticmethod
+    def format_example_payload(input_converter: Converter, inp) -> str:
+        return json.dumps(input_converter.convert(inp[1]["PresentedName"] if inp[1]["PresentedName"] is not None else ""), indent=4)
+
+    async def call_model_and_update_progress(self, plan: BatchPlan, prompt, batch_index, progress, sub_progress_task, example_indices=None):
+        # Examples not in a planned batch are sent as a batch of their own
+        if example_indices is None:
+            example_indices = plan.batch_example_indices[batch_index]
+            payload = plan.batch_payloads[batch_index]
+            max_length = plan.batch_max_output_tokens[batch_index]
+        else:
+            payload = self.get_batch_payload([(self.input_data[index], self.expected_outputs[index]) for index in example_indices])
+            max_length = self.get_max_output_tokens(example_indices)
+        start_time = time.monotonic()
+        if self.batch_submitter is not None:
+            res = await self.batch_submitter.get_result("", prompt, payload, max_length=max_length, temperature=0.0)
+        else:
+            res = await self.model.call_model_cached(
+                "", prompt,
+                payload,
+                temperature=0.0, max_length=max_length, priority=CallPriority.EVALUATION
+            )
+        telemetry.record_latency("evaluation_batch", time.monotonic() - start_time)
+        if self.batch_planner is not None:
+            self.batch_planner.record_call(len(example_indices), prompt, payload, time.monotonic() - start_time)
         progress.update(sub_progress_task, advance=1)
         return res
 
-    async def get_prompt_score(self, prompt, progress, j, i):
-        total_score = 0.0
-        field_score_sums = {}
-        field_count = {}
-        list_field_metrics_sums = {}
-        worst_score = 1
-        worst_out = None
+    def get_max_output_tokens(self, example_indices: list[int]) -> int:
+        if self.batch_planner is None:
+            return 5_000
+        return self.batch_planner.get_max_output_tokens([estimate_tokens(json.dumps(self.expected_converted[index], indent=4)) for index in example_indices])
+
+    async def get_prompt_score(self, plan: BatchPlan, prompt, progress, j, i):
+        batch_scores = await self.get_batch_scores(plan, prompt, progress, j, i)
+        self.record_example_results(plan, prompt, range(len(plan.batch_payloads)), batch_scores)
+        score = self.batch_scorer.aggregate_batch_scores(batch_scores)
+        self.score_store.set(prompt, score, plan.evaluation_config_hash)
+        return score
+
+    async def get_batch_scores(self, plan: BatchPlan, prompt, progress, j, i, batch_indices=None) -> list[dict]:
+        if batch_indices is None:
+            batch_indices = range(len(plan.batch_payloads))
+        if self.coordinator is not None:
+            return await self.get_remote_batch_scores(plan, prompt, progress, j, i, batch_indices)
+        if self.example_store is not None:
+            return await self.get_stored_batch_scores(plan, prompt, progress, j, i, batch_indices)
 
-        input_output_batches = list(self.batch_list(list(zip(self.input_data, self.expected_outputs)), self.batch_size))
+        results = await self.get_batch_results(plan, prompt, progress, j, i, batch_indices)
+        with telemetry.time("score_prompts"):
+            return [self.score_batch_result(result, plan, batch_index) for result, batch_index in zip(results, batch_indices)]
 
-        sub_progress_task = progress.add_task(f"[red]Evaluating prompt {i} for search space {j}...", total=len(input_output_batches))
+    async def get_stored_batch_scores(self, plan: BatchPlan, prompt, progress, j, i, batch_indices) -> list[dict]:
+        """Scores batches from the stored records of the prompt, calling the model only for examples without one."""
+        model_name = self.model.model_name
+        prompt_hash = self.example_store.add_prompt(prompt)
+        converted_records = {}
+        calls = []
+        unbatched_indices = []
+        for batch_index in batch_indices:
+            missing_indices = []
+            for example_index in plan.batch_example_indices[batch_index]:
+                found, record = self.example_store.get(model_name, prompt_hash, self.example_hashes[example_index])
+                # Stores written before malformed records were left out may hold None, those examples are tried again
+                if found and record is not None:
+                    converted_records[example_index] = self.record_parser.convert_record(record)
+                else:
+                    missing_indices.append(example_index)
+            if len(missing_indices) == len(plan.batch_example_indices[batch_index]):
+                # A batch without stored records is sent as planned, so it shares cached responses with runs without the store
+                calls.append((batch_index, None))
+            else:
+                unbatched_indices += missing_indices
+        calls += [(None, example_indices) for example_indices in self.batch_list(unbatched_indices, self.batch_size)]
+        telemetry.increment("example_store_hits", len(converted_records))
+
+        if calls:
+            sub_progress_task = progress.add_task(f"[red]Evaluating prompt {i} for search space {j}...", total=len(calls))
+            if self.batch_submitter is None:
+                await self.model.get_context_cache(prompt)
+            results = await asyncio.gather(*[
+                self.call_model_and_update_progress(plan, prompt, batch_index, progress, sub_progress_task, example_indices)
+                for batch_index, example_indices in calls
+            ])
+            for (batch_index, example_indices), result in zip(calls, results):
+                if example_indices is None:
+                    example_indices = plan.batch_example_indices[batch_index]
+                raw_records, converted = self.record_parser.parse_result(result)
+                self.record_parse(plan, len(example_indices), converted)
+                if converted is None:
+                    continue
+                for position, (example_index, converted_record) in enumerate(zip(example_indices, converted)):
+                    converted_records[example_index] = converted_record
+                    # Only well-formed records read one by one are stored, examples of unparseable or cut short responses
+                    # and malformed records are tried again next time
+                    if raw_records is not None and converted_record is not None:
+                        self.example_store.set(model_name, prompt_hash, self.example_hashes[example_index], raw_records[position])
+
+        with telemetry.time("score_prompts"):
+            return [
+                self.batch_scorer.score_converted_batch(
+                    [converted_records.get(example_index) for example_index in plan.batch_example_indices[batch_index]],
+                    plan.expected_converted_batches[batch_index],
+                    plan.expected_value_set_batches[batch_index],
+                )
+                for batch_index in batch_indices
+            ]
+
+    async def get_remote_batch_scores(self, plan: BatchPlan, prompt, progress, j, i, batch_indices) -> list[dict]:
+        sub_progress_task = progress.add_task(f"[red]Evaluating prompt {i} for search space {j} on workers...", total=len(batch_indices))
+
+        async def get_remote_batch_score(batch_index):
+            job = {
+                "prompt": prompt,
+                "payload": plan.batch_payloads[batch_index],
+                "max_length": plan.batch_max_output_tokens[batch_index],
+                "expected": plan.expected_converted_batches[batch_index],
+            }
+            metrics = await self.coordinator.score_batch(job)
+            progress.update(sub_progress_task, advance=1)
+            if metrics is None:
+                return self.batch_scorer.get_empty_batch_score()
+            self.record_remote_metrics(plan, prompt, batch_index, metrics)
+            return metrics["batch_score"]
+
+        return await asyncio.gather(*[get_remote_batch_score(batch_index) for batch_index in batch_indices])
+
+    def record_remote_metrics(self, plan: BatchPlan, prompt, batch_index, metrics: dict):
+        """Counts a batch which was parsed on a worker, as if it had been parsed here."""
+        self.parse_stats["responses"] += 1
+        self.parse_stats["failed_responses"] += 0 if metrics["parsed"] else 1
+        self.parse_stats["records"] += metrics["records"]
+        self.parse_stats["failed_records"] += metrics["failed_records"]
+        telemetry.increment("parse_responses")
+        telemetry.increment("parse_failed_responses", 0 if metrics["parsed"] else 1)
+        telemetry.increment("parse_records", metrics["records"])
+        telemetry.increment("parse_failed_records", metrics["failed_records"])
+        telemetry.record_latency("evaluation_batch", metrics["seconds"])
+        if self.batch_planner is not None:
+            batch_size = len(plan.batch_example_indices[batch_index])
+            self.batch_planner.record_call(batch_size, prompt, plan.batch_payloads[batch_index], metrics["seconds"])
+            if plan is self.batch_plan:
+                self.batch_planner.record_parse_outcome(batch_size, metrics["failed"])
+
+    async def get_batch_results(self, plan: BatchPlan, prompt, progress, j, i, batch_indices=None) -> list[str]:
+        if batch_indices is None:
+            batch_indices = range(len(plan.batch_payloads))
+
+        sub_progress_task = progress.add_task(f"[red]Evaluating prompt {i} for search space {j}...", total=len(batch_indices))
+
+        if self.batch_submitter is None:
+            # Every batch repeats the prompt, so it is cached on the provider once before the batches are sent
+            await self.model.get_context_cache(prompt)
 
         tasks = [
-            asyncio.create_task(self.call_model_and_update_progress(prompt, inp_out, progress, sub_progress_task))
-            for inp_out in input_output_batches
+            asyncio.create_task(self.call_model_and_update_progress(plan, prompt, batch_index, progress, sub_progress_task))
+            for batch_index in batch_indices
         ]
 
-        results = await asyncio.gather(*tasks)
-
-        for result, inp_out in zip(results, input_output_batches):
-            stripped_result = self.get_outer_curly_bracket_value(result)
-            try:
-                result_obj = json.loads(stripped_result)
-            except Exception as e:
-                # print()
-                print(f"Could not parse result: {e}")
-                # print(f"result: \n{stripped_result}\n{result}")
-                continue
-
-            converted = self.output_converter.convert(result_obj)
-
-            for (res, (i, expected)) in zip(converted, inp_out):
-                expected_converted = self.output_converter.reverse_convert_single_parse(expected)
-                if res is None:
-                    object_score = 0
-                    field_scores = {}
-                    list_field_metrics = {}
-                else:
-                    object_score, field_scores, list_field_metrics = self.evaluator.get_score_for_object(res, expected_converted)
-                if object_score < worst_score:
-                    worst_score = object_score
-                    worst_out = expected_converted
-                    print("actual:")
-                    print(res)
-                    print("expected_converted:")
-                    print(worst_out)
-                    print()
-                total_score += object_score
-
-                for field, score in field_scores.items():
-                    field_score_sums[field] = field_score_sums.get(field, 0) + score
-                    field_count[field] = field_count.get(field, 0) + 1
-
-                for field, metrics in list_field_metrics.items():
-                    if field not in list_field_metrics_sums:
-                        list_field_metrics_sums[field] = metrics
-                    else:
-                        for key in metrics:
-                            list_field_metrics_sums[field][key] += metrics[key]
-
-        num_inputs = float(len(self.input_data))
-        average_field_scores = {}
-
-        for field in field_score_sums:
-            average_field_scores[field] = field_score_sums[field] / field_count[field]
-
-        for field, metrics in list_field_metrics_sums.items():
-            tp, fp, fn = metrics["true_positives"], metrics["false_positives"], metrics["false_negatives"]
-            precision = tp / (tp + fp) if (tp + fp) > 0 else 0
-            recall = tp / (tp + fn) if (tp + fn) > 0 else 0
-            f1_score = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
-            average_field_scores[field] = f1_score
-
-        return (
-            (sum(average_field_scores.values()) / len(average_field_scores)) if (len(average_field_scores)> 0) else 0,
-            average_field_scores,
-            worst_out
-        )
+        return await asyncio.gather(*tasks)
+
+    def score_batch_result(self, result, plan: BatchPlan, batch_index) -> dict:
+        converted = self.parse_batch_result(result, plan, batch_index)
+        return self.batch_scorer.score_converted_batch(converted, plan.expected_converted_batches[batch_index], plan.expected_value_set_batches[batch_index])
+
+    def parse_batch_result(self, result, plan: BatchPlan | None = None, batch_index: int | None = None) -> list | None:
+        """
+        Converts a model response to a list of output objects, or None if it cannot be parsed.
+        Records are converted one by one, so a malformed record is kept as None in its position and the rest are still scored.
+        """
+        converted = self.record_parser.convert_batch_result(result)
+        if plan is not None and batch_index is not None:
+            self.record_parse(plan, len(plan.batch_example_indices[batch_index]), converted)
+        return converted
+
+    def record_parse(self, plan: BatchPlan, batch_size: int, converted: list | None):
+        # Batches of an earlier plan say nothing about whether the current one should shrink
+        if self.batch_planner is not None and plan is self.batch_plan:
+            self.batch_planner.record_parse(batch_size, converted)
 
     def batch_list(self, lst, batch_size):
         return [lst[i:i + batch_size] for i in range(0, len(lst), batch_size)]
-
-    def get_outer_curly_bracket_value(self, s):
-        # Initialize a variable to store the result
-        result = ''
-        # Flag to indicate if we're inside the outer curly brackets
-        inside_outer = False
-        # Counter to track the nesting level of curly brackets
-        brace_count = 0
-        
-        if s is None:
-            return result
-
-        for char in s:
-            if char == '{':
-                if brace_count == 0:
-                    inside_outer = True
-                brace_count += 1
-            elif char == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    inside_outer = False
-                    break
-
-            if inside_outer:
-                result += char
-
-        return result+"}"
\ No newline at end of file
@@ -0,0 +1,79 @@
+import asyncio
+import math
+import random
+
+from custom_converters.converter import Converter
+from model_caller.model_caller import ModelCaller
+from prompt_testing.prompt_tester_object_comparison import BatchPlan, PromptTesterObjectSimilarity, Evaluator
+
+
+class PromptTesterRacing(PromptTesterObjectSimilarity):
+    """
+    Evaluates candidates on growing subsets of the training batches (successive halving of the data).
+
+    After each stage a candidate is dropped if the upper confidence bound of its score falls below the
+    incumbent score for its search space, so only contenders are evaluated on the full set.
+    Dropped candidates return their partial score, which is always below the incumbent, and are not stored.
+    """
+    racing_fractions = (0.125, 0.25, 0.5, 1.0)
+
+    def __init__(self, model_caller: ModelCaller, input_data:list[str], expected_outputs:list[dict], evaluator: Evaluator, output_converter: Converter, input_converter: Converter, train_split, confidence_z: float = 2.0, min_racing_batches: int = 3, **kwargs):
+        super().__init__(model_caller, input_data, expected_outputs, evaluator, output_converter, input_converter, train_split, **kwargs)
+        self.confidence_z = confidence_z
+        self.min_racing_batches = min_racing_batches
+        self.racing_stats = {"candidates": 0, "dropped": 0, "batches_evaluated": 0, "batches_without_racing": 0}
+
+    def build_batches(self):
+        super().build_batches()
+        # Every candidate is raced over the same batch order, so early stages of different candidates share cached calls
+        self.batch_plan.racing_batch_order = list(range(len(self.batch_plan.batch_payloads)))
+        random.shuffle(self.batch_plan.racing_batch_order)
+
+    async def evaluate_prompts(self, plan: BatchPlan, prompts, progress, j, incumbent_score=None):
+        if incumbent_score is None:
+            return await super().evaluate_prompts(plan, prompts, progress, j)
+        tasks = [asyncio.create_task(self.race_prompt(plan, prompt, progress, j, i, incumbent_score)) for i, prompt in enumerate(prompts)]
+        return await asyncio.gather(*tasks)
+
+    async def race_prompt(self, plan: BatchPlan, prompt, progress, j, i, incumbent_score):
+        num_batches = len(plan.batch_payloads)
+        evaluated_indices = []
+        batch_scores = []
+        self.racing_stats["candidates"] += 1
+        self.racing_stats["batches_without_racing"] += num_batches
+
+        for fraction in self.racing_fractions:
+            stage_size = min(num_batches, max(self.min_racing_batches, math.ceil(fraction * num_batches)))
+            new_indices = plan.racing_batch_order[len(evaluated_indices):stage_size]
+            if not new_indices:
+                continue
+
+            batch_scores += await self.get_batch_scores(plan, prompt, progress, j, i, new_indices)
+            evaluated_indices += new_indices
+            self.racing_stats["batches_evaluated"] += len(new_indices)
+
+            if len(evaluated_indices) == num_batches:
+                break
+
+            partial_score = self.batch_scorer.aggregate_batch_scores(batch_scores, report_worst=False)
+            if self.get_upper_confidence_bound(partial_score[0], batch_scores, num_batches) < incumbent_score:
+                self.racing_stats["dropped"] += 1
+                return partial_score
+
+        # Only scores over the full set are stored, dropped candidates are raced again if they come back
+        self.record_example_results(plan, prompt, evaluated_indices, batch_scores)
+        score = self.batch_scorer.aggregate_batch_scores(batch_scores)
+        self.score_store.set(prompt, score, plan.evaluation_config_hash)
+        return score
+
+    def get_upper_confidence_bound(self, partial_score: float, batch_scores: list[dict], num_batches: int) -> float:
+        # The spread of per-batch scores estimates how far the partial score can be from the full-set score
+        per_batch_scores = [self.batch_scorer.aggregate_batch_scores([batch_score], report_worst=False)[0] for batch_score in batch_scores if batch_score["num_scored"] > 0]
+        if len(per_batch_scores) < 2:
+            return math.inf
+        mean = sum(per_batch_scores) / len(per_batch_scores)
+        variance = sum((score - mean) ** 2 for score in per_batch_scores) / (len(per_batch_scores) - 1)
+        remaining_fraction = 1 - len(batch_scores) / num_batches
+        # Finite population correction, the bound tightens to the exact score as the whole set is evaluated
+        standard_error = math.sqrt(variance / len(per_batch_scores) * remaining_fraction)
+        return partial_score + self.confidence_z * standard_error
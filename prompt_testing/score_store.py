@@ -0,0 +1,52 @@
+import hashlib
+
+
+class ScoreStore:
+    """
+    Scores of fully evaluated prompts, keyed by prompt hash and evaluation configuration.
+
+    The evaluation is deterministic for a fixed dataset, model and evaluator, so a prompt that has already
+    been scored under the same configuration reuses its (score, field_scores, worst_example) tuple.
+    """
+    def __init__(self, evaluation_config_hash: str = ""):
+        self.evaluation_config_hash = evaluation_config_hash
+        self.scores = {}
+        # Scores set since they were last taken, tracked only once set to a dict, e.g. by a checkpointed run
+        self.unsaved = None
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, prompt: str, evaluation_config_hash: str | None = None) -> str:
+        if evaluation_config_hash is None:
+            evaluation_config_hash = self.evaluation_config_hash
+        return hashlib.sha256(f"{evaluation_config_hash}\n{prompt}".encode()).hexdigest()
+
+    def get(self, prompt: str):
+        score = self.scores.get(self.get_key(prompt))
+        if score is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return score
+
+    def peek(self, prompt: str):
+        """Looks up a score without counting it as a reuse."""
+        return self.scores.get(self.get_key(prompt))
+
+    def set(self, prompt: str, score, evaluation_config_hash: str | None = None):
+        """Stores a score under the current configuration, or under the one it was evaluated with if given."""
+        key = self.get_key(prompt, evaluation_config_hash)
+        self.scores[key] = score
+        if self.unsaved is not None:
+            self.unsaved[key] = score
+
+    def take_unsaved(self) -> dict:
+        unsaved = self.unsaved or {}
+        self.unsaved = {}
+        return unsaved
+
+    def __contains__(self, prompt: str) -> bool:
+        return self.get_key(prompt) in self.scores
+
+    def __len__(self) -> int:
+        return len(self.scores)
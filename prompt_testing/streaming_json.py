@@ -0,0 +1,92 @@
+import json
+from typing import Iterator
+
+
+class StreamingRecordExtractor:
+    """
+    Extracts the elements of a JSON array from a model response in a single pass.
+
+    The scanner tracks string and escape state and the nesting depth, so each element of the array stored
+    under `records_key` is yielded as soon as its closing brace is read, as a slice of the response. A malformed
+    element only affects itself: elements which are not objects, and an element cut off at the end of the
+    response, are yielded as None so later elements keep their position.
+    """
+    def __init__(self, records_key: str = "NameParses"):
+        self.records_key = records_key
+
+    def iter_raw_records(self, text: str) -> Iterator[str | None]:
+        depth = 0
+        in_string = False
+        escaped = False
+        string_start = 0
+        last_string = None
+        expecting_array = False
+        array_depth = None
+        element_start = None
+        scalar_element = False
+
+        for i, char in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+                    last_string = text[string_start + 1:i]
+                continue
+
+            if char.isspace():
+                continue
+
+            if array_depth is not None and depth == array_depth and char not in '{,]':
+                # A string, number or null where a record is expected
+                scalar_element = True
+
+            if char == '"':
+                in_string = True
+                string_start = i
+            elif char == ':':
+                expecting_array = array_depth is None and last_string == self.records_key
+                continue
+            elif char in '{[':
+                depth += 1
+                if char == '[' and expecting_array:
+                    array_depth = depth
+                elif char == '{' and array_depth is not None and depth == array_depth + 1:
+                    element_start = i
+            elif char in '}]':
+                if char == '}' and element_start is not None and depth == array_depth + 1:
+                    yield text[element_start:i + 1]
+                    element_start = None
+                depth -= 1
+                if array_depth is not None and depth < array_depth:
+                    if scalar_element:
+                        yield None
+                    return
+            elif char == ',' and array_depth is not None and depth == array_depth:
+                if scalar_element:
+                    yield None
+                    scalar_element = False
+
+            expecting_array = False
+
+        if element_start is not None or scalar_element:
+            yield None
+
+    def found_records(self, text: str) -> bool:
+        """Whether the response contains the records key at all, as opposed to having no usable records."""
+        return f'"{self.records_key}"' in text
+
+    def iter_records(self, text: str) -> Iterator[dict | None]:
+        """Yields each element parsed to a dict, or None for an element which is not a valid JSON object."""
+        for raw_record in self.iter_raw_records(text):
+            if raw_record is None:
+                yield None
+                continue
+            try:
+                record = json.loads(raw_record)
+            except json.JSONDecodeError:
+                yield None
+                continue
+            yield record if isinstance(record, dict) else None
@@ -0,0 +1,115 @@
+import collections
+import math
+import random
+import re
+import zlib
+
+import numpy as np
+
+from telemetry import telemetry
+
+
+class SurrogateRanker:
+    """
+    Cheap local predictor of prompt scores, used to decide which candidates are worth a full evaluation.
+
+    Prompts are turned into signed hashed counts of words and word pairs plus a few length features, and a ridge
+    regression over every fully evaluated prompt predicts their score. A candidate is forwarded if its predicted
+    score is in the top `keep_fraction` of the last `window_size` predictions, so single candidates in the
+    steady-state loop are screened the same way as a round's batch. Each skipped candidate is still forwarded with
+    probability `exploration_fraction`. The share of forwarded and explored candidates which enter the archive is
+    recorded in telemetry as the surrogate's precision. If the explored share is about as high, the surrogate is
+    not telling good prompts apart. Until `min_observations` prompts have been scored, every candidate is forwarded.
+    Only the overall score is learnt, field scores are not separate targets as candidates are forwarded on the overall score alone.
+    """
+    def __init__(self, keep_fraction: float = 0.5, exploration_fraction: float = 0.1, num_features: int = 512, ridge_lambda: float = 1.0,
+                 min_observations: int = 20, window_size: int = 200, seed: int = 0):
+        self.keep_fraction = keep_fraction
+        self.exploration_fraction = exploration_fraction
+        self.num_features = num_features
+        self.ridge_lambda = ridge_lambda
+        self.min_observations = min_observations
+        dimensions = num_features + 4
+        self.feature_products = np.zeros((dimensions, dimensions))
+        self.feature_score_products = np.zeros(dimensions)
+        self.feature_sums = np.zeros(dimensions)
+        self.score_sum = 0.0
+        self.num_observations = 0
+        self.weights = None
+        self.observed = set()
+        self.recent_predictions = collections.deque(maxlen=window_size)
+        # Prompts waiting for their evaluation, with whether they were forwarded on their prediction or explored
+        self.pending = {}
+        # Candidates which fail before they are evaluated are never observed, so only the most recent ones are kept
+        self.max_pending = window_size
+        # A separate generator, so screening does not change the search's own random choices
+        self.random = random.Random(seed)
+
+    def get_features(self, prompt: str) -> np.ndarray:
+        features = np.zeros(self.num_features + 4)
+        words = re.findall(r"\w+", prompt.lower())
+        for token in words + [f"{first} {second}" for first, second in zip(words, words[1:])]:
+            token_hash = zlib.crc32(token.encode())
+            features[token_hash % self.num_features] += 1.0 if token_hash & 0x80000000 else -1.0
+        norm = np.linalg.norm(features[:self.num_features])
+        if norm > 0:
+            features[:self.num_features] /= norm
+        features[self.num_features:] = [math.log1p(len(prompt)) / 10, math.log1p(len(words)) / 10, prompt.count("\n") / 100, prompt.count("{") / 10]
+        return features
+
+    def observe(self, prompt: str, score: float | None, entered_archive: bool):
+        """Learns from a prompt's full evaluation, score is None if it was not fully evaluated."""
+        decision = self.pending.pop(prompt, None)
+        if decision is not None:
+            telemetry.increment(f"surrogate_{decision}_evaluated")
+            if entered_archive:
+                telemetry.increment(f"surrogate_{decision}_improved")
+
+        if score is None or prompt in self.observed:
+            return
+        self.observed.add(prompt)
+        features = self.get_features(prompt)
+        self.feature_products += np.outer(features, features)
+        self.feature_score_products += features * score
+        self.feature_sums += features
+        self.score_sum += score
+        self.num_observations += 1
+        self.weights = None
+
+    def fit(self):
+        # Ridge regression with an unpenalised intercept, from sums kept as prompts are observed
+        self.mean_features = self.feature_sums / self.num_observations
+        self.mean_score = self.score_sum / self.num_observations
+        covariance = self.feature_products - self.num_observations * np.outer(self.mean_features, self.mean_features)
+        cross_covariance = self.feature_score_products - self.num_observations * self.mean_features * self.mean_score
+        self.weights = np.linalg.solve(covariance + self.ridge_lambda * np.eye(len(self.feature_sums)), cross_covariance)
+
+    def predict(self, prompt: str) -> float:
+        if self.weights is None:
+            self.fit()
+        return self.mean_score + float((self.get_features(prompt) - self.mean_features) @ self.weights)
+
+    def select(self, candidates: list[str]) -> list[str]:
+        """Returns the candidates which should be fully evaluated."""
+        if not candidates or self.num_observations < self.min_observations:
+            return candidates
+
+        with telemetry.time("surrogate_rank"):
+            predictions = [self.predict(candidate) for candidate in candidates]
+        self.recent_predictions.extend(predictions)
+        threshold = np.quantile(list(self.recent_predictions), 1 - self.keep_fraction)
+
+        selected = []
+        for candidate, prediction in zip(candidates, predictions):
+            if prediction >= threshold:
+                self.pending[candidate] = "forwarded"
+            elif self.random.random() < self.exploration_fraction:
+                self.pending[candidate] = "explored"
+            else:
+                continue
+            selected.append(candidate)
+        while len(self.pending) > self.max_pending:
+            del self.pending[next(iter(self.pending))]
+        telemetry.increment("surrogate_screened", len(candidates))
+        telemetry.increment("surrogate_skipped", len(candidates) - len(selected))
+        return selected
@@ -0,0 +1,71 @@
+import argparse
+import json
+
+from rich.console import Console
+from rich.table import Table
+
+from custom_converters.converter import Converter
+from prompt_testing.example_result_store import ExampleResultStore
+from prompt_testing.labelled_dataset import LabelledDataset
+from prompt_testing.offline_rescoring import OfflineRescorer
+from prompt_testing.prompt_tester_object_comparison import Evaluator
+from run_map_elites import load_converter, parse_dict
+
+
+def parse_args_and_rescore_prompts():
+    parser = argparse.ArgumentParser(description="Score the prompts in an example store again, without model calls.")
+    parser.add_argument("--example_store_dir", type=str, help="Directory of the example store written by run_map_elites.py", required=True)
+    parser.add_argument("-i", "--input_data", type=str, help="Name of input data file within folder, e.g. \"person_names_input.json\"", required=True)
+    parser.add_argument("-o", "--output_data", type=str, help="Name of expected output data file within folder, e.g. \"non_latin_labelled_person_parses.json\"", required=True)
+    parser.add_argument("-f", "--fields_to_ignore", type=str, nargs="+", help="List of fields to ignore", default=[])
+    parser.add_argument("-w", "--weights", type=parse_dict, help="Fields to weight higher, formatted as a dictionary of string to float, e.g. {\"FirstName\":1.5}", default={})
+    parser.add_argument("--input_converter", type=str, help="Name of input converter class file", default="person_parse_input_converter")
+    parser.add_argument("--output_converter", type=str, help="Name of output converter class file", default="org_parse_converter")
+    parser.add_argument("--min_coverage", type=float, help="Only report prompts with stored records for at least this fraction of the examples any prompt has records for", default=1.0)
+    parser.add_argument("--top", type=int, help="Number of best prompts to show", default=20)
+    parser.add_argument("--output_path", type=str, help="File to write every prompt's score to as JSON, not written if not set", default=None)
+    args = parser.parse_args()
+
+    if args.output_data.endswith(".jsonl"):
+        # Large labelled sets are memory-mapped, records are decoded one at a time while hashing the examples
+        input_data, output_data = LabelledDataset(f"data/input_data/{args.input_data}", f"data/expected_output_data/{args.output_data}").get_all()
+    else:
+        with open(f"data/input_data/{args.input_data}", "r") as f:
+            input_data = f.readlines()
+        with open(f"data/expected_output_data/{args.output_data}", "r") as f:
+            output_data = json.load(f)
+
+    store = ExampleResultStore(args.example_store_dir)
+    output_converter = load_converter(args.output_converter)() if args.output_converter else Converter()
+    input_converter = load_converter(args.input_converter)() if args.input_converter else Converter()
+    rescorer = OfflineRescorer(Evaluator(args.fields_to_ignore, args.weights), output_converter, input_converter, input_data, output_data)
+
+    records_by_prompt = store.get_records_by_prompt()
+    # Runs only evaluate their training split, so coverage is measured against the examples the store has records for
+    stored_example_hashes = {example_hash for records in records_by_prompt.values() for example_hash in records}
+    num_stored_examples = sum(example_hash in stored_example_hashes for example_hash in rescorer.example_hashes)
+
+    results = []
+    for (model_name, prompt_hash), records in records_by_prompt.items():
+        score, num_covered = rescorer.score_records(records)
+        if num_covered == 0 or num_covered < args.min_coverage * num_stored_examples:
+            continue
+        results.append({"model": model_name, "prompt_hash": prompt_hash, "score": score[0], "field_scores": score[1], "examples": num_covered, "prompt": store.prompts.get(prompt_hash)})
+    results.sort(key=lambda result: result["score"], reverse=True)
+
+    table = Table(title=f"Best of {len(results)} prompts covering at least {args.min_coverage:.0%} of {num_stored_examples} stored examples")
+    table.add_column("Model", style="cyan")
+    table.add_column("Prompt", style="magenta")
+    table.add_column("Examples", style="blue")
+    table.add_column("Score", style="green")
+    for result in results[:args.top]:
+        table.add_row(result["model"], (result["prompt"] or result["prompt_hash"])[:200] + "...", str(result["examples"]), f"{result['score']:.4f}")
+    Console().print(table)
+
+    if args.output_path:
+        with open(args.output_path, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    parse_args_and_rescore_prompts()
@@ -0,0 +1,81 @@
+import math
+import time
+
+from telemetry import telemetry
+
+
+class RunBudget:
+    """
+    Limits on the model calls, tokens, estimated spend and wall-clock time of a run, plus a plateau stop.
+
+    Usage is read from the process-wide telemetry, so it covers every model call of the run, including those
+    evaluation workers report. Limits are checked between rounds, so a run can go over a limit by at most one
+    round. As the least remaining fraction of any limit falls below `taper_fraction`, `get_fan_out` shrinks the
+    number of mutations and crossovers per round, down to `min_fan_out_scale` of the full number. The run also stops
+    once the sum of the best scores of all search spaces has improved by less than `min_improvement` over the last
+    `plateau_rounds` rounds.
+    """
+    def __init__(self, max_calls: int | None = None, max_tokens: int | None = None, max_cost_usd: float | None = None, max_wall_seconds: float | None = None,
+                 plateau_rounds: int | None = None, min_improvement: float = 0.001, taper_fraction: float = 0.5, min_fan_out_scale: float = 0.25):
+        self.limits = {"calls": max_calls, "tokens": max_tokens, "cost_usd": max_cost_usd, "wall_seconds": max_wall_seconds}
+        self.plateau_rounds = plateau_rounds
+        self.min_improvement = min_improvement
+        self.taper_fraction = taper_fraction
+        self.min_fan_out_scale = min_fan_out_scale
+        self.start_time = time.monotonic()
+        self.archive_score_history = []
+        # Usage of the run before it was resumed, which the telemetry of this process has not seen
+        self.previous_usage = {"calls": 0, "tokens": 0, "cost_usd": 0.0, "wall_seconds": 0.0}
+
+    def get_usage(self) -> dict[str, float]:
+        snapshot = telemetry.get_snapshot()
+        operations = snapshot["operations"]
+        usage = {
+            "calls": sum(operations.get(operation, {}).get("count", 0) for operation in telemetry.model_call_operations),
+            "tokens": sum(count for key, count in snapshot["tokens"].items() if not key.endswith("/cached_input")),
+            "cost_usd": snapshot["spend_usd"],
+            "wall_seconds": time.monotonic() - self.start_time,
+        }
+        return {name: self.previous_usage[name] + value for name, value in usage.items()}
+
+    def get_state(self) -> dict:
+        return {"usage": self.get_usage(), "archive_score_history": list(self.archive_score_history)}
+
+    def load_state(self, state: dict):
+        """Continues the usage and plateau window of a checkpointed run, counting usage since this process started on top."""
+        self.previous_usage = {name: 0 for name in self.previous_usage}
+        usage = self.get_usage()
+        self.previous_usage = {name: state["usage"][name] - usage[name] for name in self.previous_usage}
+        self.archive_score_history = list(state["archive_score_history"])
+
+    def get_remaining_fraction(self) -> float:
+        """Smallest fraction left of any limit, 1 if there are no limits."""
+        usage = self.get_usage()
+        fractions = [1 - usage[name] / limit for name, limit in self.limits.items() if limit is not None and limit > 0]
+        return max(0.0, min(fractions, default=1.0))
+
+    def get_fan_out(self, full_fan_out: int) -> int:
+        if full_fan_out == 0:
+            return 0
+        scale = min(1.0, max(self.min_fan_out_scale, self.get_remaining_fraction() / self.taper_fraction))
+        return max(1, math.ceil(full_fan_out * scale))
+
+    def record_round(self, best_score_per_space: dict[str, float]):
+        # Filling an empty search space counts as an improvement, as its score is added to the sum
+        self.archive_score_history.append(sum(best_score_per_space.values()))
+
+    def reset_plateau(self):
+        """Starts the plateau window again, e.g. after the archive was scored on different examples."""
+        self.archive_score_history = []
+
+    def get_stop_reason(self) -> str | None:
+        usage = self.get_usage()
+        for name, limit in self.limits.items():
+            if limit is not None and usage[name] >= limit:
+                return f"{name.replace('_', ' ')} budget of {limit} reached ({usage[name]:.2f} used)"
+
+        if self.plateau_rounds is not None and len(self.archive_score_history) > self.plateau_rounds:
+            improvement = self.archive_score_history[-1] - self.archive_score_history[-1 - self.plateau_rounds]
+            if improvement < self.min_improvement:
+                return f"archive improved by {improvement:.4f} over the last {self.plateau_rounds} rounds"
+        return None
@@ -0,0 +1,36 @@
+import argparse
+import asyncio
+
+from custom_converters.converter import Converter
+from model_caller.call_scheduler import CallScheduler
+from model_caller.model_caller import ModelCaller
+from model_caller.sqlite_cache import SQLiteCache
+from prompt_testing.evaluation_worker import EvaluationWorker
+from run_map_elites import create_model_caller, load_converter
+
+
+def parse_args_and_run_worker():
+    parser = argparse.ArgumentParser(description="Evaluate prompts for a run_map_elites.py coordinator.")
+    parser.add_argument("--coordinator", type=str, help="Host and port of the coordinator, e.g. \"10.0.0.5:8765\"", default="127.0.0.1:8765")
+    parser.add_argument("-m", "--model", type=str, help="Model to use, from 'GPT', 'Gemini' or 'Fake'. Defaults to Gemini", default="Gemini")
+    parser.add_argument("--capacity", type=int, help="Number of batches this worker evaluates at once", default=16)
+    parser.add_argument("--name", type=str, help="Name the coordinator reports this worker by, defaults to the host name", default=None)
+    parser.add_argument("--cache_path", type=str, help="Location of the persistent model response cache, pass an empty string to keep the cache in memory", default="")
+    parser.add_argument("--requests_per_minute", type=float, help="Client-side limit on model requests per minute, unlimited if not set", default=None)
+    parser.add_argument("--tokens_per_minute", type=float, help="Client-side limit on estimated model tokens per minute, unlimited if not set", default=None)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum number of concurrent model calls, reduced automatically on rate limit errors", default=32)
+    args = parser.parse_args()
+
+    if args.cache_path:
+        ModelCaller.set_cache(SQLiteCache(args.cache_path))
+    scheduler = CallScheduler(args.requests_per_minute, args.tokens_per_minute, args.max_concurrency)
+    model_caller = create_model_caller(args.model, scheduler, args.max_concurrency)
+
+    worker = EvaluationWorker(model_caller, lambda converter_name: load_converter(converter_name)() if converter_name else Converter(), args.capacity, args.name)
+    host, port = args.coordinator.rsplit(":", 1)
+    asyncio.run(worker.run(host, int(port)))
+    print(f"Evaluated {worker.stats['jobs']} batches ({worker.stats['failed']} failed)")
+
+
+if __name__ == '__main__':
+    parse_args_and_run_worker()
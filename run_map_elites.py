@@ -9,12 +9,29 @@ import sys
 
 from custom_converters.converter import Converter
 from map_elites import MAPElites
+from map_elites_checkpoint import MAPElitesCheckpoint
+from run_budget import RunBudget
+from model_caller.call_scheduler import CallScheduler
+from model_caller.cassette import RecordingCaller, ReplayCaller
+from model_caller.fake_caller import FakeModelCaller
 from model_caller.gemini_caller import GeminiCaller
 from model_caller.gpt_caller import GPTCaller
 from model_caller.model_caller import ModelCaller
+from model_caller.sqlite_cache import SQLiteCache
+from prompt_testing.batch_planner import BatchPlanner
+from prompt_testing.batch_submission import BatchSubmitter, LocalFileBatchBackend, OpenAIBatchBackend
+from prompt_testing.evaluation_coordinator import EvaluationCoordinator
 from prompt_testing.prompt_tester import PromptTester
 from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+from prompt_testing.prompt_tester_racing import PromptTesterRacing
+from prompt_testing.evaluation_subset import EvaluationSubsetSelector
+from prompt_testing.example_result_store import ExampleResultStore
+from prompt_testing.labelled_dataset import LabelledDataset
+from prompt_testing.near_duplicate_index import NearDuplicateIndex
+from prompt_testing.surrogate_ranker import SurrogateRanker
+from solution_generator.search_space_classifier import EmbeddingSearchSpaceClassifier
 from solution_generator.solution_generator import GenerateSolution
+from telemetry import telemetry
 
 
 default_categories = {
@@ -30,15 +47,42 @@ default_categories = {
     # "Degree of Redundancy": ["Minimal", "Redundant"]
 }
 
-base_problem_definition = open("data/problem_definition/person_parsing.txt")
-
-def run_map_elites(model_caller: ModelCaller, prompt_tester: PromptTester, base_problem_definition: str, categories: list[str], rounds: int, min_spaces_with_solutions:int):
+def run_map_elites(model_caller: ModelCaller, prompt_tester: PromptTester, base_problem_definition: str, categories: list[str], rounds: int, min_spaces_with_solutions:int, classifier: str = "llm", classifier_min_margin: float = 0.02, steady_state_candidates: int | None = None, max_in_flight: int = 8, checkpoint: MAPElitesCheckpoint | None = None, resume_state: dict | None = None, budget: RunBudget | None = None, surrogate: SurrogateRanker | None = None, near_duplicate_index: NearDuplicateIndex | None = None):
     solution_generator = GenerateSolution(model_caller, base_problem_definition)
-    map_elites_runner = MAPElites(solution_generator,prompt_tester, categories, min_spaces_with_solutions)
-    asyncio.run(map_elites_runner.initialise_solutions(base_problem_definition, min_spaces_with_solutions))
+    search_space_classifier = None
+    if classifier == "embedding":
+        search_space_classifier = EmbeddingSearchSpaceClassifier(model_caller, categories, solution_generator, classifier_min_margin)
+    map_elites_runner = MAPElites(solution_generator,prompt_tester, categories, min_spaces_with_solutions, search_space_classifier=search_space_classifier, checkpoint=checkpoint, budget=budget, surrogate=surrogate, near_duplicate_index=near_duplicate_index)
+    if resume_state is not None:
+        map_elites_runner.load_state(resume_state)
+    # A single event loop for the whole run keeps the model clients' pooled connections usable between rounds
+    try:
+        asyncio.run(run_map_elites_rounds(map_elites_runner, base_problem_definition, rounds, min_spaces_with_solutions, steady_state_candidates, max_in_flight, resume_state is not None))
+    finally:
+        map_elites_runner.close()
+
+async def run_map_elites_rounds(map_elites_runner: MAPElites, base_problem_definition: str, rounds: int, min_spaces_with_solutions: int, steady_state_candidates: int | None = None, max_in_flight: int = 8, resumed: bool = False):
+    coordinator = getattr(map_elites_runner.prompt_tester, "coordinator", None)
+    try:
+        await run_map_elites_loop(map_elites_runner, base_problem_definition, rounds, min_spaces_with_solutions, steady_state_candidates, max_in_flight, resumed)
+    finally:
+        if coordinator is not None:
+            await coordinator.close()
+
+async def run_map_elites_loop(map_elites_runner: MAPElites, base_problem_definition: str, rounds: int, min_spaces_with_solutions: int, steady_state_candidates: int | None, max_in_flight: int, resumed: bool):
+    if not resumed:
+        await map_elites_runner.initialise_solutions(base_problem_definition, min_spaces_with_solutions)
     map_elites_runner.output_current_status()
-    for i in range(rounds):
-        asyncio.run(map_elites_runner.run_mutation_and_replacement())
+    if steady_state_candidates is not None:
+        await map_elites_runner.run_steady_state(steady_state_candidates, max_in_flight)
+        map_elites_runner.output_current_status()
+        return
+    for i in range(map_elites_runner.rounds_completed, rounds):
+        stop_reason = map_elites_runner.get_stop_reason()
+        if stop_reason is not None:
+            print(f"Stopping early: {stop_reason}")
+            break
+        await map_elites_runner.run_mutation_and_replacement()
         map_elites_runner.output_current_status()
 
 def parse_dict(arg):
@@ -59,6 +103,17 @@ def load_class_from_file(file_path, class_name):
 def to_camel_case(snake_str):
     return "".join(x.capitalize() for x in snake_str.lower().split("_"))
 
+def load_converter(converter_name: str):
+    return load_class_from_file("custom_converters/" + converter_name + ".py", to_camel_case(converter_name))
+
+def create_model_caller(model: str, scheduler: CallScheduler, max_concurrency: int) -> ModelCaller:
+    # Only the chosen client is created, so API keys of other providers are not needed
+    if model.lower() == "gpt":
+        return GPTCaller(scheduler, max_connections=max_concurrency)
+    if model.lower() == "fake":
+        return FakeModelCaller(scheduler)
+    return GeminiCaller(scheduler)
+
 def parse_args_and_run_map_elites():
     parser = argparse.ArgumentParser(description="Run a function with command-line arguments.")
     parser.add_argument("-f", "--fields_to_ignore", type=str, nargs="+", help="List of fields to ignore", default=[
@@ -68,7 +123,7 @@ def parse_args_and_run_map_elites():
         "IsNonLatin",
         "PresentedName"
     ])
-    parser.add_argument("-m", "--model", type=str, help="Model to use, from 'GPT' or 'Gemini'. Defaults to Gemini", default="Gemini")
+    parser.add_argument("-m", "--model", type=str, help="Model to use, from 'GPT', 'Gemini' or 'Fake', a local stand-in which needs no API key. Defaults to Gemini", default="Gemini")
     parser.add_argument("-w", "--weights", type=parse_dict, help="Fields to weight higher, formatted as a dictionary of string to float, e.g. {\"FirstName\":1.5}", default="""{                                                                                                                                                         "FamilyName": 2,
     "TopLevelBrand": 4,
     "LowLevelBrand": 2,
@@ -80,21 +135,88 @@ def parse_args_and_run_map_elites():
     parser.add_argument("-o", "--output_data", type=str, help="Name of expected output data file within folder, e.g. \"non_latin_labelled_person_parses.json\"", default="non_latin_labelled_person_parses.json",required=True)
     parser.add_argument("-c", "--categories", type=parse_dict, help="Dictionary of search space categories and values, e.g. {\"Specification Detail\": [\"Simple\", \"Medium\", \"Extremely Detailed\"]}", default=json.dumps(default_categories))
     parser.add_argument("-t", "--train_num", type=int, help="Number of examples to use for training, e.g. 600", default=600)
+    parser.add_argument("--split_seed", type=int, help="Seed of the sample of training examples taken from a .jsonl expected output file, the run's random state is used if not set", default=None)
     parser.add_argument("-n", "--num_rounds", type=int, help="Number of rounds to iterate for", default=30)
     parser.add_argument("-s", "--min_spaces", type=int, help="Minimum number of search spaces which should have solutions, a larger number means a wider range of solutions", default=10)
     parser.add_argument("--input_converter", type=str, help="Name of input converter class file", default="person_parse_input_converter")
     parser.add_argument("--output_converter", type=str, help="Name of output converter class file", default="org_parse_converter")
+    parser.add_argument("--cache_path", type=str, help="Location of the persistent model response cache, pass an empty string to keep the cache in memory", default="cache/model_responses.sqlite")
+    parser.add_argument("--cache_max_entries", type=int, help="Maximum number of responses kept in the persistent cache before least recently used entries are evicted", default=500_000)
+    parser.add_argument("--cache_ttl_days", type=float, help="Number of days a cached response stays valid", default=30)
+    parser.add_argument("--requests_per_minute", type=float, help="Client-side limit on model requests per minute, unlimited if not set", default=None)
+    parser.add_argument("--tokens_per_minute", type=float, help="Client-side limit on estimated model tokens per minute, unlimited if not set", default=None)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum number of concurrent model calls, reduced automatically on rate limit errors", default=32)
+    parser.add_argument("--batch_mode", type=str, choices=["none", "provider", "local"], help="Send each round's evaluation calls through a bulk batch endpoint, 'provider' uses the model provider's batch API and 'local' a file-based stand-in", default="none")
+    parser.add_argument("--batch_poll_seconds", type=float, help="Seconds between batch status checks in batch mode", default=30)
+    parser.add_argument("--classifier", type=str, choices=["llm", "embedding"], help="How prompts are assigned to search spaces, 'embedding' uses nearest centroid over cached embeddings with an LLM fallback for ambiguous prompts", default="llm")
+    parser.add_argument("--classifier_min_margin", type=float, help="Minimum cosine similarity margin between the two nearest search spaces before the embedding classifier falls back to the LLM", default=0.02)
+    parser.add_argument("--racing", action="store_true", help="Evaluate candidates on growing subsets of the training data, dropping those which cannot beat the incumbent of their search space")
+    parser.add_argument("--racing_confidence", type=float, help="Number of standard errors added to a candidate's partial score before comparing it with the incumbent when racing", default=2.0)
+    parser.add_argument("--batch_tokens", type=int, help="Pack evaluation batches up to this many estimated input and expected output tokens and size each call's output limit from its expected output, batches of 10 examples if not set", default=None)
+    parser.add_argument("--steady_state_candidates", type=int, help="Run this many candidates through a steady-state loop instead of generational rounds, --num_rounds is then ignored", default=None)
+    parser.add_argument("--max_in_flight", type=int, help="Number of candidates being generated, classified and evaluated at once in the steady-state loop", default=8)
+    parser.add_argument("--checkpoint_path", type=str, help="Location of the run checkpoint, saved after every round or archive insertion, pass an empty string to disable checkpoints", default="checkpoints/map_elites.json")
+    parser.add_argument("--resume", action="store_true", help="Continue the run saved at --checkpoint_path, with the same arguments it was started with")
+    parser.add_argument("--record_cassette", type=str, help="Record every model request, response and latency to this cassette path for later replay", default=None)
+    parser.add_argument("--replay_cassette", type=str, help="Serve model calls from a cassette recorded with --record_cassette instead of calling the model", default=None)
+    parser.add_argument("--replay_timings", action="store_true", help="Return replayed responses after their recorded latency instead of immediately")
+    parser.add_argument("--scoring", type=str, choices=["python", "columnar"], help="How model outputs are scored, 'columnar' scores all candidates of a round together with NumPy arrays over interned field values", default="python")
 
 
+    parser.add_argument("--context_caching", action="store_true", help="Cache each candidate prompt on the provider while its batches are evaluated, so repeated system prompt tokens are billed at the cached rate")
+    parser.add_argument("--max_calls", type=int, help="Stop the run once this many model calls have been made", default=None)
+    parser.add_argument("--max_tokens", type=int, help="Stop the run once this many input and output tokens have been used", default=None)
+    parser.add_argument("--max_cost_usd", type=float, help="Stop the run once its estimated spend reaches this many US dollars", default=None)
+    parser.add_argument("--max_wall_minutes", type=float, help="Stop the run after this many minutes", default=None)
+    parser.add_argument("--plateau_rounds", type=int, help="Stop the run once the best scores of all search spaces have improved by less than --min_improvement over this many rounds", default=None)
+    parser.add_argument("--min_improvement", type=float, help="Smallest improvement of the summed best scores which does not count as a plateau", default=0.001)
+    parser.add_argument("--surrogate_keep_fraction", type=float, help="Only fully evaluate generated prompts whose score predicted by a local surrogate model is in this top fraction of recent predictions, all are evaluated if not set", default=None)
+    parser.add_argument("--surrogate_exploration_fraction", type=float, help="Fraction of the prompts screened out by the surrogate which are evaluated anyway", default=0.1)
+    parser.add_argument("--example_store_dir", type=str, help="Directory to store the parsed model output of every prompt and example in, so evaluator and data changes can be rescored with rescore_prompts.py and only new examples are sent to the model. Not used if empty", default="")
+    parser.add_argument("--dedupe_threshold", type=float, help="Estimated Jaccard similarity of word shingles above which a generated prompt counts as a near duplicate of an evaluated prompt, no deduplication if not set", default=None)
+    parser.add_argument("--dedupe_policy", type=str, choices=["skip", "inherit"], help="Whether near duplicates are skipped or given the score of the prompt they duplicate", default="skip")
+    parser.add_argument("--subset_fraction", type=float, help="Once enough prompts have been evaluated on the full training set, evaluate on this fraction of the examples which best tells prompts apart, the full set is used if not set. Only used with generational rounds", default=None)
+    parser.add_argument("--subset_min_rank_correlation", type=float, help="Minimum Spearman correlation of prompt scores on the evaluation subset with scores on the full training set, the subset grows until it is reached", default=0.9)
+    parser.add_argument("--subset_validation_rounds", type=int, help="Number of rounds between evaluations of the elites on the full training set to check the evaluation subset still ranks prompts the same way", default=5)
+    parser.add_argument("--telemetry_path", type=str, help="JSON-lines file which gets a snapshot of latency percentiles, token counts, cache hit ratio, parse failure rate and estimated spend after every round, pass an empty string to disable", default="telemetry/metrics.jsonl")
+    parser.add_argument("--metrics_port", type=int, help="Serve the telemetry in the Prometheus text format at http://127.0.0.1:<port>/metrics, not served if not set", default=None)
+    parser.add_argument("--coordinator_port", type=int, help="Send evaluation batches to workers started with run_evaluation_worker.py which connect to this port, evaluated in this process if not set", default=None)
+    parser.add_argument("--coordinator_host", type=str, help="Address the coordinator listens on for workers, e.g. 0.0.0.0 to accept workers on other hosts", default="127.0.0.1")
     args = parser.parse_args()
-    model_caller = GeminiCaller()
-    if args.model.lower() == "gpt":
-        model_caller = GPTCaller()
-
-    with open(f"data/input_data/{args.input_data}", "r") as f:
-        input_data = f.readlines()
-    with open(f"data/expected_output_data/{args.output_data}", "r") as f:
-        output_data = json.load(f)
+
+    telemetry.set_output(args.telemetry_path or None)
+    if args.metrics_port is not None:
+        telemetry.start_server(args.metrics_port)
+
+    checkpoint = MAPElitesCheckpoint(args.checkpoint_path) if args.checkpoint_path else None
+    resume_state = None
+    if args.resume:
+        if checkpoint is None or not checkpoint.exists():
+            raise ValueError(f"No checkpoint to resume from at '{args.checkpoint_path}'")
+        resume_state = checkpoint.load()
+        # Restoring the starting random state picks the same search spaces and training examples as the original run
+        random.setstate(checkpoint.initial_random_state)
+    if args.cache_path:
+        ModelCaller.set_cache(SQLiteCache(args.cache_path, max_entries=args.cache_max_entries, ttl_seconds=args.cache_ttl_days * 24 * 60 * 60))
+
+    ModelCaller.context_caching = args.context_caching
+    scheduler = CallScheduler(args.requests_per_minute, args.tokens_per_minute, args.max_concurrency)
+    if args.replay_cassette:
+        model_caller = ReplayCaller(args.replay_cassette, replay_timings=args.replay_timings)
+    else:
+        model_caller = create_model_caller(args.model, scheduler, args.max_concurrency)
+    if args.record_cassette and not args.replay_cassette:
+        model_caller = RecordingCaller(model_caller, args.record_cassette)
+
+    if args.output_data.endswith(".jsonl"):
+        # Large labelled sets are memory-mapped and only the sampled training examples are read
+        dataset = LabelledDataset(f"data/input_data/{args.input_data}", f"data/expected_output_data/{args.output_data}")
+        input_data, output_data = dataset.get_split(args.train_num, args.split_seed)
+    else:
+        with open(f"data/input_data/{args.input_data}", "r") as f:
+            input_data = f.readlines()
+        with open(f"data/expected_output_data/{args.output_data}", "r") as f:
+            output_data = json.load(f)
     with open(f"data/problem_definition/{args.problem_definition}", "r") as f:
         problem_definition = f.read()
 
@@ -121,8 +243,55 @@ def parse_args_and_run_map_elites():
         input_converter_file = "custom_converters/"+args.input_converter+".py"
         input_converter = load_class_from_file(input_converter_file, to_camel_case(args.input_converter))
 
-    prompt_tester = PromptTesterObjectSimilarity(model_caller, input_data, output_data, Evaluator(fields_to_ignore, fields_higher_weightings), output_converter(), input_converter(), train_split=train_split)
-    run_map_elites(model_caller, prompt_tester, problem_definition, combinations, num_rounds, min_spaces_with_solutions)
+    batch_submitter = None
+    # Backends call the provider directly, the submitter records their results to the cassette when recording
+    provider_caller = model_caller.model_caller if isinstance(model_caller, RecordingCaller) else model_caller
+    if args.batch_mode == "provider":
+        if not isinstance(provider_caller, GPTCaller):
+            raise ValueError("Provider batch mode is only available for GPT models")
+        batch_submitter = BatchSubmitter(OpenAIBatchBackend(provider_caller.client, provider_caller.model_name), model_caller, poll_interval_seconds=args.batch_poll_seconds)
+    elif args.batch_mode == "local":
+        batch_submitter = BatchSubmitter(LocalFileBatchBackend(provider_caller), model_caller, poll_interval_seconds=args.batch_poll_seconds)
+
+    coordinator = None
+    if args.coordinator_port is not None:
+        if batch_submitter is not None or args.scoring == "columnar":
+            raise ValueError("Evaluation workers cannot be combined with batch mode or columnar scoring")
+        coordinator = EvaluationCoordinator(args.coordinator_host, args.coordinator_port, {
+            "fields_to_ignore": fields_to_ignore,
+            "fields_weightings": fields_higher_weightings,
+            "output_converter": args.output_converter,
+            "model_name": model_caller.model_name,
+        })
+
+    budget = None
+    if any(limit is not None for limit in [args.max_calls, args.max_tokens, args.max_cost_usd, args.max_wall_minutes, args.plateau_rounds]):
+        budget = RunBudget(args.max_calls, args.max_tokens, args.max_cost_usd, args.max_wall_minutes * 60 if args.max_wall_minutes is not None else None,
+                           args.plateau_rounds, args.min_improvement)
+
+    surrogate = SurrogateRanker(args.surrogate_keep_fraction, args.surrogate_exploration_fraction) if args.surrogate_keep_fraction is not None else None
+
+    near_duplicate_index = NearDuplicateIndex(args.dedupe_threshold, args.dedupe_policy) if args.dedupe_threshold is not None else None
+
+    evaluation_subset = None
+    if args.subset_fraction is not None:
+        if args.scoring == "columnar" or args.steady_state_candidates is not None:
+            raise ValueError("An evaluation subset cannot be combined with columnar scoring or the steady-state loop")
+        evaluation_subset = EvaluationSubsetSelector(args.subset_fraction, args.subset_min_rank_correlation, args.subset_validation_rounds)
+
+    example_store = None
+    if args.example_store_dir:
+        if coordinator is not None or args.scoring == "columnar":
+            raise ValueError("The example store cannot be combined with evaluation workers or columnar scoring")
+        example_store = ExampleResultStore(args.example_store_dir)
+
+    evaluator = Evaluator(fields_to_ignore, fields_higher_weightings)
+    batch_planner = BatchPlanner(target_tokens=args.batch_tokens) if args.batch_tokens is not None else None
+    if args.racing:
+        prompt_tester = PromptTesterRacing(model_caller, input_data, output_data, evaluator, output_converter(), input_converter(), train_split=train_split, confidence_z=args.racing_confidence, batch_submitter=batch_submitter, columnar_scoring=args.scoring == "columnar", batch_planner=batch_planner, coordinator=coordinator, evaluation_subset=evaluation_subset, example_store=example_store)
+    else:
+        prompt_tester = PromptTesterObjectSimilarity(model_caller, input_data, output_data, evaluator, output_converter(), input_converter(), train_split=train_split, batch_submitter=batch_submitter, columnar_scoring=args.scoring == "columnar", batch_planner=batch_planner, coordinator=coordinator, evaluation_subset=evaluation_subset, example_store=example_store)
+    run_map_elites(model_caller, prompt_tester, problem_definition, combinations, num_rounds, min_spaces_with_solutions, args.classifier, args.classifier_min_margin, args.steady_state_candidates, args.max_in_flight, checkpoint, resume_state, budget, surrogate, near_duplicate_index)
 
 
 if __name__ == '__main__':
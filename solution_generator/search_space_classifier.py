@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import numpy as np
+
+from model_caller.model_caller import ModelCaller
+from solution_generator.solution_generator import GenerateSolution
+
+
+class EmbeddingSearchSpaceClassifier:
+    """
+    Assigns prompts to search spaces by nearest centroid in embedding space.
+
+    Each search space definition is embedded once and candidates are embedded in bulk, so classifying a
+    round costs one embedding call instead of one completion per candidate. Embeddings are cached by
+    content hash in the model response cache. When the best and second best cosine similarities are
+    closer than `min_margin`, the LLM classifier of the solution generator is used instead.
+    """
+    def __init__(self, model_caller: ModelCaller, search_space_definitions: list[str], solution_generator: GenerateSolution | None = None, min_margin: float = 0.02):
+        self.model_caller = model_caller
+        self.search_space_definitions = search_space_definitions
+        self.solution_generator = solution_generator
+        self.min_margin = min_margin
+        self.embedding_cache = {}
+        self.search_space_matrix = None
+        self.stats = {"classified": 0, "llm_fallbacks": 0, "embedded": 0}
+
+    async def classify(self, solutions: list[str]) -> list[str | None]:
+        if len(solutions) == 0:
+            return []
+
+        try:
+            if self.search_space_matrix is None:
+                self.search_space_matrix = await self.get_embeddings(self.search_space_definitions)
+            solution_matrix = await self.get_embeddings(solutions)
+        except Exception as e:
+            print(f"Could not embed solutions, classifying them with the LLM instead: {str(e)[:100]}")
+            return await self.classify_with_llm(solutions)
+
+        similarities = solution_matrix @ self.search_space_matrix.T
+        ranked = np.argsort(-similarities, axis=1)
+        best = ranked[:, 0]
+        if similarities.shape[1] > 1:
+            margins = similarities[np.arange(len(solutions)), best] - similarities[np.arange(len(solutions)), ranked[:, 1]]
+        else:
+            margins = np.full(len(solutions), np.inf)
+
+        spaces = [self.search_space_definitions[index] for index in best]
+        self.stats["classified"] += len(solutions)
+
+        low_margin_indices = [i for i in range(len(solutions)) if margins[i] < self.min_margin]
+        if self.solution_generator is not None and low_margin_indices:
+            self.stats["llm_fallbacks"] += len(low_margin_indices)
+            fallback_spaces = await asyncio.gather(*[
+                self.solution_generator.get_search_space_of_solution(self.search_space_definitions, solutions[i])
+                for i in low_margin_indices
+            ])
+            for i, space in zip(low_margin_indices, fallback_spaces):
+                # An invalid LLM answer keeps the nearest centroid rather than wasting the candidate
+                if space is not None:
+                    spaces[i] = space
+
+        return spaces
+
+    async def classify_with_llm(self, solutions: list[str]) -> list[str | None]:
+        if self.solution_generator is None:
+            return [None] * len(solutions)
+        self.stats["llm_fallbacks"] += len(solutions)
+        return await asyncio.gather(*[
+            self.solution_generator.get_search_space_of_solution(self.search_space_definitions, solution)
+            for solution in solutions
+        ])
+
+    async def get_embeddings(self, texts: list[str]) -> np.ndarray:
+        """Returns unit-normalised embeddings, one row per text."""
+        keys = [self.get_embedding_key(text) for text in texts]
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key in self.embedding_cache or key in missing:
+                continue
+            cached = await self.model_caller.async_cache.get_hashed(key)
+            if cached is not None:
+                self.embedding_cache[key] = np.array(json.loads(cached))
+            else:
+                missing[key] = text
+
+        if missing:
+            vectors = await self.model_caller.embed_texts(list(missing.values()))
+            self.stats["embedded"] += len(missing)
+            for key, vector in zip(missing.keys(), vectors):
+                self.embedding_cache[key] = np.array(vector)
+                await self.model_caller.async_cache.set_hashed(key, json.dumps(list(vector)))
+
+        matrix = np.stack([self.embedding_cache[key] for key in keys]).astype(np.float64)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def get_embedding_key(self, text: str) -> str:
+        return self.model_caller.async_cache.generate_cache_key(("embedding", self.model_caller.embedding_model_name, text))
@@ -2,7 +2,9 @@ import json
 import random
 import re
 
+from model_caller.call_scheduler import CallPriority
 from model_caller.model_caller import ModelCaller
+from telemetry import telemetry
 
 
 class GenerateSolution:
@@ -101,34 +103,39 @@ Prompt 2:
 
 
     async def generate_random_solution(self) -> list[str]:
-        initial_solution = await self.model_caller.call_model(user_prompt=self.solution_generation_prompt + self.base_solution, chat_history="", system_prompt="", max_length=5_000)
+        with telemetry.time("generate_random_solution"):
+            initial_solution = await self.model_caller.call_model(user_prompt=self.solution_generation_prompt + self.base_solution, chat_history="", system_prompt="", max_length=5_000)
         prompts = self.extract_prompts(initial_solution)
         return prompts
 
     async def mutate_solution(self, solution: str, example: list[str]) -> list[str]:
         # print(f"\nMutating solution: {solution[:200]}...")
-        mutated_solution = await self.model_caller.call_model(user_prompt=self.get_solution_mutation_prompt(example) + solution, chat_history="", max_length=5_000)
+        with telemetry.time("mutate_solution"):
+            mutated_solution = await self.model_caller.call_model(user_prompt=self.get_solution_mutation_prompt(example) + solution, chat_history="", max_length=5_000)
         prompts = self.extract_prompts(mutated_solution)
         # print(f"Mutated solution:\n{'...\n'.join([p[:200] for p in prompts])}\n")
         return prompts
 
     async def crossover_solutions(self, solution1: str, solution2: str) -> list[str]:
         # print(f"\nMutating solution: {solution[:200]}...")
-        mutated_solution = await self.model_caller.call_model(user_prompt=self.get_solution_crossover_prompt(solution1, solution2), chat_history="", max_length=5_000)
+        with telemetry.time("crossover_solutions"):
+            mutated_solution = await self.model_caller.call_model(user_prompt=self.get_solution_crossover_prompt(solution1, solution2), chat_history="", max_length=5_000)
         prompts = self.extract_prompts(mutated_solution)
         # print(f"Mutated solution:\n{'...\n'.join([p[:200] for p in prompts])}\n")
         return prompts
 
     async def generate_solution_for_search_space(self, search_space_definition: str) -> list[str]:
         # print(f"Generating solution for search space: {search_space_definition}")
-        solution = await self.model_caller.call_model(user_prompt=self.get_solution_generation_from_search_space_prompt(search_space_definition, self.base_solution), max_length=5_000)
+        with telemetry.time("generate_solution_for_search_space"):
+            solution = await self.model_caller.call_model(user_prompt=self.get_solution_generation_from_search_space_prompt(search_space_definition, self.base_solution), max_length=5_000)
         prompts = self.extract_prompts(solution)
         # print(f"Solution for search space:{search_space_definition}\nPrompts: {'...\n'.join([p[:200] for p in prompts])}...\n<fin>")
         return prompts
 
     async def get_search_space_of_solution(self, search_space_definitions: list[str], solution: str) -> str | None:
         prompt = self.get_search_space_of_solution_prompt(search_space_definitions, solution)
-        search_space_response = (await self.model_caller.call_model_cached(user_prompt=prompt, chat_history="", max_length=10)).strip()
+        with telemetry.time("get_search_space_of_solution"):
+            search_space_response = (await self.model_caller.call_model_cached(user_prompt=prompt, chat_history="", max_length=10, priority=CallPriority.CLASSIFICATION)).strip()
         if not search_space_response.isnumeric() or int(search_space_response) >= len(search_space_definitions):
             print(f"Invalid search space response: {search_space_response}")
             return None
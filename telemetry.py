@@ -0,0 +1,235 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Telemetry:
+    """
+    Process-wide metrics for model calls, prompt generation, evaluation and MAP-Elites rounds.
+
+    Operations record their wall-clock latency, model calls record input and output tokens, and events such as
+    retries, timeouts, cache hits and parse failures are counted. `end_round` appends a snapshot with latency
+    percentiles, cache hit ratio, parse failure rate and the estimated spend of the round to a JSON-lines file,
+    and `start_server` serves the same metrics in the Prometheus text format.
+    """
+    # USD per million input and output tokens, models which are not listed are counted as free
+    prices_per_million_tokens = {
+        "gpt-4o": (2.50, 10.00),
+        "gemini-1.5-flash": (0.075, 0.30),
+        "text-embedding-3-small": (0.02, 0.0),
+        "text-embedding-004": (0.0, 0.0),
+    }
+    # Fraction of the input price billed for input tokens read from a provider context cache
+    cached_input_price_fraction = 0.25
+    # Fraction of the usual prices billed for calls answered through a provider batch endpoint
+    batch_price_fraction = 0.5
+    max_samples_per_operation = 10_000
+    # Ratios of event counts reported in snapshots, as (numerator event, denominator event)
+    ratios = {
+        "cache_hit_ratio": ("cache_hits", "cache_requests"),
+        "parse_failure_rate": ("parse_failed_records", "parse_records"),
+        "surrogate_precision": ("surrogate_forwarded_improved", "surrogate_forwarded_evaluated"),
+        "surrogate_exploration_precision": ("surrogate_explored_improved", "surrogate_explored_evaluated"),
+    }
+    quantiles = (0.5, 0.9, 0.99)
+    model_call_operations = ("model_call", "embedding_call", "batch_model_call")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency_samples = collections.defaultdict(lambda: collections.deque(maxlen=self.max_samples_per_operation))
+        self.latency_counts = collections.Counter()
+        self.latency_sums = collections.Counter()
+        self.tokens = collections.Counter()
+        self.events = collections.Counter()
+        self.spend_usd = 0.0
+        # Usage reported by evaluation workers is kept apart, so a worker in this process never reports it back
+        self.remote_latency_counts = collections.Counter()
+        self.remote_latency_sums = collections.Counter()
+        self.remote_tokens = collections.Counter()
+        self.remote_spend_usd = 0.0
+        self.round_start_spend_usd = 0.0
+        self.path = None
+        self.server = None
+
+    def set_output(self, path: str | None):
+        self.path = path
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def record_latency(self, operation: str, seconds: float):
+        with self.lock:
+            self.latency_samples[operation].append(seconds)
+            self.latency_counts[operation] += 1
+            self.latency_sums[operation] += seconds
+
+    @contextmanager
+    def time(self, operation: str):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_latency(operation, time.monotonic() - start_time)
+
+    def increment(self, event: str, amount: int = 1):
+        with self.lock:
+            self.events[event] += amount
+
+    def record_model_call(self, model_name: str, input_tokens: int, output_tokens: int, seconds: float, operation: str = "model_call", cached_input_tokens: int = 0):
+        """Records a call, `cached_input_tokens` are the part of `input_tokens` which was read from a context cache."""
+        self.record_latency(operation, seconds)
+        input_price, output_price = self.prices_per_million_tokens.get(model_name, (0.0, 0.0))
+        if operation == "batch_model_call":
+            input_price, output_price = input_price * self.batch_price_fraction, output_price * self.batch_price_fraction
+        with self.lock:
+            self.tokens[(model_name, "input")] += input_tokens
+            self.tokens[(model_name, "cached_input")] += cached_input_tokens
+            self.tokens[(model_name, "output")] += output_tokens
+            billed_input_tokens = input_tokens - cached_input_tokens + cached_input_tokens * self.cached_input_price_fraction
+            self.spend_usd += (billed_input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+    def get_model_usage(self) -> dict:
+        """Model calls made in this process, their seconds, tokens and spend so far, in the form `record_remote_usage` takes."""
+        with self.lock:
+            return {
+                "calls": {operation: self.latency_counts[operation] for operation in self.model_call_operations},
+                "seconds": {operation: self.latency_sums[operation] for operation in self.model_call_operations},
+                "tokens": {f"{model_name}/{direction}": count for (model_name, direction), count in self.tokens.items()},
+                "spend_usd": self.spend_usd,
+            }
+
+    @staticmethod
+    def get_usage_difference(usage: dict, previous_usage: dict) -> dict:
+        return {
+            "calls": {operation: count - previous_usage["calls"].get(operation, 0) for operation, count in usage["calls"].items()},
+            "seconds": {operation: seconds - previous_usage["seconds"].get(operation, 0.0) for operation, seconds in usage["seconds"].items()},
+            "tokens": {key: count - previous_usage["tokens"].get(key, 0) for key, count in usage["tokens"].items()},
+            "spend_usd": usage["spend_usd"] - previous_usage["spend_usd"],
+        }
+
+    def record_remote_usage(self, usage: dict):
+        """Adds model usage reported by another process, such as an evaluation worker, its latency samples stay there."""
+        with self.lock:
+            for operation, count in usage["calls"].items():
+                if count > 0:
+                    self.remote_latency_counts[operation] += count
+                    self.remote_latency_sums[operation] += usage["seconds"].get(operation, 0.0)
+            for key, count in usage["tokens"].items():
+                model_name, direction = key.rsplit("/", 1)
+                self.remote_tokens[(model_name, direction)] += count
+            self.remote_spend_usd += usage["spend_usd"]
+
+    def get_percentiles(self, operation: str) -> dict[str, float]:
+        samples = sorted(self.latency_samples[operation])
+        if not samples:
+            return {}
+        return {f"p{int(quantile * 100)}": samples[min(len(samples) - 1, int(quantile * len(samples)))] for quantile in self.quantiles}
+
+    def get_snapshot(self) -> dict:
+        with self.lock:
+            latency_counts = collections.Counter(self.latency_counts)
+            latency_counts.update(self.remote_latency_counts)
+            latency_sums = collections.Counter(self.latency_sums)
+            latency_sums.update(self.remote_latency_sums)
+            model_tokens = collections.Counter(self.tokens)
+            model_tokens.update(self.remote_tokens)
+            operations = {
+                operation: {
+                    "count": latency_counts[operation],
+                    "mean_seconds": latency_sums[operation] / latency_counts[operation],
+                    **self.get_percentiles(operation),
+                }
+                for operation in latency_counts
+            }
+            events = dict(self.events)
+            tokens = {f"{model_name}/{direction}": count for (model_name, direction), count in model_tokens.items()}
+            spend_usd = self.spend_usd + self.remote_spend_usd
+
+        return {
+            "operations": operations,
+            "tokens": tokens,
+            "events": events,
+            **{
+                ratio: events.get(numerator, 0) / events[denominator] if events.get(denominator) else 0.0
+                for ratio, (numerator, denominator) in self.ratios.items()
+            },
+            "spend_usd": spend_usd,
+        }
+
+    def end_round(self, label: str) -> dict:
+        """Appends a snapshot for the round which just finished to the JSON-lines output."""
+        snapshot = self.get_snapshot()
+        snapshot["time"] = time.time()
+        snapshot["round"] = label
+        snapshot["round_spend_usd"] = snapshot["spend_usd"] - self.round_start_spend_usd
+        self.round_start_spend_usd = snapshot["spend_usd"]
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(snapshot) + "\n")
+        return snapshot
+
+    def get_prometheus_text(self) -> str:
+        snapshot = self.get_snapshot()
+        lines = [
+            "# TYPE autoprompt_operation_seconds summary",
+        ]
+        for operation, stats in snapshot["operations"].items():
+            # Operations only run on other processes have counts but no local samples
+            for quantile in self.quantiles if f"p{int(self.quantiles[0] * 100)}" in stats else ():
+                lines.append(f'autoprompt_operation_seconds{{operation="{operation}",quantile="{quantile}"}} {stats[f"p{int(quantile * 100)}"]}')
+            lines.append(f'autoprompt_operation_seconds_count{{operation="{operation}"}} {stats["count"]}')
+            lines.append(f'autoprompt_operation_seconds_sum{{operation="{operation}"}} {stats["mean_seconds"] * stats["count"]}')
+
+        lines.append("# TYPE autoprompt_tokens_total counter")
+        for key, count in snapshot["tokens"].items():
+            model_name, direction = key.rsplit("/", 1)
+            lines.append(f'autoprompt_tokens_total{{model="{model_name}",direction="{direction}"}} {count}')
+
+        lines.append("# TYPE autoprompt_events_total counter")
+        for event, count in snapshot["events"].items():
+            lines.append(f'autoprompt_events_total{{event="{event}"}} {count}')
+
+        for ratio in self.ratios:
+            lines += [
+                f"# TYPE autoprompt_{ratio} gauge",
+                f"autoprompt_{ratio} {snapshot[ratio]}",
+            ]
+
+        lines += [
+            "# TYPE autoprompt_spend_usd_total counter",
+            f"autoprompt_spend_usd_total {snapshot['spend_usd']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, port: int, host: str = "127.0.0.1"):
+        """Serves the metrics at http://host:port/metrics from a background thread."""
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = telemetry.get_prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop_server(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+telemetry = Telemetry()
@@ -0,0 +1,27 @@
+import random
+
+import pytest
+
+from custom_converters.org_parse_converter import OrgParseConverter
+from model_caller.async_cache import AsyncCache
+from model_caller.fake_caller import FakeModelCaller
+from model_caller.model_caller import ModelCaller
+from telemetry import telemetry
+
+
+@pytest.fixture(autouse=True)
+def fresh_process_state():
+    # Model callers share a class-level cache, in-flight calls and counters, and telemetry is process-wide
+    ModelCaller.set_cache(AsyncCache())
+    ModelCaller.in_flight_calls.clear()
+    ModelCaller.call_counters.update({counter: 0 for counter in ModelCaller.call_counters})
+    telemetry.__init__()
+    random.seed(0)
+
+
+@pytest.fixture
+def org_dataset() -> tuple[list[str], list[dict]]:
+    """Organisation names with their expected parses, as FakeModelCaller answers a perfect prompt."""
+    names = FakeModelCaller.generate_org_names(20, 0)
+    converter = OrgParseConverter()
+    return names, [converter.convert_single_parse(FakeModelCaller.get_name_parse(name)) for name in names]
@@ -0,0 +1,44 @@
+import asyncio
+
+from rich.progress import Progress
+
+from custom_converters.org_parse_converter import OrgParseConverter
+from custom_converters.person_parse_input_converter import PersonParseInputConverter
+from model_caller.fake_caller import FakeModelCaller
+from prompt_testing.batch_planner import BatchPlanner
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+
+prompts = [
+    "Parse each organisation name into its components.",
+    "Identify the top level brand and any legal suffixes of each organisation name.",
+]
+
+
+def test_batches_are_planned_again_while_an_evaluation_is_running(org_dataset):
+    names, expected_outputs = org_dataset
+    batch_planner = BatchPlanner(target_tokens=4_000)
+    model_caller = FakeModelCaller(latency_seconds=0.2, latency_sigma=0.0, seconds_per_output_token=0.0)
+    prompt_tester = PromptTesterObjectSimilarity(model_caller, names, expected_outputs, Evaluator(["Id", "TransliteratedName"], {}), OrgParseConverter(),
+                                                 PersonParseInputConverter(), train_split=len(names), batch_planner=batch_planner)
+    first_plan = prompt_tester.batch_plan
+
+    async def evaluate_across_replan():
+        running = asyncio.create_task(prompt_tester.get_scores_for_solutions([prompts[0]], Progress(disable=True), 0))
+        await asyncio.sleep(0.05)
+        # Enough failed batches for the planner to shrink them before the next evaluation
+        batch_planner.recent_batches = batch_planner.recent_failed_batches = batch_planner.min_observations
+        second_scores = await prompt_tester.get_scores_for_solutions([prompts[1]], Progress(disable=True), 0)
+        return await running, second_scores
+
+    first_scores, second_scores = asyncio.run(evaluate_across_replan())
+
+    second_plan = prompt_tester.batch_plan
+    assert batch_planner.shrink_count == 1
+    assert len(second_plan.batch_payloads) > len(first_plan.batch_payloads)
+    # The running evaluation finished on the batches it started with, and its score is kept under their configuration
+    score_store = prompt_tester.score_store
+    assert score_store.scores[score_store.get_key(prompts[0], first_plan.evaluation_config_hash)] == first_scores[0]
+    assert prompts[0] not in score_store
+    assert score_store.peek(prompts[1]) == second_scores[0]
+    # Only batches of the current plan count towards shrinking it again
+    assert batch_planner.recent_batches == len(second_plan.batch_payloads)
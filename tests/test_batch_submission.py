@@ -0,0 +1,33 @@
+import asyncio
+
+from model_caller.cassette import RecordingCaller, ReplayCaller
+from model_caller.fake_caller import FakeModelCaller
+from prompt_testing.batch_submission import BatchSubmitter, LocalFileBatchBackend
+
+prompt = "Parse each organisation name into its components."
+
+
+def test_batch_results_are_cached_and_recorded_for_replay(tmp_path):
+    fake_caller = FakeModelCaller(latency_seconds=0.0, latency_sigma=0.0, seconds_per_output_token=0.0)
+    recording_caller = RecordingCaller(fake_caller, str(tmp_path / "cassette"))
+    payloads = [f'{{"PresentedName": "{name}"}}' for name in FakeModelCaller.generate_org_names(3, 0)]
+    # The backend calls the model directly, so each batched request is recorded once, by the submitter
+    submitter = BatchSubmitter(LocalFileBatchBackend(fake_caller, str(tmp_path / "local")), recording_caller, requests_directory=str(tmp_path / "requests"),
+                               collection_window_seconds=0.0, poll_interval_seconds=0.0)
+
+    async def submit():
+        return await asyncio.gather(*[submitter.get_result("", prompt, payload, max_length=1_000, temperature=0.0) for payload in payloads])
+
+    results = asyncio.run(submit())
+    recording_caller.close()
+    assert all(result != "" for result in results)
+    assert fake_caller.call_counts["evaluation"] == 3
+
+    # Answered from the cache without another batch
+    assert asyncio.run(submitter.get_result("", prompt, payloads[0], max_length=1_000, temperature=0.0)) == results[0]
+
+    replay_caller = ReplayCaller(str(tmp_path / "cassette"))
+    replayed = [asyncio.run(replay_caller.call_model("", prompt, payload, max_length=1_000, temperature=0.0)) for payload in payloads]
+    assert replayed == results
+    assert replay_caller.misses == 0
+    assert len(replay_caller.reader) == 3
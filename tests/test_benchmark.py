@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+
+from benchmark_map_elites import run_benchmark
+
+
+def create_benchmark_args(**overrides) -> argparse.Namespace:
+    args = {"rounds": 2, "num_examples": 30, "min_spaces": 2, "max_concurrency": 16, "latency_seconds": 0.5, "time_scale": 0.002,
+            "error_rate": 0.0, "rate_limit_rate": 0.0, "context_caching": False, "seed": 0}
+    return argparse.Namespace(**{**args, **overrides})
+
+
+def test_benchmark_run_completes():
+    results = asyncio.run(run_benchmark(create_benchmark_args()))
+
+    assert len(results["rounds"]) == 2
+    assert 0.0 < results["best_score"] <= 1.0
+    for round_result in results["rounds"]:
+        calls = round_result["calls"]
+        assert round_result["candidates_evaluated"] > 0
+        # Every new candidate is classified once and scored on each of the training batches
+        assert calls["classification"] == round_result["candidates_evaluated"]
+        assert calls["evaluation"] % round_result["candidates_evaluated"] == 0
+        assert calls["errors"] == 0 and calls["rate_limited"] == 0
+
+    call_counters = results["call_counters"]
+    assert call_counters["requests"] == call_counters["cache_hits"] + call_counters["coalesced"] + call_counters["model_calls"]
+    assert call_counters["cache_hits"] / call_counters["requests"] > 0.05
+
+
+def test_benchmark_is_repeatable_with_a_fixed_seed():
+    first_results = asyncio.run(run_benchmark(create_benchmark_args()))
+    second_results = asyncio.run(run_benchmark(create_benchmark_args()))
+
+    assert [round_result["calls"] for round_result in first_results["rounds"]] == [round_result["calls"] for round_result in second_results["rounds"]]
+    assert first_results["call_counters"] == second_results["call_counters"]
+    assert first_results["best_score"] == second_results["best_score"]
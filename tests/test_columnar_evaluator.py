@@ -0,0 +1,42 @@
+import asyncio
+import random
+
+import pytest
+from rich.progress import Progress
+
+from custom_converters.org_parse_converter import OrgParseConverter
+from custom_converters.person_parse_input_converter import PersonParseInputConverter
+from model_caller.async_cache import AsyncCache
+from model_caller.fake_caller import FakeModelCaller
+from model_caller.model_caller import ModelCaller
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+
+prompts = [
+    "Parse each organisation name into its components.",
+    "Parse each organisation name into its components. Keep the PresentedName exactly as given. Use empty lists for components which are missing.",
+    "Identify the top level brand and any lower level brand. List legal suffixes exactly as written and give their full forms.",
+    "Return the output as JSON with a NameParses list, one object per input, keeping each Id. Mark brands which are likely acronyms.",
+]
+
+
+def get_scores(org_dataset, columnar_scoring: bool) -> list:
+    names, expected_outputs = org_dataset
+    # Both testers must get the same training split and fresh model responses
+    random.seed(0)
+    ModelCaller.set_cache(AsyncCache())
+    model_caller = FakeModelCaller(latency_seconds=0.0, latency_sigma=0.0, seconds_per_output_token=0.0, malformed_record_rate=0.1)
+    prompt_tester = PromptTesterObjectSimilarity(model_caller, names, expected_outputs, Evaluator(["Id", "TransliteratedName"], {"TopLevelBrand": 2.0}),
+                                                 OrgParseConverter(), PersonParseInputConverter(), train_split=len(names), columnar_scoring=columnar_scoring)
+    return asyncio.run(prompt_tester.get_scores_for_solutions(prompts, Progress(disable=True), 0))
+
+
+def test_columnar_scores_match_per_object_scores(org_dataset):
+    python_scores = get_scores(org_dataset, columnar_scoring=False)
+    columnar_scores = get_scores(org_dataset, columnar_scoring=True)
+
+    # The prompts parse differently, so the comparison covers a spread of scores
+    assert len({round(score[0], 6) for score in python_scores}) > 1
+    for (python_score, python_field_scores, python_worst), (columnar_score, columnar_field_scores, columnar_worst) in zip(python_scores, columnar_scores):
+        assert columnar_score == pytest.approx(python_score)
+        assert columnar_field_scores == pytest.approx(python_field_scores)
+        assert columnar_worst == python_worst
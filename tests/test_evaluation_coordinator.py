@@ -0,0 +1,130 @@
+import asyncio
+import random
+
+from rich.progress import Progress
+
+from custom_converters.org_parse_converter import OrgParseConverter
+from custom_converters.person_parse_input_converter import PersonParseInputConverter
+from model_caller.async_cache import AsyncCache
+from model_caller.fake_caller import FakeModelCaller
+from model_caller.model_caller import ModelCaller
+from prompt_testing.evaluation_coordinator import EvaluationCoordinator
+from prompt_testing.evaluation_worker import EvaluationWorker
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+
+prompts = [
+    "Parse each organisation name into its components. Keep the PresentedName exactly as given.",
+    "Identify the top level brand and any lower level brand. Mark brands which are likely acronyms.",
+    "List legal suffixes exactly as written and give their full forms.",
+]
+fields_to_ignore = ["Id", "TransliteratedName"]
+
+
+class StalledCaller(FakeModelCaller):
+    """Never answers, so its worker holds the jobs it is sent until it is killed."""
+    async def call_model_cached(self, *args, **kwargs) -> str:
+        await asyncio.Event().wait()
+
+
+def create_fake_caller() -> FakeModelCaller:
+    return FakeModelCaller(latency_seconds=0.02, latency_sigma=0.0, seconds_per_output_token=0.0)
+
+
+def create_worker(model_caller: FakeModelCaller, name: str) -> EvaluationWorker:
+    return EvaluationWorker(model_caller, lambda converter_name: OrgParseConverter(), capacity=1, name=name, reconnect_seconds=0.1)
+
+
+def create_tester(org_dataset, coordinator: EvaluationCoordinator | None = None) -> PromptTesterObjectSimilarity:
+    names, expected_outputs = org_dataset
+    # The training split is a shuffle of the data, so every tester gets the same batches
+    random.seed(0)
+    return PromptTesterObjectSimilarity(create_fake_caller(), names, expected_outputs, Evaluator(fields_to_ignore, {}), OrgParseConverter(),
+                                        PersonParseInputConverter(), train_split=len(names), coordinator=coordinator)
+
+
+async def start_coordinator() -> tuple[EvaluationCoordinator, int]:
+    coordinator = EvaluationCoordinator("127.0.0.1", 0, {
+        "fields_to_ignore": fields_to_ignore,
+        "fields_weightings": {},
+        "output_converter": "org_parse_converter",
+        "model_name": FakeModelCaller.model_name,
+    })
+    await coordinator.start()
+    # Port 0 lets the OS pick a free port
+    return coordinator, coordinator.server.sockets[0].getsockname()[1]
+
+
+async def wait_until(condition, timeout: float = 10):
+    async with asyncio.timeout(timeout):
+        while not condition():
+            await asyncio.sleep(0.01)
+
+
+def get_local_scores(org_dataset) -> list:
+    scores = asyncio.run(create_tester(org_dataset).get_scores_for_solutions(prompts, Progress(disable=True), 0))
+    # Workers must call the model themselves, not read the responses the local evaluation cached
+    ModelCaller.set_cache(AsyncCache())
+    return scores
+
+
+def test_remote_scores_match_local_scores(org_dataset):
+    local_scores = get_local_scores(org_dataset)
+
+    async def score_on_workers():
+        coordinator, port = await start_coordinator()
+        workers = [create_worker(create_fake_caller(), f"worker-{i}") for i in range(2)]
+        worker_tasks = [asyncio.create_task(worker.run("127.0.0.1", port)) for worker in workers]
+        await wait_until(lambda: coordinator.stats["workers_connected"] == 2)
+        scores = await create_tester(org_dataset, coordinator).get_scores_for_solutions(prompts, Progress(disable=True), 0)
+        await coordinator.close()
+        # Workers exit when the coordinator shuts down
+        await asyncio.wait_for(asyncio.gather(*worker_tasks), 5)
+        return scores, workers, coordinator
+
+    remote_scores, workers, coordinator = asyncio.run(score_on_workers())
+    assert [score[:2] for score in remote_scores] == [score[:2] for score in local_scores]
+    assert all(worker.stats["jobs"] > 0 for worker in workers)
+    assert coordinator.stats["retried"] == 0 and coordinator.stats["failed"] == 0
+
+
+def test_jobs_of_a_killed_worker_are_requeued(org_dataset):
+    local_scores = get_local_scores(org_dataset)
+
+    async def score_with_killed_worker():
+        coordinator, port = await start_coordinator()
+        stalled_worker = create_worker(StalledCaller(), "stalled")
+        stalled_task = asyncio.create_task(stalled_worker.run("127.0.0.1", port))
+        await wait_until(lambda: coordinator.stats["workers_connected"] == 1)
+
+        scoring = asyncio.create_task(create_tester(org_dataset, coordinator).get_scores_for_solutions(prompts, Progress(disable=True), 0))
+        await wait_until(lambda: stalled_worker.stats["jobs"] == 1)
+        healthy_worker = create_worker(create_fake_caller(), "healthy")
+        healthy_task = asyncio.create_task(healthy_worker.run("127.0.0.1", port))
+        stalled_task.cancel()
+
+        scores = await asyncio.wait_for(scoring, 10)
+        await coordinator.close()
+        await asyncio.wait_for(healthy_task, 5)
+        return scores, coordinator
+
+    scores, coordinator = asyncio.run(score_with_killed_worker())
+    assert coordinator.stats["workers_lost"] == 1
+    assert coordinator.stats["retried"] == 1
+    assert coordinator.stats["failed"] == 0
+    assert [score[:2] for score in scores] == [score[:2] for score in local_scores]
+
+
+def test_worker_with_another_model_is_turned_away():
+    async def connect_other_model():
+        coordinator, port = await start_coordinator()
+        other_model = create_fake_caller()
+        other_model.model_name = "other-model"
+        worker = create_worker(other_model, "other")
+        # The worker exits instead of connecting again
+        await asyncio.wait_for(worker.run("127.0.0.1", port), 5)
+        await coordinator.close()
+        return coordinator, worker
+
+    coordinator, worker = asyncio.run(connect_other_model())
+    assert coordinator.stats["workers_connected"] == 0
+    assert worker.stats["jobs"] == 0
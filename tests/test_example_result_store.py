@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from rich.progress import Progress
+
+from custom_converters.converter import Converter
+from custom_converters.org_parse_converter import OrgParseConverter
+from custom_converters.person_parse_input_converter import PersonParseInputConverter
+from model_caller.fake_caller import FakeModelCaller
+from prompt_testing.batch_scoring import RecordParser
+from prompt_testing.example_result_store import ExampleResultStore
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+
+prompt = "Parse each organisation name into its components."
+
+
+def test_records_survive_a_save_and_load(tmp_path):
+    example_store = ExampleResultStore(str(tmp_path))
+    prompt_hash = example_store.add_prompt(prompt)
+    records = {ExampleResultStore.get_hash(f"example {i}"): {"PresentedName": f"Org {i}", "LegalSuffixes": ["Ltd"] * i} for i in range(5)}
+    for example_hash, record in records.items():
+        example_store.set("fake", prompt_hash, example_hash, record)
+    example_store.save()
+    # Later records go to a shard of their own
+    example_store.set("other-model", prompt_hash, ExampleResultStore.get_hash("example 0"), {"PresentedName": "Ünïcode Org"})
+    example_store.save()
+
+    loaded_store = ExampleResultStore(str(tmp_path))
+    assert len(loaded_store) == 6
+    assert loaded_store.prompts[prompt_hash] == prompt
+    for example_hash, record in records.items():
+        assert loaded_store.get("fake", prompt_hash, example_hash) == (True, record)
+    assert loaded_store.get("other-model", prompt_hash, ExampleResultStore.get_hash("example 0")) == (True, {"PresentedName": "Ünïcode Org"})
+    assert loaded_store.get("fake", prompt_hash, ExampleResultStore.get_hash("example 9")) == (False, None)
+    assert loaded_store.get_records_by_prompt()[("fake", prompt_hash)] == records
+
+
+def test_malformed_records_are_not_stored_and_are_tried_again(org_dataset):
+    # Examples with the same name share their stored record, so each name is evaluated once
+    unique_examples = dict(zip(*org_dataset))
+    names, expected_outputs = list(unique_examples), list(unique_examples.values())
+    model_caller = FakeModelCaller(latency_seconds=0.0, latency_sigma=0.0, seconds_per_output_token=0.0, malformed_record_rate=0.3)
+    example_store = ExampleResultStore()
+    prompt_tester = PromptTesterObjectSimilarity(model_caller, names, expected_outputs, Evaluator(["Id", "TransliteratedName"], {}), OrgParseConverter(),
+                                                 PersonParseInputConverter(), train_split=len(names), example_store=example_store)
+
+    asyncio.run(prompt_tester.get_batch_scores(prompt_tester.batch_plan, prompt, Progress(disable=True), 0, 0))
+    stored_records = example_store.get_records_by_prompt()[("fake", example_store.add_prompt(prompt))]
+    assert prompt_tester.parse_stats["failed_records"] > 0
+    assert len(stored_records) == len(names) - prompt_tester.parse_stats["failed_records"]
+    assert all(record is not None for record in stored_records.values())
+
+    # Only the examples without a stored record are sent to the model again
+    calls_before = model_caller.call_counts["evaluation"]
+    records_before = prompt_tester.parse_stats["records"]
+    asyncio.run(prompt_tester.get_batch_scores(prompt_tester.batch_plan, prompt, Progress(disable=True), 0, 0))
+    assert model_caller.call_counts["evaluation"] == calls_before + 1
+    assert prompt_tester.parse_stats["records"] - records_before == len(names) - len(stored_records)
+
+
+class SingleParseConverter(Converter):
+    """Reads a response holding one parse rather than a list of them."""
+    def convert(self, inp) -> list[dict]:
+        return [inp["Parse"]] if "Parse" in inp else []
+
+
+def test_responses_without_records_are_converted_by_the_output_converter():
+    record_parser = RecordParser(SingleParseConverter(), PromptTesterObjectSimilarity.records_key)
+    record = FakeModelCaller.get_name_parse("Acme Holdings Ltd")
+
+    raw_records, converted = record_parser.parse_result("```json\n" + json.dumps({"Parse": record}) + "\n```")
+
+    # The records cannot be read one by one, so there are no raw records to store
+    assert raw_records is None
+    assert converted == [record]
+    assert record_parser.parse_result("not JSON") == (None, None)
+    assert record_parser.parse_stats["failed_responses"] == 1
@@ -0,0 +1,52 @@
+import json
+
+from prompt_testing.labelled_dataset import LabelledDataset
+
+
+def write_dataset(tmp_path, num_inputs: int, num_outputs: int) -> LabelledDataset:
+    input_path = tmp_path / "inputs.txt"
+    output_path = tmp_path / "outputs.jsonl"
+    input_path.write_text("".join(f"Org {i} Ltd\n" for i in range(num_inputs)))
+    # The last expected output has no trailing newline, it is still a record
+    output_path.write_text("\n".join(json.dumps({"PresentedName": f"Org {i}", "Index": i}) for i in range(num_outputs)))
+    return LabelledDataset(str(input_path), str(output_path))
+
+
+def test_split_pairs_inputs_with_their_expected_outputs(tmp_path):
+    dataset = write_dataset(tmp_path, 50, 50)
+    inputs, expected_outputs = dataset.get_split(20, seed=3)
+
+    assert len(inputs) == len(expected_outputs) == 20
+    indices = [expected_output["Index"] for expected_output in expected_outputs]
+    assert len(set(indices)) == 20
+    assert [input_text.strip() for input_text in inputs] == [f"Org {i} Ltd" for i in indices]
+    assert inputs[-1] == inputs[19]
+    assert [record["Index"] for record in expected_outputs[5:10]] == indices[5:10]
+
+
+def test_split_is_reproducible_with_a_seed(tmp_path):
+    dataset = write_dataset(tmp_path, 50, 50)
+    first = [record["Index"] for record in dataset.get_split(10, seed=7)[1]]
+    second = [record["Index"] for record in dataset.get_split(10, seed=7)[1]]
+    other = [record["Index"] for record in dataset.get_split(10, seed=8)[1]]
+    assert first == second
+    assert first != other
+
+
+def test_split_is_capped_at_the_shorter_file(tmp_path):
+    dataset = write_dataset(tmp_path, 12, 9)
+    assert len(dataset) == 9
+    inputs, expected_outputs = dataset.get_split(100, seed=0)
+    assert len(inputs) == 9
+    assert sorted(record["Index"] for record in expected_outputs) == list(range(9))
+
+
+def test_line_index_is_reused_while_the_file_is_unchanged(tmp_path):
+    write_dataset(tmp_path, 5, 5)
+    index_path = tmp_path / "outputs.jsonl.offsets.npz"
+    assert index_path.exists()
+    modified_ns = index_path.stat().st_mtime_ns
+
+    dataset = LabelledDataset(str(tmp_path / "inputs.txt"), str(tmp_path / "outputs.jsonl"))
+    assert index_path.stat().st_mtime_ns == modified_ns
+    assert dataset.get_split(5, seed=1)[1][0]["PresentedName"].startswith("Org ")
@@ -0,0 +1,36 @@
+import asyncio
+
+from rich.console import Console
+
+from benchmark_map_elites import benchmark_categories, benchmark_problem_definition
+from custom_converters.org_parse_converter import OrgParseConverter
+from custom_converters.person_parse_input_converter import PersonParseInputConverter
+from map_elites import MAPElites
+from model_caller.fake_caller import FakeModelCaller
+from prompt_testing.prompt_tester_object_comparison import PromptTesterObjectSimilarity, Evaluator
+from solution_generator.solution_generator import GenerateSolution
+
+
+def test_steady_state_status_does_not_clear_the_live_progress(org_dataset, tmp_path, monkeypatch):
+    # Best prompts are written to the prompts directory of the working directory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "prompts").mkdir()
+    names, expected_outputs = org_dataset
+    model_caller = FakeModelCaller(latency_seconds=0.01, latency_sigma=0.0, seconds_per_output_token=0.0)
+    prompt_tester = PromptTesterObjectSimilarity(model_caller, names, expected_outputs, Evaluator(["Id", "TransliteratedName"], {}), OrgParseConverter(),
+                                                 PersonParseInputConverter(), train_split=len(names))
+    map_elites_runner = MAPElites(GenerateSolution(model_caller, benchmark_problem_definition), prompt_tester, benchmark_categories, 2)
+    map_elites_runner.console = Console(record=True, force_terminal=True, width=200)
+    clears = []
+    monkeypatch.setattr(map_elites_runner.console, "clear", lambda *args, **kwargs: clears.append(args))
+
+    async def run():
+        await map_elites_runner.initialise_solutions(benchmark_problem_definition, 2)
+        await map_elites_runner.run_steady_state(4, max_in_flight=2)
+
+    asyncio.run(run())
+    map_elites_runner.close()
+
+    assert map_elites_runner.steady_state_stats["completed"] == 4
+    assert "MAP-Elites Status" in map_elites_runner.console.export_text()
+    assert clears == []
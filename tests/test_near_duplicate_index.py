@@ -0,0 +1,53 @@
+from prompt_testing.near_duplicate_index import NearDuplicateIndex
+from prompt_testing.score_store import ScoreStore
+
+known_prompt = ("Parse each organisation name into its components. Identify the top level brand and any lower level brand. "
+                "List legal suffixes exactly as written and give their full forms. Record locations and nationalities mentioned in the name. "
+                "Return the output as JSON with a NameParses list, one object per input, keeping each Id.")
+# One word changed at the very end, so almost every shingle is shared
+near_duplicate = known_prompt.replace("keeping each Id.", "keeping every Id.")
+different_prompt = "Think step by step about which words form the brand, then classify the organisation type from words such as Group or Branch."
+
+
+def test_finds_near_duplicates_but_not_different_prompts():
+    index = NearDuplicateIndex(threshold=0.8)
+    index.add(known_prompt)
+
+    match = index.find(index.get_signature(near_duplicate))
+    assert match is not None and match[0] == known_prompt and match[1] >= 0.8
+    assert index.find(index.get_signature(known_prompt)) == (known_prompt, 1.0)
+    assert index.find(index.get_signature(different_prompt)) is None
+
+
+def test_skip_policy_drops_near_duplicates_including_those_within_one_round():
+    index = NearDuplicateIndex(threshold=0.8, policy="skip")
+    index.add(known_prompt)
+
+    kept = index.filter([near_duplicate, different_prompt, different_prompt + " "])
+
+    assert kept == [different_prompt]
+    assert index.stats == {"checked": 3, "skipped": 2, "inherited": 0}
+    # Filtering does not index, candidates are added once evaluated
+    assert index.find(index.get_signature(different_prompt)) is None
+
+
+def test_inherit_policy_reuses_the_known_score():
+    index = NearDuplicateIndex(threshold=0.8, policy="inherit")
+    index.add(known_prompt)
+    score_store = ScoreStore("config")
+    known_score = (0.75, {"TopLevelBrand": 0.9}, None)
+    score_store.set(known_prompt, known_score)
+
+    kept = index.filter([near_duplicate], score_store)
+
+    assert kept == [near_duplicate]
+    assert score_store.peek(near_duplicate) == known_score
+    assert index.stats["inherited"] == 1
+
+
+def test_inherit_policy_skips_near_duplicates_of_prompts_without_a_score():
+    index = NearDuplicateIndex(threshold=0.8, policy="inherit")
+    index.add(known_prompt)
+
+    assert index.filter([near_duplicate], ScoreStore("config")) == []
+    assert index.stats["skipped"] == 1
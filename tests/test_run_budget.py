@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from model_caller.fake_caller import FakeModelCaller
+from prompt_testing.batch_submission import BatchBackend, BatchSubmitter
+from run_budget import RunBudget
+from telemetry import telemetry
+
+
+class AnsweringBackend(BatchBackend):
+    """Answers every request at once and reports provider token usage for it, as a provider batch endpoint does."""
+    def __init__(self):
+        self.requests = {}
+
+    async def submit(self, requests_path: str) -> str:
+        with open(requests_path) as f:
+            self.requests["batch"] = [json.loads(line)["custom_id"] for line in f if line.strip()]
+        return "batch"
+
+    async def get_status(self, batch_id: str) -> str:
+        return "completed"
+
+    async def get_results(self, batch_id: str) -> dict[str, str]:
+        return {custom_id: "{}" for custom_id in self.requests[batch_id]}
+
+    def take_usage(self, batch_id: str) -> dict[str, dict]:
+        return {custom_id: {"input_tokens": 100, "cached_input_tokens": 40, "output_tokens": 20} for custom_id in self.requests[batch_id]}
+
+
+def test_batch_calls_count_towards_the_budget(tmp_path):
+    budget = RunBudget(max_calls=2)
+    submitter = BatchSubmitter(AnsweringBackend(), FakeModelCaller(), requests_directory=str(tmp_path), collection_window_seconds=0.0, poll_interval_seconds=0.0)
+
+    async def submit():
+        return await asyncio.gather(*[submitter.get_result("", "Parse the names.", f"name {i}") for i in range(2)])
+
+    asyncio.run(submit())
+
+    usage = budget.get_usage()
+    assert usage["calls"] == 2
+    assert usage["tokens"] == 2 * (100 + 20)
+    assert budget.get_stop_reason() is not None
+
+
+def test_resumed_budget_continues_from_the_checkpointed_usage():
+    budget = RunBudget(max_calls=10, plateau_rounds=2)
+    for _ in range(3):
+        telemetry.record_model_call("fake", 100, 10, 0.1)
+    budget.record_round({"a": 0.5})
+    budget.record_round({"a": 0.6})
+    state = budget.get_state()
+
+    # A new process starts with empty telemetry
+    telemetry.__init__()
+    telemetry.record_model_call("fake", 100, 10, 0.1)
+    resumed_budget = RunBudget(max_calls=10, plateau_rounds=2)
+    resumed_budget.load_state(state)
+    assert resumed_budget.get_usage()["calls"] == 3
+    assert resumed_budget.get_usage()["tokens"] == 3 * 110
+    assert resumed_budget.get_usage()["wall_seconds"] >= state["usage"]["wall_seconds"]
+    assert resumed_budget.archive_score_history == [0.5, 0.6]
+
+    telemetry.record_model_call("fake", 100, 10, 0.1)
+    assert resumed_budget.get_usage()["calls"] == 4
+    resumed_budget.record_round({"a": 0.6})
+    assert resumed_budget.get_stop_reason() is None
+    resumed_budget.record_round({"a": 0.6})
+    assert resumed_budget.get_stop_reason() == "archive improved by 0.0000 over the last 2 rounds"
@@ -0,0 +1,76 @@
+import asyncio
+import re
+
+import pytest
+
+from model_caller.fake_caller import FakeModelCaller
+from model_caller.model_caller import ModelCaller
+from solution_generator.search_space_classifier import EmbeddingSearchSpaceClassifier
+
+search_space_definitions = ["Conciseness: Short", "Conciseness: Long", "Specification Detail: Simple"]
+vocabulary = ["short", "long", "simple"]
+
+
+class KeywordEmbeddingCaller(FakeModelCaller):
+    """Embeds a text as the counts of a few keywords, so each search space definition lies on its own axis."""
+    embedding_model_name = "keyword-embedding"
+
+    async def embed_texts(self, texts_to_embed: list[str]) -> list[list[float]]:
+        self.call_counts["embedding"] += 1
+        return [[float(re.findall(r"\w+", text.lower()).count(word)) for word in vocabulary] for text in texts_to_embed]
+
+
+class NoEmbeddingCaller(ModelCaller):
+    model_name = "no-embedding"
+
+    async def call_model(self, chat_history: str, system_prompt: str, user_prompt: str, max_length: int = 5_000, temperature: float = 0.7, priority: int = 0) -> str:
+        return ""
+
+    def embed_text(self, text_to_embed: str) -> str:
+        return ""
+
+
+class RecordingSolutionGenerator:
+    """Answers the LLM fallback with the first search space and counts how often it was asked."""
+    def __init__(self):
+        self.calls = 0
+
+    async def get_search_space_of_solution(self, search_space_definitions: list[str], solution: str) -> str:
+        self.calls += 1
+        return search_space_definitions[0]
+
+
+def test_prompts_are_classified_by_their_embeddings():
+    model_caller = KeywordEmbeddingCaller()
+    solution_generator = RecordingSolutionGenerator()
+    classifier = EmbeddingSearchSpaceClassifier(model_caller, search_space_definitions, solution_generator)
+    solutions = ["Give a long, long answer.", "Keep every field simple.", "Be short.", "Be short."]
+
+    spaces = asyncio.run(classifier.classify(solutions))
+
+    assert spaces == ["Conciseness: Long", "Specification Detail: Simple", "Conciseness: Short", "Conciseness: Short"]
+    assert solution_generator.calls == 0
+    assert classifier.stats == {"classified": 4, "llm_fallbacks": 0, "embedded": 6}
+    # Definitions and repeated prompts are embedded once, in bulk
+    assert model_caller.call_counts["embedding"] == 2
+
+
+def test_ambiguous_prompts_fall_back_to_the_llm():
+    solution_generator = RecordingSolutionGenerator()
+    classifier = EmbeddingSearchSpaceClassifier(KeywordEmbeddingCaller(), search_space_definitions, solution_generator)
+
+    spaces = asyncio.run(classifier.classify(["Short or long, whichever fits."]))
+
+    assert spaces == ["Conciseness: Short"]
+    assert solution_generator.calls == 1
+    assert classifier.stats["llm_fallbacks"] == 1
+
+
+def test_callers_without_bulk_embeddings_fall_back_to_the_llm():
+    with pytest.raises(NotImplementedError, match="NoEmbeddingCaller does not support bulk embeddings"):
+        asyncio.run(NoEmbeddingCaller().embed_texts(["Be short."]))
+
+    solution_generator = RecordingSolutionGenerator()
+    classifier = EmbeddingSearchSpaceClassifier(NoEmbeddingCaller(), search_space_definitions, solution_generator)
+    assert asyncio.run(classifier.classify(["Be short.", "Be simple."])) == ["Conciseness: Short", "Conciseness: Short"]
+    assert solution_generator.calls == 2
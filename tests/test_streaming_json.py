@@ -0,0 +1,37 @@
+import json
+
+from prompt_testing.streaming_json import StreamingRecordExtractor
+
+extractor = StreamingRecordExtractor("NameParses")
+
+
+def test_braces_and_brackets_inside_strings_do_not_end_records():
+    records = [
+        {"Id": "1", "PresentedName": "Curly {Brace} Ltd", "Alias": ["[Square]", "}{"]},
+        {"Id": "2", "PresentedName": "Quote \" and backslash \\ Inc", "Alias": []},
+        {"Id": "3", "PresentedName": "NameParses: [ not an array", "Alias": ["]"]},
+    ]
+    response = "```json\n" + json.dumps({"Meta": {"NameParses": "decoy"}, "NameParses": records}, indent=4) + "\n```"
+
+    assert list(extractor.iter_records(response)) == records
+
+
+def test_a_record_cut_off_by_the_output_limit_keeps_the_earlier_ones():
+    records = [{"Id": str(i), "PresentedName": f"Org {i} {{Ltd}}"} for i in range(3)]
+    response = json.dumps({"NameParses": records})
+    truncated = response[:response.index('"Id": "2"') + 12]
+
+    assert list(extractor.iter_records(truncated)) == records[:2] + [None]
+
+
+def test_malformed_records_keep_their_position():
+    response = '{"NameParses": [{"Id": "0"}, "not a record", {"Id" "1"}, null, {"Id": "2"}]}'
+
+    assert list(extractor.iter_records(response)) == [{"Id": "0"}, None, None, None, {"Id": "2"}]
+
+
+def test_responses_without_the_records_key():
+    assert not extractor.found_records('{"Parses": [{"Id": "0"}]}')
+    assert list(extractor.iter_records('{"Parses": [{"Id": "0"}]}')) == []
+    assert extractor.found_records('{"NameParses": []}')
+    assert list(extractor.iter_records('{"NameParses": []}')) == []
@@ -0,0 +1,37 @@
+import random
+
+from prompt_testing.surrogate_ranker import SurrogateRanker
+
+
+def create_prompt(prompt_random: random.Random, good: bool) -> str:
+    words = ["parse", "names", "return", "json", "brands", "suffixes", "locations", "records"]
+    prompt_words = prompt_random.choices(words, k=12) + (["exactly", "verbatim"] if good else ["roughly", "summarise"])
+    prompt_random.shuffle(prompt_words)
+    return " ".join(prompt_words)
+
+
+def test_forwards_candidates_like_those_which_scored_well():
+    surrogate = SurrogateRanker(keep_fraction=0.5, exploration_fraction=0.0, min_observations=20)
+    prompt_random = random.Random(0)
+    for i in range(40):
+        good = i % 2 == 0
+        surrogate.observe(create_prompt(prompt_random, good), 0.8 if good else 0.4, entered_archive=False)
+
+    good_candidates = [create_prompt(prompt_random, True) for _ in range(10)]
+    bad_candidates = [create_prompt(prompt_random, False) for _ in range(10)]
+    selected = surrogate.select(good_candidates + bad_candidates)
+
+    assert set(selected) == set(good_candidates)
+    assert set(surrogate.pending) == set(good_candidates)
+
+
+def test_pending_candidates_are_bounded():
+    surrogate = SurrogateRanker(keep_fraction=1.0, min_observations=1, window_size=50)
+    surrogate.observe("parse the names", 0.5, entered_archive=False)
+    # Candidates which are never observed, e.g. because their evaluation failed
+    for round_index in range(20):
+        surrogate.select([f"candidate {round_index} {i}" for i in range(10)])
+
+    assert len(surrogate.pending) == 50
+    assert "candidate 19 9" in surrogate.pending
+    assert "candidate 0 0" not in surrogate.pending